@@ -16,15 +16,19 @@ import time
 import gym
 import json
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image 
 
 # Import custom modules
 import embodiedbench.envs.eb_alfred.utils as utils
 from embodiedbench.envs.eb_alfred.utils import alfred_objs, alfred_open_obj, alfred_pick_obj, alfred_slice_obj, alfred_open_obj, alfred_toggle_obj, alfred_recep
 from embodiedbench.envs.eb_alfred.thor_connector import ThorConnector
+from embodiedbench.envs.simulator_pool import SimulatorPool
+from embodiedbench.envs.log_sink import get_log_sink
 from embodiedbench.envs.eb_alfred.data.preprocess import Dataset
 from embodiedbench.envs.eb_alfred.gen import constants
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 # global information
 X_DISPLAY = '1'
@@ -35,6 +39,9 @@ ValidEvalSets = [
     'base', 'common_sense', 'complex_instruction', 'spatial', 
     'visual_appearance', 'long_horizon'
     ]
+# 'deferred' computes the dense subgoal rewards on a background worker, off the step path.
+# Only 'dense' and 'deferred' track subgoals, so only they can be used for subgoal evaluation.
+RewardTypes = ['none', 'sparse', 'dense', 'deferred']
 
 
 def get_global_action_space():
@@ -94,7 +101,11 @@ class EBAlfEnv(gym.Env):
         action_space (gym.spaces.Discrete): Discrete action space 
         language_skill_set (list): Readable action descriptions
     """
-    def __init__(self, eval_set='base', exp_name='', down_sample_ratio=1.0, selected_indexes=[], detection_box=False, resolution=500):
+    # simulator class the pool launches; the offline replay benchmark swaps in a stand-in
+    connector_cls = ThorConnector
+
+    def __init__(self, eval_set='base', exp_name='', down_sample_ratio=1.0, selected_indexes=[], detection_box=False, resolution=500,
+                 sim_pool_size=1, sim_step_timeout=300, reward_type='dense', skill_macro=False):
         """
         Initialize the AI2THOR environment.
         """
@@ -102,10 +113,19 @@ class EBAlfEnv(gym.Env):
         self.data_path = ALFRED_SPLIT_PATH
         self.reward_config_path = ALFRED_REWARD_PATH
         self.resolution = resolution
-        self.env = ThorConnector(x_display=X_DISPLAY, player_screen_height=resolution, player_screen_width=resolution)
+        assert reward_type in RewardTypes
+        self.reward_type = reward_type
+        self._reward_worker = ThreadPoolExecutor(max_workers=1) if reward_type == 'deferred' else None
+        # sim_pool_size - 1 warm spares take over if the running ThorConnector hangs or dies
+        # skill_macro: intermediate low-level steps of a skill skip rendering, only its final observation is rendered
+        self.sim_pool = SimulatorPool(
+            lambda: self.connector_cls(x_display=X_DISPLAY, player_screen_height=resolution, player_screen_width=resolution,
+                                  macro_mode=skill_macro),
+            size=sim_pool_size, step_timeout=sim_step_timeout, name='ThorConnector')
 
         # load dataset
         assert eval_set in ValidEvalSets
+        self.eval_set = eval_set
         self.down_sample_ratio = down_sample_ratio
         self.dataset = self._load_dataset(eval_set)
         if len(selected_indexes):
@@ -117,12 +137,15 @@ class EBAlfEnv(gym.Env):
         self._current_episode_num = 0
         self.selected_indexes = selected_indexes
         self._initial_episode_num = 0
+        self._eval_set_datasets = {eval_set: self.dataset}
         self._current_step = 0
         self._max_episode_steps = 30
         self._cur_invalid_actions = 0
         self._max_invalid_actions = 10
         self._episode_start_time = 0
         self.episode_log = []
+        self._episode_task = None
+        self._episode_actions = []
         
         # Task-related attributes
         self.episode_language_instruction = ''
@@ -135,6 +158,7 @@ class EBAlfEnv(gym.Env):
         # feedback verbosity, 0: concise, 1: verbose
         self.feedback_verbosity = 0
         self.log_path = 'running/eb_alfred/{}'.format(exp_name)
+        self.log_sink = get_log_sink()
 
         self.detection = detection_box # add detection in image
         self.name_to_id_dict = None
@@ -143,6 +167,10 @@ class EBAlfEnv(gym.Env):
         self.action_space = gym.spaces.Discrete(len(self.language_skill_set))
 
 
+    @property
+    def env(self):
+        return self.sim_pool.active
+
     def generate_additional_action_space(self):
         """
         Generate additional actions for receptacles with multiple instances
@@ -220,6 +248,31 @@ class EBAlfEnv(gym.Env):
             dataset = dataset[0:len(dataset):select_every]
         return dataset
 
+    def set_eval_set(self, eval_set, exp_name):
+        """Switch to another eval set while keeping the running simulator."""
+        assert eval_set in ValidEvalSets
+        if eval_set not in self._eval_set_datasets:
+            dataset = self._load_dataset(eval_set)
+            if len(self.selected_indexes):
+                dataset = [dataset[i] for i in self.selected_indexes]
+            self._eval_set_datasets[eval_set] = dataset
+        self.eval_set = eval_set
+        self.dataset = self._eval_set_datasets[eval_set]
+        self.number_of_episodes = len(self.dataset)
+        self._current_episode_num = 0
+        self._reset = False
+        self.log_path = 'running/eb_alfred/{}'.format(exp_name)
+
+    def seek_episode(self, index):
+        """Make the next reset() load episode `index` of the current eval set."""
+        assert 0 <= index < self.number_of_episodes
+        self._current_episode_num = index
+
+    def episode_scenes(self):
+        """Scene name of every episode in the current eval set, in dataset order."""
+        # ALFRED task folders end with the scene number, e.g. pick_and_place_simple-Pencil-None-Shelf-308/trial_...
+        return ['FloorPlan%s' % task['task'].split('/')[0].split('-')[-1] for task in self.dataset]
+
 
     def current_episode(self):
         """Return current episode"""
@@ -258,10 +311,12 @@ class EBAlfEnv(gym.Env):
             del traj_data['scene']['init_action']["rotateOnTeleport"]
             traj_data['scene']['init_action']["standing"] = True
         self.env.step(dict(traj_data['scene']['init_action']))
-        self.env.set_task(traj_data, model_args, reward_type='dense', max_episode_length=self._max_episode_steps)
+        self.env.set_task(traj_data, model_args, reward_type='sparse' if self.reward_type == 'none' else self.reward_type,
+                          max_episode_length=self._max_episode_steps)
         #############################
         self.generate_additional_action_space()
 
+    @tracing.traced('env.reset')
     def reset(self):
         """
         Reset the environment for a new episode.
@@ -270,7 +325,9 @@ class EBAlfEnv(gym.Env):
             observation
         """
         assert self._current_episode_num < self.number_of_episodes
-        self._reset_controller(self.dataset[self._current_episode_num])
+        self._episode_task = self.dataset[self._current_episode_num]
+        self._episode_actions = []
+        self.sim_pool.run(lambda: self._reset_controller(self._episode_task))
         self._current_step = 0
         self._cur_invalid_actions = 0
         self._current_episode_num += 1
@@ -283,6 +340,7 @@ class EBAlfEnv(gym.Env):
         return obs
 
 
+    @tracing.traced('env.step')
     def step(self, action, reasoning=''):
         """
         Execute a single environment step.
@@ -306,12 +364,11 @@ class EBAlfEnv(gym.Env):
             if (self.name_to_id_dict is not None) and lang_action_split[-1] in self.name_to_id_dict: # multiple instances
                 lang_action = ' '.join(lang_action_split[:-1] + [self.name_to_id_dict[lang_action_split[-1]]])
 
-        event = self.env.llm_skill_interact(lang_action)
+        event, reward, done = self.sim_pool.run(lambda: self._interact(lang_action), restore=self._restore_episode)
+        self._episode_actions.append(lang_action)
         if not event['success']:
             self._cur_invalid_actions += 1
         
-        ## test calculate reward
-        reward, done = self.env.get_transition_reward()
         subgoal_met = self.env.get_goal_conditions_met()
         info['task_success'] = float(self.env.get_goal_satisfied())
         info['task_progress'] = subgoal_met[0] / subgoal_met[1]
@@ -329,6 +386,7 @@ class EBAlfEnv(gym.Env):
         info['env_feedback'] = self.get_env_feedback(event)
         info['episode_elapsed_seconds'] = time.time() - self._episode_start_time
         info['last_action_success'] = float(event['success'])
+        info['skill_stats'] = self.env.last_skill_stats
         info['object_states'] = {
                                     "cooled_objects" : self.env.cooled_objects,
                                     "heated_objects" : self.env.heated_objects,
@@ -341,6 +399,29 @@ class EBAlfEnv(gym.Env):
         self.episode_log.append(info)
         return obs, reward, done, info
     
+    def _interact(self, lang_action):
+        event = self.env.llm_skill_interact(lang_action)
+        if self.reward_type == 'none':
+            return event, 0.0, self.env.task.untracked_step()
+        ## test calculate reward
+        with tracing.span('env.reward'):
+            reward, done = self.env.get_transition_reward()
+        transition = self.env.task.last_transition
+        if transition is not None:
+            self.env.task.deferred_results.append(self._reward_worker.submit(self.env.task.deferred_subgoal_reward, transition))
+        return event, reward, done
+
+    def get_deferred_reward(self):
+        """Total dense subgoal reward of the current episode held back in 'deferred' mode."""
+        return float(sum(future.result() for future in self.env.task.deferred_results))
+
+    def _restore_episode(self):
+        """Rebuild the current episode on a restarted simulator by replaying its actions."""
+        logger.info(f"Replaying {len(self._episode_actions)} actions to restore the episode...")
+        self._reset_controller(self._episode_task)
+        for lang_action in self._episode_actions:
+            self._interact(lang_action)
+
     def get_env_feedback(self, info):
         """
         Generate feedback message for the current step.
@@ -368,43 +449,38 @@ class EBAlfEnv(gym.Env):
     def seed(self, seed=None):
         self.env.random_initilize(seed)
 
+    @tracing.traced('env.save_image')
     def save_image(self, *args, **kwargs):
         """Save current agent view as a PNG image."""
         episode_idx = self._current_episode_num if not len(self.selected_indexes) else self.selected_indexes[self._current_episode_num - 1] + 1
         
         folder = self.log_path + '/images/episode_{}'.format(episode_idx)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
         img = Image.fromarray(self.env.last_event.frame)
         if self.detection:
             img = utils.draw_boxes(img, self.env.last_event.instance_detections2D, name_translation=self.id_to_name_dict)
 
         # time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         image_path = os.path.join(folder, 'episode_{}_step_{}.png'.format(episode_idx, self._current_step)) #, time_stamp))
-        img.save(image_path)
-        return image_path
+        return self.log_sink.save_image(img, image_path)
 
+    @tracing.traced('env.save_log')
     def save_episode_log(self):
-        if not os.path.exists(self.log_path):
-            os.makedirs(self.log_path)
         # time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         episode_idx = self._current_episode_num if not len(self.selected_indexes) else self.selected_indexes[self._current_episode_num - 1] + 1
         filename = 'episode_{}_step_{}.json'.format(episode_idx, self._current_step) #, time_stamp)
         if len(self.episode_log):
-            with open(os.path.join(self.log_path, filename), 'w') as f:
-                for item in self.episode_log:
-                    if 'object_states' in item:
-                        item.pop('object_states')
-                    try:
-                        json.dump(item, f, ensure_ascii=False)
-                    except:
-                        import pdb;pdb.set_trace()
-                    f.write('\n')  
+            for item in self.episode_log:
+                if 'object_states' in item:
+                    item.pop('object_states')
+            self.log_sink.write_jsonl(os.path.join(self.log_path, filename), self.episode_log)
+        self.log_sink.end_episode()
 
 
     def close(self):
         """Terminate the environment."""
-        self.env.stop()
+        if self._reward_worker is not None:
+            self._reward_worker.shutdown(wait=False)
+        self.sim_pool.close()
 
     
 
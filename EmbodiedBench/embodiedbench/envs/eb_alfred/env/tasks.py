@@ -5,11 +5,75 @@ from embodiedbench.envs.eb_alfred.gen.utils.game_util import get_objects_with_na
 from embodiedbench.envs.eb_alfred.env.reward import get_action
 
 
+class RecordedEvent(object):
+    '''
+    the parts of an ai2thor event the reward actions read, kept without the frames
+    '''
+
+    def __init__(self, event):
+        self.metadata = event.metadata
+        self.pose_discrete = event.pose_discrete
+
+
+class RecordedEnvState(object):
+    '''
+    stand-in for ThorEnv when replaying dense rewards of a deferred episode
+    '''
+
+    def __init__(self):
+        self.cleaned_objects = set()
+        self.heated_objects = set()
+        self.cooled_objects = set()
+        self.cooled_reward = False
+        self.reopen_reward = False
+
+
+class EventIndex(object):
+    '''
+    objects of one event that match the (name, prop) queries of a task, gathered in a
+    single pass with the same test as get_objects_with_name_and_prop
+    '''
+
+    def __init__(self, metadata, queries):
+        self.metadata = metadata
+        self.groups = {query: [] for query in queries}
+        for obj in metadata['objects']:
+            object_id = obj['objectId']
+            for (name, prop), group in self.groups.items():
+                if name in object_id and obj[prop]:
+                    group.append(obj)
+
+    def get(self, name, prop):
+        return self.groups[(name, prop)]
+
+
+def object_ids(objs):
+    return set(obj['objectId'] for obj in objs)
+
+
+def receptacle_contents(receptacles):
+    '''
+    ids of everything inside any of the receptacles
+    '''
+    contents = set()
+    for r in receptacles:
+        if r['receptacleObjectIds'] is not None:
+            contents.update(r['receptacleObjectIds'])
+    return contents
+
+
+def num_sliced(objs):
+    return sum(1 for obj in objs if 'Sliced' in obj['objectId'])
+
+
 class BaseTask(object):
     '''
     base class for tasks
     '''
 
+    # (target, prop) pairs read by indexed_goal_conditions_met
+    goal_queries = ()
+
     def __init__(self, traj, env, args, reward_type='sparse', max_episode_length=2000):
         # settings
         self.traj = traj
@@ -26,9 +90,18 @@ class BaseTask(object):
         self.goal_idx = 0
         self.finished = -1
 
-        # load navigation graph
+        # load navigation graph, only the dense subgoal rewards need it
         self.gt_graph = None
-        self.load_nav_graph()
+        if "dense" in self.reward_type:
+            self.load_nav_graph()
+
+        # 'deferred' records the transitions and leaves the dense subgoal rewards to deferred_subgoal_reward;
+        # the owner of the worker appends the futures of those calls to deferred_results
+        self.deferred = reward_type == 'deferred'
+        self._deferred_goal_idx = 0
+        self.deferred_results = []
+        self._deferred_env = RecordedEnvState()
+        self.last_transition = None
 
         # reward config
         self.reward_config = None
@@ -38,6 +111,10 @@ class BaseTask(object):
         # prev state
         self.prev_state = self.env.last_event
 
+        # goal conditions of the last evaluated event
+        self._targets = None
+        self._goal_cache = None
+
     def load_reward_config(self, config_file):
         '''
         load json file with reward values
@@ -72,11 +149,35 @@ class BaseTask(object):
         '''
         raise NotImplementedError
 
+    def goal_conditions_met(self, state):
+        '''
+        (satisfied, total) goal conditions, memoized for the last event since a step
+        evaluates them several times on the same event
+        '''
+        env_key = (len(self.env.heated_objects), len(self.env.cooled_objects), len(self.env.cleaned_objects))
+        if self._goal_cache is not None and self._goal_cache[0] is state and self._goal_cache[1] == env_key:
+            return self._goal_cache[2]
+        targets = self.get_targets()
+        queries = [(targets[target], prop) for target, prop in self.goal_queries]
+        pcs = self.indexed_goal_conditions_met(EventIndex(state.metadata, queries), targets)
+        self._goal_cache = (state, env_key, pcs)
+        return pcs
+
+    def indexed_goal_conditions_met(self, index, targets):
+        raise NotImplementedError
+
+    def scan_goal_conditions_met(self, state):
+        '''
+        reference implementation that rescans the metadata, kept to check the indexed path against
+        '''
+        raise NotImplementedError
+
     def transition_reward(self, state):
         '''
         immediate reward given the current state
         '''
         reward = 0
+        self.last_transition = None
 
         # goal completed
         if self.goal_finished:
@@ -96,6 +197,8 @@ class BaseTask(object):
                 self.finished += 1
                 if self.goal_idx + 1 < self.num_subgoals:
                     self.goal_idx += 1
+        elif self.deferred:
+            self.last_transition = self.record_transition(state)
 
         # end task reward
         goal_finished = self.goal_satisfied(state)
@@ -123,6 +226,43 @@ class BaseTask(object):
         done = self.goal_idx >= self.num_subgoals or self.step_num >= self.max_episode_length
         return reward, done
 
+    def untracked_step(self):
+        '''
+        step bookkeeping of transition_reward without computing any reward, for reward_type 'none'
+        '''
+        self.prev_state = self.env.last_event
+        self.step_num += 1
+        return self.goal_idx >= self.num_subgoals or self.step_num >= self.max_episode_length
+
+    def record_transition(self, state):
+        '''
+        snapshot of everything the dense subgoal reward of a transition reads
+        '''
+        return (RecordedEvent(state), RecordedEvent(self.prev_state),
+                (set(self.env.cleaned_objects), set(self.env.heated_objects), set(self.env.cooled_objects)))
+
+    def deferred_subgoal_reward(self, transition):
+        '''
+        dense subgoal reward of a recorded transition, the same value transition_reward
+        adds in dense mode. Transitions must be passed in step order.
+        '''
+        if self.gt_graph is None:
+            self.load_nav_graph()
+        state, prev_state, (cleaned, heated, cooled) = transition
+        env = self._deferred_env
+        env.cleaned_objects, env.heated_objects, env.cooled_objects = cleaned, heated, cooled
+
+        expert_plan = self.traj['plan']['high_pddl']
+        action_type = expert_plan[self._deferred_goal_idx]['planner_action']['action']
+        action = get_action(action_type, self.gt_graph, env, self.reward_config, self.strict)
+        sg_reward, sg_done = action.get_reward(state, prev_state, expert_plan, self._deferred_goal_idx)
+        if sg_done:
+            self.finished += 1
+            if self._deferred_goal_idx + 1 < self.num_subgoals:
+                self._deferred_goal_idx += 1
+                self.goal_idx = self._deferred_goal_idx
+        return sg_reward
+
     def reset(self):
         '''
         Reset internal states
@@ -133,6 +273,13 @@ class BaseTask(object):
         self.goal_finished = False
 
     def get_subgoal_idx(self):
+        '''
+        index of the last finished subgoal. Subgoals are only tracked by the dense rewards: 'dense' and
+        'deferred' support subgoal evaluation, 'sparse' and 'none' stay at -1. In 'deferred' mode this
+        waits until the worker has processed every step taken so far.
+        '''
+        for future in self.deferred_results:
+            future.result()
         return self.finished
 
     def get_target(self, var):
@@ -145,6 +292,8 @@ class BaseTask(object):
         '''
         returns a dictionary of all targets for the task
         '''
+        if self._targets is not None:
+            return dict(self._targets)
         targets = {
             'object': self.get_target('object_target'),
             'parent': self.get_target('parent_target'),
@@ -156,7 +305,8 @@ class BaseTask(object):
         if 'object_sliced' in self.traj['pddl_params'] and self.traj['pddl_params']['object_sliced']:
             targets['object'] += 'Sliced'  # Change, e.g., "Apple" -> "AppleSliced" as pickup target.
 
-        return targets
+        self._targets = targets
+        return dict(targets)
 
 
 class PickAndPlaceSimpleTask(BaseTask):
@@ -164,6 +314,8 @@ class PickAndPlaceSimpleTask(BaseTask):
     pick_and_place task
     '''
 
+    goal_queries = (('parent', 'receptacle'), ('object', 'pickupable'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -172,7 +324,24 @@ class PickAndPlaceSimpleTask(BaseTask):
         pcs = self.goal_conditions_met(state)
         return pcs[0] == pcs[1]
 
-    def goal_conditions_met(self, state):
+    def indexed_goal_conditions_met(self, index, targets):
+        ts = 1
+        s = 0
+
+        receptacles = index.get(targets['parent'], 'receptacle')
+        pickupables = index.get(targets['object'], 'pickupable')
+
+        if 'Sliced' in targets['object']:
+            ts += 1
+            if num_sliced(pickupables) >= 1:
+                s += 1
+
+        if object_ids(pickupables) & receptacle_contents(receptacles):
+            s += 1
+
+        return s, ts
+
+    def scan_goal_conditions_met(self, state):
         ts = 1
         s = 0
 
@@ -202,6 +371,8 @@ class PickTwoObjAndPlaceTask(BaseTask):
     pick_two_obj_and_place task
     '''
 
+    goal_queries = (('parent', 'receptacle'), ('object', 'pickupable'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -210,7 +381,24 @@ class PickTwoObjAndPlaceTask(BaseTask):
         pcs = self.goal_conditions_met(state)
         return pcs[0] == pcs[1]
 
-    def goal_conditions_met(self, state):
+    def indexed_goal_conditions_met(self, index, targets):
+        ts = 2
+        s = 0
+
+        receptacles = index.get(targets['parent'], 'receptacle')
+        pickupables = index.get(targets['object'], 'pickupable')
+
+        if 'Sliced' in targets['object']:
+            ts += 2
+            s += min(num_sliced(pickupables), 2)
+
+        # max raises on an empty list just like np.max in the scan path
+        pickup_ids = object_ids(pickupables)
+        s += min(max([len(pickup_ids.intersection(r['receptacleObjectIds'])) if r['receptacleObjectIds'] is not None else 0
+                      for r in receptacles]), 2)
+        return s, ts
+
+    def scan_goal_conditions_met(self, state):
         ts = 2
         s = 0
 
@@ -239,6 +427,8 @@ class LookAtObjInLightTask(BaseTask):
     look_at_obj_in_light task
     '''
 
+    goal_queries = (('toggle', 'toggleable'), ('object', 'pickupable'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -247,7 +437,27 @@ class LookAtObjInLightTask(BaseTask):
         pcs = self.goal_conditions_met(state)
         return pcs[0] == pcs[1]
 
-    def goal_conditions_met(self, state):
+    def indexed_goal_conditions_met(self, index, targets):
+        ts = 2
+        s = 0
+
+        toggleables = index.get(targets['toggle'], 'toggleable')
+        pickupables = index.get(targets['object'], 'pickupable')
+        inventory_objects = index.metadata['inventoryObjects']
+
+        if 'Sliced' in targets['object']:
+            ts += 1
+            if num_sliced(pickupables) >= 1:
+                s += 1
+
+        if len(inventory_objects) > 0 and inventory_objects[0]['objectId'] in object_ids(pickupables):
+            s += 1
+        if any(t['isToggled'] and t['visible'] for t in toggleables):
+            s += 1
+
+        return s, ts
+
+    def scan_goal_conditions_met(self, state):
         ts = 2
         s = 0
 
@@ -280,6 +490,8 @@ class PickHeatThenPlaceInRecepTask(BaseTask):
     pick_heat_then_place_in_recep task
     '''
 
+    goal_queries = (('parent', 'receptacle'), ('object', 'pickupable'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -288,7 +500,32 @@ class PickHeatThenPlaceInRecepTask(BaseTask):
         pcs = self.goal_conditions_met(state)
         return pcs[0] == pcs[1]
 
-    def goal_conditions_met(self, state):
+    def indexed_goal_conditions_met(self, index, targets):
+        ts = 3
+        s = 0
+
+        receptacles = index.get(targets['parent'], 'receptacle')
+        pickupables = index.get(targets['object'], 'pickupable')
+
+        if 'Sliced' in targets['object']:
+            ts += 1
+            if num_sliced(pickupables) >= 1:
+                s += 1
+
+        pickup_ids = object_ids(pickupables)
+        objs_in_place = pickup_ids & receptacle_contents(receptacles)
+        objs_changed = pickup_ids & self.env.heated_objects
+
+        if len(objs_in_place) > 0:
+            s += 1
+        if len(objs_changed) > 0:
+            s += 1
+        if objs_in_place & objs_changed:
+            s += 1
+
+        return s, ts
+
+    def scan_goal_conditions_met(self, state):
         ts = 3
         s = 0
 
@@ -327,6 +564,8 @@ class PickCoolThenPlaceInRecepTask(BaseTask):
     pick_cool_then_place_in_recep task
     '''
 
+    goal_queries = (('parent', 'receptacle'), ('object', 'pickupable'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -335,7 +574,32 @@ class PickCoolThenPlaceInRecepTask(BaseTask):
         pcs = self.goal_conditions_met(state)
         return pcs[0] == pcs[1]
 
-    def goal_conditions_met(self, state):
+    def indexed_goal_conditions_met(self, index, targets):
+        ts = 3
+        s = 0
+
+        receptacles = index.get(targets['parent'], 'receptacle')
+        pickupables = index.get(targets['object'], 'pickupable')
+
+        if 'Sliced' in targets['object']:
+            ts += 1
+            if num_sliced(pickupables) >= 1:
+                s += 1
+
+        pickup_ids = object_ids(pickupables)
+        objs_in_place = pickup_ids & receptacle_contents(receptacles)
+        objs_changed = pickup_ids & self.env.cooled_objects
+
+        if len(objs_in_place) > 0:
+            s += 1
+        if len(objs_changed) > 0:
+            s += 1
+        if objs_in_place & objs_changed:
+            s += 1
+
+        return s, ts
+
+    def scan_goal_conditions_met(self, state):
         ts = 3
         s = 0
 
@@ -373,6 +637,8 @@ class PickCleanThenPlaceInRecepTask(BaseTask):
     pick_clean_then_place_in_recep task
     '''
 
+    goal_queries = (('parent', 'receptacle'), ('object', 'pickupable'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -381,7 +647,32 @@ class PickCleanThenPlaceInRecepTask(BaseTask):
         pcs = self.goal_conditions_met(state)
         return pcs[0] == pcs[1]
 
-    def goal_conditions_met(self, state):
+    def indexed_goal_conditions_met(self, index, targets):
+        ts = 3
+        s = 0
+
+        receptacles = index.get(targets['parent'], 'receptacle')
+        pickupables = index.get(targets['object'], 'pickupable')
+
+        if 'Sliced' in targets['object']:
+            ts += 1
+            if num_sliced(pickupables) >= 1:
+                s += 1
+
+        pickup_ids = object_ids(pickupables)
+        objs_in_place = pickup_ids & receptacle_contents(receptacles)
+        objs_changed = pickup_ids & self.env.cleaned_objects
+
+        if len(objs_in_place) > 0:
+            s += 1
+        if len(objs_changed) > 0:
+            s += 1
+        if objs_in_place & objs_changed:
+            s += 1
+
+        return s, ts
+
+    def scan_goal_conditions_met(self, state):
         ts = 3
         s = 0
 
@@ -419,6 +710,8 @@ class PickAndPlaceWithMovableRecepTask(BaseTask):
     pick_and_place_with_movable_recep task
     '''
 
+    goal_queries = (('parent', 'receptacle'), ('object', 'pickupable'), ('mrecep', 'pickupable'))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -427,7 +720,36 @@ class PickAndPlaceWithMovableRecepTask(BaseTask):
         pcs = self.goal_conditions_met(state)
         return pcs[0] == pcs[1]
 
-    def goal_conditions_met(self, state):
+    def indexed_goal_conditions_met(self, index, targets):
+        ts = 3
+        s = 0
+
+        receptacles = index.get(targets['parent'], 'receptacle')
+        pickupables = index.get(targets['object'], 'pickupable')
+        movables = index.get(targets['mrecep'], 'pickupable')
+
+        if 'Sliced' in targets['object']:
+            ts += 1
+            if num_sliced(pickupables) >= 1:
+                s += 1
+
+        pickup_ids = object_ids(pickupables)
+        movable_ids = object_ids(movables)
+        recep_ids = object_ids(receptacles)
+        # the object is in the movable receptacle
+        if object_ids([p for p in pickupables if 'receptacleObjectIds' in p]) & receptacle_contents(movables):
+            s += 1
+        # the movable receptacle is in the final receptacle
+        if movable_ids & receptacle_contents([r for r in receptacles if 'receptacleObjectIds' in r]):
+            s += 1
+        # the whole stack is in the final receptacle
+        if any(pickup_ids.intersection(m['receptacleObjectIds']) and recep_ids.intersection(m['parentReceptacles'])
+               for m in movables if m['parentReceptacles'] is not None and m['receptacleObjectIds'] is not None):
+            s += 1
+
+        return s, ts
+
+    def scan_goal_conditions_met(self, state):
         ts = 3
         s = 0
 
@@ -1,4 +1,4 @@
-import os, math, re
+import os, math, re, time
 import textwrap
 
 import numpy as np
@@ -10,18 +10,31 @@ from embodiedbench.envs.eb_alfred.env.thor_env import ThorEnv
 from embodiedbench.envs.eb_alfred.gen import constants
 from embodiedbench.envs.eb_alfred.gen.utils.game_util import get_objects_with_name_and_prop
 from embodiedbench.envs.eb_alfred.utils import natural_word_to_ithor_name
+from embodiedbench import tracing
 
 
 log = logging.getLogger(__name__)
 
 log.setLevel(level=logging.ERROR)
 
+SKILLS = ['find', 'pick up', 'put down', 'open', 'close', 'turn on', 'turn off', 'slice', 'drop']
+# skills that issue several low-level steps; in macro mode only their final observation is rendered
+MACRO_SKILLS = ['find', 'put down', 'open']
+SUPPRESSED_RENDER_SETTINGS = {'renderImage': False,
+                              'renderDepthImage': False,
+                              'renderClassImage': False,
+                              'renderObjectImage': False,
+                              }
+# outcome of the last real step, carried over to the event of the final render
+OUTCOME_METADATA_KEYS = ['lastAction', 'lastActionSuccess', 'errorMessage', 'actionReturn']
+
 class ThorConnector(ThorEnv):
     def __init__(self, x_display=constants.X_DISPLAY,
                  player_screen_height=constants.DETECTION_SCREEN_HEIGHT,
                  player_screen_width=constants.DETECTION_SCREEN_WIDTH,
                  quality='MediumCloseFitShadows',
-                 build_path=constants.BUILD_PATH):
+                 build_path=constants.BUILD_PATH,
+                 macro_mode=False):
         super().__init__(x_display, player_screen_height, player_screen_width, quality, build_path)
         self.font = ImageFont.truetype("/usr/share/fonts/truetype/ubuntu/UbuntuMono-B.ttf", 24)
         self.agent_height = 0.9
@@ -30,12 +43,20 @@ class ThorConnector(ThorEnv):
         self.sliced = False
         self.task = None
         self.put_count_dict = {}
+        self.macro_mode = macro_mode
+        self._skill_stats = None
+        self.last_skill_stats = None
+        self.skill_counters = {}
+        # (scene, object id, object pose) -> teleport pose that reached the object, kept across episodes
+        self.teleport_pose_cache = {}
+        self.teleport_candidates = {}
 
     def restore_scene(self, object_poses, object_toggles, dirty_and_empty):
         # print(object_poses)
         super().restore_scene(object_poses, object_toggles, dirty_and_empty)
         self.reachable_positions, self.reachable_position_kdtree = self.get_reachable_positions()
         self.cur_receptacle = None
+        self.teleport_candidates = {}
 
     def get_reachable_positions(self):
         free_positions = super().step(dict(action="GetReachablePositions")).metadata["actionReturn"]
@@ -69,7 +90,92 @@ class ThorConnector(ThorEnv):
         selected = i[nth - 1]
         return self.reachable_positions[selected]
 
+    def step(self, action, smooth_nav=False):
+        '''
+        low-level step. inside a skill it is counted, and in macro mode it skips rendering
+        '''
+        with tracing.span('sim.step'):
+            return self._step(action, smooth_nav)
+
+    def _step(self, action, smooth_nav):
+        stats = self._skill_stats
+        if stats is None:
+            return super().step(action, smooth_nav)
+        if type(action) == str:
+            action = {'action': action}
+
+        start = time.time()
+        if not stats['suppress_render']:
+            event = super().step(action, smooth_nav)
+        elif "LookUp" in action['action'] or "LookDown" in action['action']:
+            # ThorEnv.step turns looks into a TeleportFull with the default render settings
+            angle = -constants.AGENT_HORIZON_ADJ if "LookUp" in action['action'] else constants.AGENT_HORIZON_ADJ
+            self.look_angle(angle, render_settings=SUPPRESSED_RENDER_SETTINGS)
+            event = self.update_states(action)
+            self.check_post_conditions(action)
+        else:
+            action = dict(action, tempRenderChange=True, renderNormalsImage=False, **SUPPRESSED_RENDER_SETTINGS)
+            event = super().step(action, smooth_nav)
+        stats['unity_seconds'] += time.time() - start
+        stats['low_level_steps'] += 1
+        return event
+
+    def _begin_skill(self, instruction):
+        skill = next((s for s in SKILLS if instruction.startswith(s)), instruction)
+        self._skill_stats = {
+            'skill': skill,
+            'low_level_steps': 0,
+            'unity_seconds': 0.0,
+            'suppress_render': self.macro_mode and skill in MACRO_SKILLS,
+        }
+
+    def _end_skill(self):
+        stats, self._skill_stats = self._skill_stats, None
+        if stats.pop('suppress_render') and stats['low_level_steps'] > 0:
+            # render the final observation once
+            metadata = self.last_event.metadata
+            start = time.time()
+            self.noop()
+            stats['unity_seconds'] += time.time() - start
+            for key in OUTCOME_METADATA_KEYS:
+                if key in metadata:
+                    self.last_event.metadata[key] = metadata[key]
+            stats['rendered_steps'] = 1
+        else:
+            stats['rendered_steps'] = stats['low_level_steps']
+        stats['unity_seconds'] = round(stats['unity_seconds'], 4)
+        self.last_skill_stats = stats
+
+        counter = self.skill_counters.setdefault(stats['skill'], {'calls': 0, 'low_level_steps': 0, 'rendered_steps': 0, 'unity_seconds': 0.0})
+        counter['calls'] += 1
+        counter['low_level_steps'] += stats['low_level_steps']
+        counter['rendered_steps'] += stats['rendered_steps']
+        counter['unity_seconds'] = round(counter['unity_seconds'] + stats['unity_seconds'], 4)
+
     def llm_skill_interact(self, instruction: str):
+        with tracing.span('sim.skill', instruction=instruction):
+            self._begin_skill(instruction)
+            try:
+                ret = self._run_skill(instruction)
+            finally:
+                self._end_skill()
+
+        if not self.last_event.metadata['lastActionSuccess']:
+            log.warning(f"llm_skill_interact failed")
+            log.warning(f"errorMessage: {self.last_event.metadata['errorMessage']}")
+            log.warning(f"returned msg: {ret}")
+        else:
+            log.info(f"Last action succeeded")
+
+        ret_dict = {
+            'action': instruction,
+            'success': len(ret) <= 0,
+            'message': ret
+        }
+
+        return ret_dict
+
+    def _run_skill(self, instruction):
         if instruction.startswith("put down ") or instruction.startswith("open "):
             pass
         else:
@@ -128,21 +234,7 @@ class ThorConnector(ThorEnv):
             ret = self.drop()
         else:
             assert False, 'instruction not supported'
-
-        if not self.last_event.metadata['lastActionSuccess']:
-            log.warning(f"llm_skill_interact failed")
-            log.warning(f"errorMessage: {self.last_event.metadata['errorMessage']}")
-            log.warning(f"returned msg: {ret}")
-        else:
-            log.info(f"Last action succeeded")
-
-        ret_dict = {
-            'action': instruction,
-            'success': len(ret) <= 0,
-            'message': ret
-        }
-
-        return ret_dict
+        return ret
 
     def get_object_prop(self, name, prop, metadata):
         for obj in metadata['objects']:
@@ -183,60 +275,28 @@ class ThorConnector(ThorEnv):
         if obj_idx == -1:
             ret_msg = f'Cannot find {target_obj}. This object may not exist in this scene. Try to explore other instances instead.'
         else:
-            # teleport sometimes fails even with reachable positions. if fails, repeat with the next closest reachable positions.
-            max_attempts = 20
-            teleport_success = False
-
-            # get obj location
-            loc = objects[obj_idx]['position']
-            obj_rot = objects[obj_idx]['rotation']['y']
-
             # # do not move if the object is already visible and close
             # if objects[obj_idx]['visible'] and objects[obj_idx]['distance'] < 1.0:
             #     log.info('Object is already visible')
             #     max_attempts = 0
             #     teleport_success = True
 
-            # try teleporting
-            reachable_pos_idx = 0
-            for i in range(max_attempts):
-                reachable_pos_idx += 1
-                if i == 10 and (target_obj == 'Fridge' or target_obj == 'Microwave'):
-                    reachable_pos_idx -= 10
-
-                closest_loc = self.find_close_reachable_position([loc['x'], loc['y'], loc['z']], reachable_pos_idx)
-                # calculate desired rotation angle (see https://github.com/allenai/ai2thor/issues/806)
-                rot_angle = math.atan2(-(loc['x'] - closest_loc[0]), loc['z'] - closest_loc[2])
-                if rot_angle > 0:
-                    rot_angle -= 2 * math.pi
-                rot_angle = -(180 / math.pi) * rot_angle  # in degrees
-
-                if i < 10 and (target_obj == 'Fridge' or target_obj == 'Microwave'):  # not always correct, but better than nothing
-                    angle_diff = abs(self.angle_diff(rot_angle, obj_rot))
-                    if target_obj == 'Fridge' and \
-                            not ((90 - 20 < angle_diff < 90 + 20) or (270 - 20 < angle_diff < 270 + 20)):
-                        continue
-                    if target_obj == 'Microwave' and \
-                            not ((180 - 20 < angle_diff < 180 + 20) or (0 - 20 < angle_diff < 0 + 20)):
-                        continue
-
-                # calculate desired horizon angle
-                camera_height = self.agent_height + constants.CAMERA_HEIGHT_OFFSET
-                xz_dist = math.hypot(loc['x'] - closest_loc[0], loc['z'] - closest_loc[2])
-                hor_angle = math.atan2((loc['y'] - camera_height), xz_dist)
-                hor_angle = (180 / math.pi) * hor_angle  # in degrees
-                hor_angle *= 0.9  # adjust angle for better view
-                # hor_angle = -30
-                # hor_angle = 0
-
+            # teleport sometimes fails even with reachable positions. if fails, repeat with the next closest reachable positions.
+            # the pose that worked last time for this object (in this scene and at this pose) is tried first
+            cache_key = (self.last_event.metadata.get('sceneName'), obj_id, self.object_pose_key(objects[obj_idx]))
+            teleport_success = False
+            for pose in self.get_teleport_candidates(cache_key, target_obj, objects[obj_idx]):
                 # teleport ### Full
-                super().step(dict(action="TeleportFull", x=closest_loc[0], y=self.agent_height, z=closest_loc[2], rotation=rot_angle, horizon=-hor_angle))
+                self.step(dict(action="TeleportFull", x=pose[0], y=self.agent_height, z=pose[2], rotation=pose[3], horizon=pose[4]))
 
                 if not self.last_event.metadata['lastActionSuccess']:
                     log.warning(
                         f"TeleportFull action failed: {self.last_event.metadata['errorMessage']}, trying again...")
+                    if self.teleport_pose_cache.get(cache_key) == pose:
+                        del self.teleport_pose_cache[cache_key]
                 else:
                     teleport_success = True
+                    self.teleport_pose_cache[cache_key] = pose
                     break
 
             if not teleport_success:
@@ -244,6 +304,71 @@ class ThorConnector(ThorEnv):
 
         return ret_msg
 
+    @staticmethod
+    def object_pose_key(obj):
+        pos, rot = obj['position'], obj['rotation']
+        return tuple(round(v, 3) for v in (pos['x'], pos['y'], pos['z'], rot['x'], rot['y'], rot['z']))
+
+    def get_teleport_candidates(self, cache_key, target_obj, obj):
+        '''
+        teleport poses (x, y, z, rotation, horizon) to try for an object, best first.
+        the ranked list is built once per object and episode, the cached successful pose goes first
+        '''
+        candidates = self.teleport_candidates.get(cache_key)
+        if candidates is None:
+            candidates = self.rank_teleport_candidates(target_obj, obj['position'], obj['rotation']['y'])
+            self.teleport_candidates[cache_key] = candidates
+
+        cached = self.teleport_pose_cache.get(cache_key)
+        if cached is not None:
+            # reachable positions depend on the episode's object layout, so the cached pose must still be one of them
+            d, _ = self.reachable_position_kdtree.query(cached[:3])
+            if d < 1e-3:
+                return [cached] + [pose for pose in candidates if pose != cached]
+            del self.teleport_pose_cache[cache_key]
+        return candidates
+
+    def rank_teleport_candidates(self, target_obj, loc, obj_rot, max_attempts=20):
+        n_positions = len(self.reachable_positions)
+        _, indices = self.reachable_position_kdtree.query([loc['x'], loc['y'], loc['z']], k=max_attempts)
+        if target_obj == 'Fridge' or target_obj == 'Microwave':
+            # the ten closest positions facing the door first, then the ten closest ones regardless of the angle
+            order = [(i, True) for i in range(10)] + [(i, False) for i in range(10)]
+        else:
+            order = [(i, False) for i in range(max_attempts)]
+
+        candidates = []
+        for i, check_angle in order:
+            if indices[i] >= n_positions:  # fewer reachable positions than attempts
+                continue
+            closest_loc = self.reachable_positions[indices[i]]
+            # calculate desired rotation angle (see https://github.com/allenai/ai2thor/issues/806)
+            rot_angle = math.atan2(-(loc['x'] - closest_loc[0]), loc['z'] - closest_loc[2])
+            if rot_angle > 0:
+                rot_angle -= 2 * math.pi
+            rot_angle = -(180 / math.pi) * rot_angle  # in degrees
+
+            if check_angle:  # not always correct, but better than nothing
+                angle_diff = abs(self.angle_diff(rot_angle, obj_rot))
+                if target_obj == 'Fridge' and \
+                        not ((90 - 20 < angle_diff < 90 + 20) or (270 - 20 < angle_diff < 270 + 20)):
+                    continue
+                if target_obj == 'Microwave' and \
+                        not ((180 - 20 < angle_diff < 180 + 20) or (0 - 20 < angle_diff < 0 + 20)):
+                    continue
+
+            # calculate desired horizon angle
+            camera_height = self.agent_height + constants.CAMERA_HEIGHT_OFFSET
+            xz_dist = math.hypot(loc['x'] - closest_loc[0], loc['z'] - closest_loc[2])
+            hor_angle = math.atan2((loc['y'] - camera_height), xz_dist)
+            hor_angle = (180 / math.pi) * hor_angle  # in degrees
+            hor_angle *= 0.9  # adjust angle for better view
+
+            pose = (float(closest_loc[0]), float(closest_loc[1]), float(closest_loc[2]), rot_angle, -hor_angle)
+            if pose not in candidates:  # a failed pose is not retried
+                candidates.append(pose)
+        return candidates
+
     def get_obj_id_from_name(self, obj_name, only_pickupable=False, only_toggleable=False, priority_sliced=False, get_inherited=False,
                              parent_receptacle_penalty=True, priority_in_visibility=False, exclude_obj_id=None):
         obj_id = None
@@ -309,13 +434,13 @@ class ThorConnector(ThorEnv):
                 ret_msg = f'{obj_name} is not visible because it is in {recep_name}. Note: multiple instances of {recep_name} may exist'
 
                 # try anyway
-                super().step(dict(
+                self.step(dict(
                     action="PickupObject",
                     objectId=obj_id,
                     forceAction=False
                 ))
             else:
-                super().step(dict(
+                self.step(dict(
                     action="PickupObject",
                     objectId=obj_id,
                     forceAction=False
@@ -382,33 +507,33 @@ class ThorConnector(ThorEnv):
 
                     # look up (put action fails when a receptacle is not visible)
                     if j == 1:
-                        super().step(dict(action="LookUp"))
-                        super().step(dict(action="LookUp"))
+                        self.step(dict(action="LookUp"))
+                        self.step(dict(action="LookUp"))
                     elif j == 2:
-                        super().step(dict(action="LookDown"))
-                        super().step(dict(action="LookDown"))
-                        super().step(dict(action="LookDown"))
-                        super().step(dict(action="LookDown"))
+                        self.step(dict(action="LookDown"))
+                        self.step(dict(action="LookDown"))
+                        self.step(dict(action="LookDown"))
+                        self.step(dict(action="LookDown"))
                     elif j == 3:
-                        super().step(dict(action="LookUp"))
-                        super().step(dict(action="LookUp"))
-                        super().step(dict(action="MoveBack"))
+                        self.step(dict(action="LookUp"))
+                        self.step(dict(action="LookUp"))
+                        self.step(dict(action="MoveBack"))
                     elif j == 4:
-                        super().step(dict(action="MoveAhead"))
+                        self.step(dict(action="MoveAhead"))
                         for r in range(4):
-                            super().step(dict(action="MoveRight"))
+                            self.step(dict(action="MoveRight"))
                     elif j == 5:
                         for r in range(8):
-                            super().step(dict(action="MoveLeft"))
+                            self.step(dict(action="MoveLeft"))
                     elif j == 6:
                         for r in range(4):
-                            super().step(dict(action="MoveRight"))
-                        super().step(dict(  # this somehow make putobject success in some cases
+                            self.step(dict(action="MoveRight"))
+                        self.step(dict(  # this somehow make putobject success in some cases
                             action="RotateHand",
                             x=40
                         ))
 
-                    super().step(dict(action="PutObject",objectId=holding_obj_id, receptacleObjectId=recep_id, forceAction=True))
+                    self.step(dict(action="PutObject",objectId=holding_obj_id, receptacleObjectId=recep_id, forceAction=True))
                     last_recep_id = recep_id
 
                     if not self.last_event.metadata['lastActionSuccess']:
@@ -428,7 +553,7 @@ class ThorConnector(ThorEnv):
     def drop(self):
         log.info(f'drop')
         ret_msg = ''
-        super().step(dict(
+        self.step(dict(
             action="DropHandObject",
             forceAction=True
         ))
@@ -465,7 +590,7 @@ class ThorConnector(ThorEnv):
                     break
 
             for i in range(4):
-                super().step(dict(
+                self.step(dict(
                     action="OpenObject",
                     objectId=obj_id,
                 ))
@@ -480,13 +605,13 @@ class ThorConnector(ThorEnv):
 
                     # move around to avoid self-collision
                     if i == 0:
-                        super().step(dict(action="MoveBack"))
+                        self.step(dict(action="MoveBack"))
                     elif i == 1:
-                        super().step(dict(action="MoveBack"))
-                        super().step(dict(action="MoveRight"))
+                        self.step(dict(action="MoveBack"))
+                        self.step(dict(action="MoveRight"))
                     elif i == 2:
-                        super().step(dict(action="MoveLeft"))
-                        super().step(dict(action="MoveLeft"))
+                        self.step(dict(action="MoveLeft"))
+                        self.step(dict(action="MoveLeft"))
                 else:
                     ret_msg = ''
                     break
@@ -505,7 +630,7 @@ class ThorConnector(ThorEnv):
         if obj_id is None:
             ret_msg = f'Cannot find {obj_name} to close'
         else:
-            super().step(dict(
+            self.step(dict(
                 action="CloseObject",
                 objectId=obj_id,
             ))
@@ -528,7 +653,7 @@ class ThorConnector(ThorEnv):
             ret_msg = f'Cannot find {obj_name} to turn on'
         else:
             try:
-                super().step(dict(
+                self.step(dict(
                     action="ToggleObjectOn",
                     objectId=obj_id,
                 ))
@@ -547,7 +672,7 @@ class ThorConnector(ThorEnv):
         if obj_id is None:
             ret_msg = f'Cannot find {obj_name} to turn off'
         else:
-            super().step(dict(
+            self.step(dict(
                 action="ToggleObjectOff",
                 objectId=obj_id,
             ))
@@ -564,7 +689,7 @@ class ThorConnector(ThorEnv):
         if obj_id is None:
             ret_msg = f'Cannot find {obj_name} to slice'
         else:
-            super().step(dict(
+            self.step(dict(
                 action="SliceObject",
                 objectId=obj_id,
             ))
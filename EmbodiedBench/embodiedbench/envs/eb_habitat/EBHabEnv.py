@@ -33,7 +33,9 @@ import embodiedbench.envs.eb_habitat.predicate_task
 import embodiedbench.envs.eb_habitat.config
 import embodiedbench.envs.eb_habitat.measures
 from embodiedbench.envs.eb_habitat.utils import observations_to_image, merge_to_file, draw_text
+from embodiedbench.envs.log_sink import get_log_sink
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 HABITAT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config/task/language_rearrangement.yaml')
 
@@ -108,6 +110,14 @@ def transform_action_to_natural_language(skill_set):
 
 
 
+def write_video(video_path, frames, fps=30):
+    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+    video_writer = imageio.get_writer(video_path, fps=fps)
+    for data in frames:
+        video_writer.append_data(data)
+    video_writer.close()
+
+
 class EBHabEnv(gym.Env):
     def __init__(self, eval_set='train', exp_name='', down_sample_ratio=1.0, start_epi_index=0, resolution=500, recording=False):
         """
@@ -119,6 +129,7 @@ class EBHabEnv(gym.Env):
         _add_sim_sensor_to_config(self.config, ThirdRGBSensorConfig())
         # set the dataset
         assert eval_set in ValidEvalSets
+        self.eval_set = eval_set
         OmegaConf.set_readonly(self.config, False)
         self.config.habitat.dataset.data_path = os.path.join(os.path.dirname(__file__), 'datasets/{}.pickle'.format(eval_set))
         self.config.habitat.simulator.agents.main_agent.sim_sensors.head_rgb_sensor.height = resolution
@@ -137,6 +148,7 @@ class EBHabEnv(gym.Env):
         # Episode tracking
         self.down_sample_ratio = down_sample_ratio
         self.number_of_episodes = self.env.number_of_episodes * down_sample_ratio
+        self._eval_set_episodes = {eval_set: list(self.dataset.episodes)}
         self._reset = False
         self._current_episode_num = 0 
         while start_epi_index >= 1 and self._current_episode_num < start_epi_index:
@@ -162,6 +174,7 @@ class EBHabEnv(gym.Env):
         # feedback verbosity, 0: concise, 1: verbose
         self.feedback_verbosity = 1
         self.log_path = 'running/eb_habitat/{}'.format(exp_name)
+        self.log_sink = get_log_sink()
         # video recorder
         self.recording = recording
         self.episode_video = []
@@ -169,7 +182,37 @@ class EBHabEnv(gym.Env):
     def current_episode(self, all_info: bool = False):
         return self.env.current_episode(all_info)
 
+    def set_eval_set(self, eval_set, exp_name):
+        """
+        Switch to another eval set while keeping the running simulator.
+        The episodes are swapped inside the dataset object the task is bound to.
+        """
+        assert eval_set in ValidEvalSets
+        if eval_set not in self._eval_set_episodes:
+            dataset_config = self.config.habitat.dataset.copy()
+            OmegaConf.set_readonly(dataset_config, False)
+            dataset_config.data_path = os.path.join(os.path.dirname(__file__), 'datasets/{}.pickle'.format(eval_set))
+            self._eval_set_episodes[eval_set] = make_dataset(dataset_config.type, config=dataset_config).episodes
+        self.eval_set = eval_set
+        self.env.env.env._env.episodes = self._eval_set_episodes[eval_set]
+        self.number_of_episodes = len(self.dataset.episodes) * self.down_sample_ratio
+        self._current_episode_num = 0
+        self._reset = False
+        self.log_path = 'running/eb_habitat/{}'.format(exp_name)
+
+    def seek_episode(self, index):
+        """Make the next reset() load episode `index` of the current eval set."""
+        assert 0 <= index < self.number_of_episodes
+        self._current_episode_num = index
+        self.env.env.env._env.current_episode = self.dataset.episodes[index]
+
+    def episode_scenes(self):
+        """Scene id of every episode in the current eval set, in dataset order."""
+        num = int(np.ceil(self.number_of_episodes))
+        return [episode.scene_id for episode in self.dataset.episodes[:num]]
+
 
+    @tracing.traced('env.reset')
     def reset(self, **kwargs):
         """
         Reset the environment for a new episode. The env will iterate over all the task data from the dataset
@@ -244,6 +287,7 @@ class EBHabEnv(gym.Env):
         # env_feedback += ' The current task progress is {}.'.format(info['task_progress'])
         return env_feedback
 
+    @tracing.traced('env.step')
     def step(self, action, reasoning='', **kwargs):
         """
         Execute a single environment step.
@@ -254,7 +298,8 @@ class EBHabEnv(gym.Env):
         """
         assert self._reset, 'Reset env before stepping'
         self._current_step += 1
-        obs, reward, done, info = self.env.step(action, **kwargs)
+        with tracing.span('sim.step'):
+            obs, reward, done, info = self.env.step(action, **kwargs)
         if self.recording:
             self.episode_video.append(self.env.render("rgb_array"))
 
@@ -283,36 +328,28 @@ class EBHabEnv(gym.Env):
     def seed(self, seed=None):
         self.env.seed(seed)
 
+    @tracing.traced('env.save_image')
     def save_image(self, obs, key='head_rgb'):
         """Save current agent observation as a PNG image."""
         folder = self.log_path + '/images/episode_{}'.format(self._current_episode_num)
-        if not os.path.exists(folder):
-            os.makedirs(folder)
         img = Image.fromarray(observations_to_image(obs, key))
         # time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         image_path = os.path.join(folder, 'episode_{}_step_{}.png'.format(self._current_episode_num, self._current_step)) #, time_stamp))
-        img.save(image_path)
-        return image_path
+        return self.log_sink.save_image(img, image_path)
 
+    @tracing.traced('env.save_log')
     def save_episode_log(self):
-        if not os.path.exists(self.log_path):
-            os.makedirs(self.log_path)
         # time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         filename = 'episode_{}_step_{}.json'.format(self._current_episode_num, self._current_step) #, time_stamp)
         if len(self.episode_log):
-            with open(os.path.join(self.log_path, filename), 'w', encoding='utf-8') as f:
-                for item in self.episode_log:
-                    json.dump(item, f, ensure_ascii=False)
-                    f.write('\n')  
+            self.log_sink.write_jsonl(os.path.join(self.log_path, filename), self.episode_log)
         
         if len(self.episode_video):
             folder = self.log_path + '/video'
-            if not os.path.exists(folder):
-                os.makedirs(folder)
-            video_writer = imageio.get_writer(os.path.join(folder, 'video_episode_{}_steps_{}.mp4'.format(self._current_episode_num, self._current_step)), fps=30)
-            for data in self.episode_video:
-                video_writer.append_data(data)
-            video_writer.close()
+            video_path = os.path.join(folder, 'video_episode_{}_steps_{}.mp4'.format(self._current_episode_num, self._current_step))
+            # reset() starts a new list, so the writer thread owns this one
+            self.log_sink.submit(write_video, video_path, self.episode_video)
+        self.log_sink.end_episode()
 
 
 
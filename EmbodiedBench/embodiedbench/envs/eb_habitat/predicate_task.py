@@ -22,7 +22,6 @@ from habitat.tasks.rearrange.rearrange_task import RearrangeTask
 from habitat.tasks.rearrange.utils import add_perf_timing_func
 from omegaconf import DictConfig, ListConfig
 from PIL import Image
-from transformers import AutoTokenizer
 
 import embodiedbench.envs.eb_habitat.config
 from embodiedbench.envs.eb_habitat.dataset.episodes import LangRearrangeEpisode
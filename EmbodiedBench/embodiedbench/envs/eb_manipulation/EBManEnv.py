@@ -14,11 +14,13 @@ import numpy as np
 from amsolver.backend.utils import task_file_to_task_class
 from pathlib import Path
 from amsolver.utils import name_to_task_class
-from embodiedbench.envs.eb_manipulation.eb_man_utils import get_continous_action_from_discrete
+from embodiedbench.envs.eb_manipulation.eb_man_utils import get_continous_action_from_discrete, ObservationView
 import os
 import time
 from PIL import Image
+from embodiedbench.envs.log_sink import get_log_sink
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 EVAL_SETS = {
     'base': ['pick_cube_shape', 'stack_cubes_color', 'place_into_shape_sorter_color', 'wipe_table_direction'],
@@ -33,14 +35,15 @@ ValidEvalSets = ['base', 'common_sense', 'complex', 'spatial', 'visual']
 class EBManEnv(gym.Env):
     metadata = {'render.modes': ['human', 'rgb_array']}
 
-    def __init__(self, eval_set, render_mode='human', img_size=(500, 500), down_sample_ratio=1.0, log_path = None, selected_indexes=[]):
+    def __init__(self, eval_set, render_mode='human', img_size=(500, 500), down_sample_ratio=1.0, log_path = None, selected_indexes=[], success_check_stride=1):
         obs_config = ObservationConfig()
         obs_config.set_all(True)
         obs_config.set_image_size(img_size)
 
         action_mode = ActionMode(ArmActionMode.ABS_EE_POSE_PLAN_WORLD_FRAME)        
         self.env = Environment(
-            action_mode, obs_config=obs_config, headless=True)
+            action_mode, obs_config=obs_config, headless=True,
+            success_check_stride=success_check_stride)
         self.env.launch()
         self._render_mode = render_mode
 
@@ -56,6 +59,7 @@ class EBManEnv(gym.Env):
         else:
             if down_sample_ratio < 1.0:
                 self.dataset = self.dataset[:int(len(self.dataset) * down_sample_ratio)]
+        self.env.preload_task_configs([episode[3] for episode in self.dataset])
         self.task = None
         self.current_task_variation = None
 
@@ -90,6 +94,7 @@ class EBManEnv(gym.Env):
             self.log_path = 'running/eb_manipulation/{}'.format(eval_set)
         else:
             self.log_path = log_path
+        self.log_sink = get_log_sink()
     
     def load_test_config(self, data_folder, task_name):
         episode_list = []
@@ -143,6 +148,7 @@ class EBManEnv(gym.Env):
         if mode == 'rgb_array':
             return self._gym_cam.capture_rgb()
 
+    @tracing.traced('env.reset')
     def reset(self):
         """
         Reset the environment for a new episode.
@@ -161,17 +167,21 @@ class EBManEnv(gym.Env):
         self.task_class = self.current_task_variation.split('_')[0]
         descriptions, obs = self.task.load_config(self.dataset[self._current_episode_num - 1][1], self.dataset[self._current_episode_num - 1][2], self.dataset[self._current_episode_num - 1][3])
         self.episode_language_instruction = descriptions[0]
-        self.last_frame_obs = vars(obs)
+        self.last_frame_obs = ObservationView(obs)
         return descriptions[0], obs
     
+    @tracing.traced('env.step')
     def step(self, discrete_action):
         assert self._reset, "Reset the environment before stepping."
         info = {}
         self._current_step += 1
         action_success = False
+        sim_steps = 0
         try:
             action = get_continous_action_from_discrete(discrete_action)
-            obs, reward, terminate = self.task.step(action)
+            with tracing.span('sim.step'):
+                obs, reward, terminate = self.task.step(action)
+            sim_steps += self.task.last_sim_steps
             if self.current_task_variation.startswith('stack'):
                 if terminate:
                     if action[-1] == 0.0:
@@ -182,6 +192,7 @@ class EBManEnv(gym.Env):
                         action[2] += 0.03
                         logger.debug("checking if the object is stacked properly ...")
                         obs, reward, terminate = self.task.step(action)
+                        sim_steps += self.task.last_sim_steps
                         if terminate and reward == 1.0:
                             logger.debug("stacking is successful ...")
                             reward = 1.0
@@ -190,7 +201,7 @@ class EBManEnv(gym.Env):
                             logger.debug("stacking is unsuccessful ...")
                             reward = 0.0
                             terminate = False
-            self.last_frame_obs = vars(obs)
+            self.last_frame_obs = ObservationView(obs)
             action_success = True
         except Exception as e:
             print(f"*** An unexpected error occurred: {e}")
@@ -203,6 +214,7 @@ class EBManEnv(gym.Env):
         info['episode_elapsed_seconds'] = time.time() - self._episode_start_time
         info['episode_num'] = self._current_episode_num
         info['action'] = discrete_action
+        info['sim_steps'] = sim_steps
         if action_success == True:
             info['action_success'] = 1.0
         else:
@@ -218,19 +230,19 @@ class EBManEnv(gym.Env):
         return self.last_frame_obs, reward, terminate, info
 
     def close(self) -> None:
+        logger.info(f"EB-Manipulation config cache: {self.env.asset_cache_stats()}")
         self.env.shutdown()
     
+    @tracing.traced('env.save_image')
     def save_image(self, key=['front_rgb']) -> str:
         log_path = self.log_path + '/images/' + f"episode_{self._current_episode_num}"
-        if not os.path.exists(log_path):
-            os.makedirs(log_path) 
         image_path_list=[]
         for cam_view in key:
             single_image = Image.fromarray(self.last_frame_obs[cam_view])
             time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime()) 
             image_path = 'episode_{}_step_{}_{}.png'.format(self._current_episode_num, self._current_step, cam_view)
             image_path = os.path.join(log_path, 'episode_{}_step_{}_{}.png'.format(self._current_episode_num, self._current_step, cam_view))
-            single_image.save(image_path)
+            self.log_sink.save_image(single_image, image_path)
             image_path_list.append(image_path)
         return image_path_list
     
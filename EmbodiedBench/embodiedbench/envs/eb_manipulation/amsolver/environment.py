@@ -31,6 +31,7 @@ import importlib
 from typing import Type, List
 from amsolver.observation_config import ObservationConfig
 from amsolver.task_environment import TaskEnvironment
+from amsolver.scene_asset_cache import SceneAssetCache
 from amsolver.action_modes import ActionMode, ArmActionMode
 
 
@@ -58,7 +59,8 @@ class Environment(object):
                  frequency: int=1,
                  visual_randomization_config: VisualRandomizationConfig=None,
                  dynamics_randomization_config: DynamicsRandomizationConfig=None,
-                 attach_grasped_objects: bool = True
+                 attach_grasped_objects: bool = True,
+                 success_check_stride: int = 1
                  ):
 
         self._dataset_root = dataset_root
@@ -73,6 +75,7 @@ class Environment(object):
         self._visual_randomization_config = visual_randomization_config
         self._dynamics_randomization_config = dynamics_randomization_config
         self._attach_grasped_objects = attach_grasped_objects
+        self._success_check_stride = success_check_stride
 
         if robot_configuration not in SUPPORTED_ROBOTS.keys():
             raise ValueError('robot_configuration must be one of %s' %
@@ -91,6 +94,7 @@ class Environment(object):
         self._robot = None
         self._scene = None
         self._prev_task = None
+        self._asset_cache = SceneAssetCache()
 
     def _set_arm_control_action(self):
         self._robot.arm.set_control_loop_enabled(True)
@@ -183,7 +187,16 @@ class Environment(object):
         return TaskEnvironment(
             self._pyrep, self._robot, self._scene, task,
             self._action_mode, self._dataset_root, self._obs_config,
-            self._static_positions, self._attach_grasped_objects)
+            self._static_positions, self._attach_grasped_objects,
+            asset_cache=self._asset_cache,
+            success_check_stride=self._success_check_stride)
+
+    def preload_task_configs(self, config_paths: List[str]) -> None:
+        """Parses the episode configs up front so load_config skips the disk."""
+        self._asset_cache.preload_configs(config_paths)
+
+    def asset_cache_stats(self):
+        return self._asset_cache.stats()
 
     @property
     def action_size(self):
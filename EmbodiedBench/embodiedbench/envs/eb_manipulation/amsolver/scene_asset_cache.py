@@ -0,0 +1,42 @@
+import pickle
+from typing import Dict, Iterable
+
+
+class SceneAssetCache(object):
+    """Keeps the parsed ``configs.pkl`` of every episode of the eval set.
+
+    Each episode ships its own task base and waypoint models, so those are
+    still imported by load_config; only the config unpickling is cached.
+    """
+
+    def __init__(self) -> None:
+        self._configs: Dict[str, object] = {}
+        self.config_hits = 0
+        self.config_misses = 0
+
+    def preload_configs(self, config_paths: Iterable[str]) -> None:
+        for path in config_paths:
+            if path not in self._configs:
+                self._load(path)
+
+    def _load(self, config_path: str):
+        with open(config_path, 'rb') as f:
+            config = pickle.load(f)
+        self._configs[config_path] = config
+        return config
+
+    def get_config(self, config_path: str):
+        config = self._configs.get(config_path)
+        if config is None:
+            self.config_misses += 1
+            return self._load(config_path)
+        self.config_hits += 1
+        # The conditions are shared between episodes, so clear whatever
+        # state the previous run left in them.
+        for cond in config.success_conditions:
+            cond.reset()
+        return config
+
+    def stats(self) -> Dict[str, int]:
+        return {'config_hits': self.config_hits,
+                'config_misses': self.config_misses}
@@ -21,6 +21,7 @@ from amsolver.backend.task import Task
 from amsolver.backend.utils import execute_path
 from amsolver.demo import Demo
 from amsolver.observation_config import ObservationConfig
+from amsolver.scene_asset_cache import SceneAssetCache
 from scipy.spatial.transform import Rotation as R
 
 _TORQUE_MAX_VEL = 9999
@@ -46,7 +47,9 @@ class TaskEnvironment(object):
                  action_mode: ActionMode, dataset_root: str,
                  obs_config: ObservationConfig,
                  static_positions: bool = False,
-                 attach_grasped_objects: bool = True):
+                 attach_grasped_objects: bool = True,
+                 asset_cache: SceneAssetCache = None,
+                 success_check_stride: int = 1):
         self._pyrep = pyrep
         self._robot = robot
         self._scene = scene
@@ -60,6 +63,13 @@ class TaskEnvironment(object):
         self._reset_called = False
         self._prev_ee_velocity = None
         self._enable_path_observations = False
+        self._asset_cache = asset_cache
+        # Task success is checked every success_check_stride path steps and
+        # always at the end of the path.
+        self._success_check_stride = max(1, int(success_check_stride))
+        self._collidable_shapes = None
+        self._sim_steps = 0
+        self.last_sim_steps = 0
         tasks_folder = self._task.__module__.split('.')[0]
         ttms_folder = TTMS_FOLDER + tasks_folder+'/task_ttms' # change to absolute path to vlmbench folder
         # ttms_folder = './'+tasks_folder+'/task_ttms'
@@ -102,6 +112,7 @@ class TaskEnvironment(object):
                 % self._task.get_name()) from e
 
         self._reset_called = True
+        self._collidable_shapes = None
         # Returns a list of descriptions and the first observation
         return desc, self._scene.get_observation()
 
@@ -142,6 +153,7 @@ class TaskEnvironment(object):
         # (e.g. when we collide wth something)
         while not done:
             self._scene.step()
+            self._sim_steps += 1
             cur_positions = self._robot.arm.get_joint_positions()
             reached = np.allclose(cur_positions, joint_positions, atol=0.01)
             not_moving = False
@@ -184,10 +196,7 @@ class TaskEnvironment(object):
             if colliding:
                 # Disable collisions with the objects that we are colliding with
                 grasped_objects = self._robot.gripper.get_grasped_objects()
-                colliding_shapes = [s for s in self._pyrep.get_objects_in_tree(
-                    object_type=ObjectType.SHAPE) if (
-                        s.is_collidable() and
-                        s not in self._robot_shapes and
+                colliding_shapes = [s for s in self._get_collidable_shapes() if (
                         s not in grasped_objects and
                         self._robot.arm.check_arm_collision(s))]
                 [s.set_collidable(False) for s in colliding_shapes]
@@ -195,9 +204,11 @@ class TaskEnvironment(object):
                     action, collision_checking, relative_to)
                 [s.set_collidable(True) for s in colliding_shapes]
                 # Only run this path until we are no longer colliding
+                small_step = 0
                 while not done:
                     done = path.step()
                     self._scene.step()
+                    self._sim_steps += 1
                     if self._enable_path_observations:
                         observations.append(self._scene.get_observation())
                     if recorder is not None:
@@ -205,11 +216,13 @@ class TaskEnvironment(object):
                     colliding = self._robot.arm.check_arm_collision()
                     if not colliding:
                         break
-                    success, terminate = self._task.success()
-                    # If the task succeeds while traversing path, then break early
-                    if success:
-                        done = True
-                        break
+                    if done or small_step % self._success_check_stride == 0:
+                        success, terminate = self._task.success()
+                        # If the task succeeds while traversing path, then break early
+                        if success:
+                            done = True
+                            break
+                    small_step += 1
         if not done:
             path = self._path_action_get_path(
                 action, collision_checking, relative_to)
@@ -217,26 +230,39 @@ class TaskEnvironment(object):
             while not done:
                 done = path.step()
                 self._scene.step()
+                self._sim_steps += 1
                 if self._enable_path_observations:
                     observations.append(self._scene.get_observation())
                 if recorder is not None:
                     recorder.take_snap()
-                success, terminate = self._task.success()
-                # If the task succeeds while traversing path, then break early
-                # if success:
-                #     break
-                if success:
-                    success_in_path.append(small_step)
+                if done or small_step % self._success_check_stride == 0:
+                    success, terminate = self._task.success()
+                    # If the task succeeds while traversing path, then break early
+                    # if success:
+                    #     break
+                    if success:
+                        success_in_path.append(small_step)
                 small_step += 1
 
         return observations, success_in_path
 
+    def _get_collidable_shapes(self) -> List[Object]:
+        # The shapes in the scene only change when a task is loaded, so the
+        # tree is walked once per load instead of on every colliding action.
+        if self._collidable_shapes is None:
+            self._collidable_shapes = [
+                s for s in self._pyrep.get_objects_in_tree(
+                    object_type=ObjectType.SHAPE)
+                if s.is_collidable() and s not in self._robot_shapes]
+        return self._collidable_shapes
+
     def step(self, action, collision_checking=None, use_auto_move=True, recorder = None, need_grasp_obj = None) -> Tuple[Observation, int, bool]:
         # returns observation, reward, done, info
         if not self._reset_called:
             raise RuntimeError(
                 "Call 'reset' before calling 'step' on a task.")
 
+        self._sim_steps = 0
         # action should contain 1 extra value for gripper open close state
         arm_action = np.array(action[:-1])
         ee_action = action[-1]
@@ -414,11 +440,13 @@ class TaskEnvironment(object):
                 done = self._robot.gripper.actuate(ee_action, velocity=0.2)
                 self._pyrep.step()
                 self._task.step()
+                self._sim_steps += 1
             if ee_action == 1.0:
                 # Step a few more times to allow objects to drop
                 for _ in range(10):
                     self._pyrep.step()
                     self._task.step()
+                self._sim_steps += 10
 
         success, terminate = self._task.success()
         # task_reward = self._task.reward(steps)
@@ -428,6 +456,7 @@ class TaskEnvironment(object):
         elif grasp_sucess:
             success = 0.5
         reward = float(success)
+        self.last_sim_steps = self._sim_steps
         return obs, reward, terminate
 
     def auto_grasp(self, obs, goal_tip_pose, ee_action):
@@ -656,14 +685,18 @@ class TaskEnvironment(object):
             Dummy("waypoint_sets").remove()
         new_base = self._pyrep.import_model(task_base)
         waypoints = self._pyrep.import_model(waypoint_sets)
-        with open(config_path, 'rb') as f:
-            config = pickle.load(f)
+        if self._asset_cache is not None:
+            config = self._asset_cache.get_config(config_path)
+        else:
+            with open(config_path, 'rb') as f:
+                config = pickle.load(f)
         self._task._success_conditions = config.success_conditions
         graspable_objects = []
         for obj_name in config.graspable_objects:
             graspable_objects.append(Object.get_object(obj_name))
         self._task._graspable_objects = graspable_objects
         self._task.set_initial_objects_in_scene()
+        self._collidable_shapes = None
         if not hasattr(self, "attr_retrivel"):
             self.attr_retrivel = []
         for key, val in config.task_attributes.items():
@@ -1,17 +1,27 @@
 import os
+from collections.abc import Mapping
+from types import MappingProxyType
 from typing import List
 import numpy as np
 from pyrep.objects import VisionSensor
-from ultralytics import YOLO
 import cv2
 from scipy.spatial.transform import Rotation
+from embodiedbench.envs.log_sink import read_file_bytes
 
 SCENE_BOUNDS = np.array([-0.3, -0.5, 0.6, 0.7, 0.5, 1.6])
 ROTATION_RESOLUTION = 3
 VOXEL_SIZE = 100
 CAMERAS = ['front', 'left_shoulder', 'right_shoulder', 'wrist']
 USE_GENERAL_OBJECT_NAMES = True
-object_detection_model = YOLO("yolo11n.pt")
+_object_detection_model = None
+
+def get_object_detection_model():
+    """YOLO detector, loaded on first use so that importing the env does not load ultralytics."""
+    global _object_detection_model
+    if _object_detection_model is None:
+        from ultralytics import YOLO
+        _object_detection_model = YOLO("yolo11n.pt")
+    return _object_detection_model
 
 # From https://github.com/stepjam/RLBench/blob/master/rlbench/backend/utils.py
 def point_to_voxel_index(
@@ -48,8 +58,13 @@ def get_continous_action_from_discrete(discrete_action):
     ])
     return continuous_action
 
+def read_image_bgr(image_path):
+    """cv2.imread for a frame that may still be queued in the episode log sink."""
+    data = np.frombuffer(read_file_bytes(image_path), dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
 def draw_xyz_coordinate(image_path, resolution):
-    image = cv2.imread(image_path)
+    image = read_image_bgr(image_path)
     # origin = (45, 172)  # Adjust based on the table's position in the image
     if resolution == 500:
         origin = (62, 239)  # Adjust based on the table's position in the image
@@ -210,9 +225,10 @@ def draw_bounding_boxes(image_path_list, world_points, camera_extrinsics_list, c
         pixel_points_2D, _ = cv2.projectPoints(np.array(world_points), rvec, tvec, camera_intrinsics, np.zeros(4))
 
         # get the bounding boxes using YOLO
-        results = object_detection_model.predict(source=input_image_path, conf=0.0001, line_width=1, verbose=False)
+        image_bgr = read_image_bgr(input_image_path)
+        # YOLO takes BGR arrays like the ones cv2.imread returns
+        results = get_object_detection_model().predict(source=image_bgr, conf=0.0001, line_width=1, verbose=False)
         predicted_boxes = results[0].boxes.xyxy
-        image_bgr = cv2.imread(input_image_path, cv2.IMREAD_COLOR)
 
         box_id = 0
         # find the closest bounding box and save the current index
@@ -258,6 +274,46 @@ def draw_bounding_boxes(image_path_list, world_points, camera_extrinsics_list, c
     
     return image_save_path_list
 
+####### Read-only observation view
+# Fields of an amsolver Observation that the evaluator reads: images for saving,
+# depth and masks for the object coordinates, camera parameters in misc.
+# Point clouds, joint and gripper states are never consumed on this path.
+OBSERVATION_VIEW_FIELDS = tuple(
+    f"{camera}_{kind}" for camera in CAMERAS + ['overhead'] for kind in ('rgb', 'depth', 'mask')
+) + ('misc', 'object_informations')
+
+class ObservationView(Mapping):
+    """
+    Read-only view over the OBSERVATION_VIEW_FIELDS of an observation.
+
+    Arrays are shared with the simulator output instead of copied and are
+    flagged non-writeable, so consumers that try to modify them in place fail
+    loudly instead of corrupting the next reader.
+    """
+    __slots__ = ('_fields',)
+
+    def __init__(self, obs):
+        source = obs if isinstance(obs, Mapping) else vars(obs)
+        fields = {}
+        for key in OBSERVATION_VIEW_FIELDS:
+            value = source.get(key)
+            if isinstance(value, np.ndarray) and value.flags.writeable:
+                value = value.view()
+                value.flags.writeable = False
+            elif isinstance(value, dict):
+                value = MappingProxyType(value)
+            fields[key] = value
+        self._fields = fields
+
+    def __getitem__(self, key):
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
 ####### Generate object information for the initial observation
 def _get_mask_id_to_name_dict_for_input(object_info):
     mask_id_to_name_dict = {}
@@ -287,7 +343,7 @@ def _get_point_cloud_dict_for_input(obs, camera_types):
 def _get_mask_dict_for_input(obs):
     mask_dict = {}
     for camera in CAMERAS:
-        rgb_mask = np.array(obs[f"{camera}_mask"], dtype=int)
+        rgb_mask = np.asarray(obs[f"{camera}_mask"], dtype=int)
         mask_dict[camera] = rgb_mask
     return mask_dict
 
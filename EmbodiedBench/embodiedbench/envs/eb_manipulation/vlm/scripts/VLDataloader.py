@@ -16,10 +16,80 @@ from scipy.spatial.transform import Rotation as R
 from num2words import num2words
 
 
+def split_by_waypoints(observations):
+    """Returns the indexes of the first observation of every waypoint and the waypoint names."""
+    obs_select_inds = [0]
+    previous_waypoint = "waypoint0"
+    all_waypoints = [previous_waypoint]
+    for i, obs in enumerate(observations):
+        if obs.current_waypoint_name == previous_waypoint:
+            continue
+        else:
+            previous_waypoint = obs.current_waypoint_name
+            all_waypoints.append(previous_waypoint)
+            obs_select_inds.append(i)
+    return obs_select_inds, all_waypoints
+
+
+# Order of the camera views fed to the heightmap fusion.
+FUSION_VIEWS = ['front', 'wrist', 'left_shoulder', 'right_shoulder', 'overhead']
+
+
+def get_bounds(episode):
+    z_max = 1.2
+    if 'door' in str(episode) or 'drawer' in str(episode):
+        z_max = 1.8
+    return np.array([[-0.05,0.67],[-0.45, 0.45], [0.7, z_max]])
+
+
+def batched_fused_heightmaps(colors, pcds, bounds, pixel_size):
+    """
+    Same result as calling get_fused_heightmap on every step, but all steps and views are
+    projected in one pass.
+    colors: [steps, views, H, W, 3] uint8, pcds: [steps, views, H, W, 3] in world frame.
+    Returns colormaps [steps, height, width, 3] uint8 and heightmaps [steps, height, width] float32.
+    """
+    width = int(np.round((bounds[0, 1] - bounds[0, 0]) / pixel_size))
+    height = int(np.round((bounds[1, 1] - bounds[1, 0]) / pixel_size))
+    n_steps, n_views = colors.shape[:2]
+    points = pcds.reshape(n_steps, n_views, -1, 3)
+    colors = colors.reshape(n_steps, n_views, -1, colors.shape[-1])
+
+    # Filter out 3D points that are outside of the predefined bounds.
+    valid = ((points >= bounds[:, 0]) & (points < bounds[:, 1])).all(axis=-1)
+    step_ids, view_ids, point_ids = np.nonzero(valid)
+    points = points[step_ids, view_ids, point_ids]
+    colors = colors[step_ids, view_ids, point_ids]
+
+    # Sort by z so the array assignment below keeps the highest point of every cell (z-buffering).
+    order = np.argsort(points[:, 2], kind='stable')
+    points, colors = points[order], colors[order]
+    step_ids, view_ids = step_ids[order], view_ids[order]
+    px = np.clip(np.int32(np.floor((points[:, 0] - bounds[0, 0]) / pixel_size)), 0, width - 1)
+    py = np.clip(np.int32(np.floor((points[:, 1] - bounds[1, 0]) / pixel_size)), 0, height - 1)
+    cells = ((step_ids * n_views + view_ids) * height + py) * width + px
+
+    heightmaps = np.zeros(n_steps * n_views * height * width, dtype=np.float32)
+    colormaps = np.zeros((n_steps * n_views * height * width, colors.shape[-1]), dtype=np.uint8)
+    heightmaps[cells] = points[:, 2] - bounds[2, 0]
+    colormaps[cells] = colors
+    heightmaps = heightmaps.reshape(n_steps, n_views, height, width)
+    colormaps = np.float32(colormaps.reshape(n_steps, n_views, height, width, -1))
+
+    # Fuse maps from different views.
+    valid = np.sum(colormaps, axis=-1) > 0
+    repeat = np.sum(valid, axis=1)
+    repeat[repeat == 0] = 1
+    cmaps = np.uint8(np.round(np.sum(colormaps, axis=1) / repeat[..., None]))
+    hmaps = np.max(heightmaps, axis=1)  # Max to handle occlusions.
+    return cmaps, hmaps
+
+
 class VLM_dataset(Dataset):
     def __init__(self, root, setd, img_size=(360, 360), 
                     unused_camera_list = ['left_shoulder', 'right_shoulder', 'overhead','wrist'], preprocess = True, 
-                    use_fail_cases = True, sample_numbers = None, train_tasks = None, random_sample = False, args=None):
+                    use_fail_cases = True, sample_numbers = None, train_tasks = None, random_sample = False, args=None,
+                    packed_dir = None):
         self.root = root
         self.setd = setd
         self.dataset_path = Path(os.path.join(self.root, self.setd))
@@ -70,10 +140,21 @@ class VLM_dataset(Dataset):
         self.relative = False
         self.renew_obs = False
         self.add_low_lang = False
+        self.batched_fusion = True
         if args is not None:
             self.relative = args.relative
             self.renew_obs = args.renew_obs
             self.add_low_lang = args.add_low_lang
+            self.batched_fusion = getattr(args, 'batched_fusion', True)
+            packed_dir = getattr(args, 'packed_dir', None) or packed_dir
+        # Shards written by pack_dataset.py; the source tree is only read, never rewritten.
+        self.packed = None
+        if packed_dir is not None:
+            from vlm.scripts.pack_dataset import PackedShards
+            self.packed = PackedShards(os.path.join(packed_dir, self.setd))
+            missing_views = set(self.views) - set(self.packed.views)
+            if missing_views:
+                raise ValueError('{} was packed without the cameras {}'.format(packed_dir, sorted(missing_views)))
 
     def read_lists(self):
         tasks_list_path = self.dataset_path / '{}_list.pkl'.format(self.setd)
@@ -114,6 +195,11 @@ class VLM_dataset(Dataset):
         task_name = episode.parents[2]
         fail_cases = 'fail_cases' in str(episode)
 
+        if self.packed is not None and str(episode) in self.packed:
+            obs, high_level_instructions, self.all_waypoints = self.packed.get_episode(str(episode))
+            output_dict = self.get_cliport_gt(obs, high_level_instructions, episode)
+            return self._check_output(output_dict, index)
+
         low_dim_obs = self.dataset_path/episode/"low_dim_obs.pkl"
         with open(low_dim_obs, 'rb') as f:
             demo_temple = pickle.load(f)
@@ -127,16 +213,7 @@ class VLM_dataset(Dataset):
                 obs_select_inds = obs_select_inds[0:self.sample_numbers]
         split_by_waypoint = True
         if split_by_waypoint:
-            obs_select_inds = [0]
-            previous_waypoint="waypoint0"
-            self.all_waypoints = [previous_waypoint]
-            for i, obs in enumerate(demo_temple._observations):
-                if obs.current_waypoint_name == previous_waypoint:
-                    continue
-                else:
-                    previous_waypoint = obs.current_waypoint_name
-                    self.all_waypoints.append(previous_waypoint)
-                    obs_select_inds.append(i)
+            obs_select_inds, self.all_waypoints = split_by_waypoints(demo_temple._observations)
             # for i in range(len(obs_select_inds)):
             #     if i+1<len(obs_select_inds):
             #         random_i = np.random.randint(obs_select_inds[i], obs_select_inds[i+1])
@@ -197,6 +274,9 @@ class VLM_dataset(Dataset):
             obs = data._observations
             obs = [obs[i] for i in obs_select_inds]
         output_dict = self.get_cliport_gt(obs, demo_temple.high_level_instructions, episode)
+        return self._check_output(output_dict, index)
+
+    def _check_output(self, output_dict, index):
         if output_dict['valid']:
             self.valid_episodes.append(index)
         else:
@@ -210,13 +290,12 @@ class VLM_dataset(Dataset):
         return output_dict
 
     def get_cliport_gt(self, data, languages, episode):
-        z_max = 1.2
-        if 'door' in str(episode) or 'drawer' in str(episode):
-            z_max = 1.8
-        bounds = np.array([[-0.05,0.67],[-0.45, 0.45], [0.7, z_max]])
+        bounds = get_bounds(episode)
         pixel_size = 5.625e-3
         target_obj = None
         cmaps, hmaps = [], []
+        step_colors, step_pcds = [], []
+        id_to_name = {}
         high_l = np.random.choice(languages, 1)[0]
         if high_l[-1]!=".":
             high_l+="."
@@ -256,27 +335,19 @@ class VLM_dataset(Dataset):
             current_waypoint, index, attention_id, related_rotation = step
             obs = data[index]
             waypoint_info = obs.object_informations[current_waypoint]
-            for name, obj in obs.object_informations.items():
-                if "id" in obj and "waypoint" not in name:
-                    if obj["id"] == attention_id:
-                        target_obj = name
-            front_rgb = obs.front_rgb
-            wrist_rgb = obs.wrist_rgb
-            left_rgb = obs.left_shoulder_rgb
-            right_rgb = obs.right_shoulder_rgb
-            overhead_rgb = obs.overhead_rgb
-
-            front_point_cloud = obs.front_point_cloud
-            wrist_point_cloud = obs.wrist_point_cloud
-            left_point_cloud = obs.left_shoulder_point_cloud
-            right_point_cloud = obs.right_shoulder_point_cloud
-            overhead_point_cloud = obs.overhead_point_cloud
-
-            colors = [front_rgb, wrist_rgb, left_rgb, right_rgb, overhead_rgb]
-            pcds = [front_point_cloud, wrist_point_cloud, left_point_cloud, right_point_cloud, overhead_point_cloud]
-            cmap, hmap = get_fused_heightmap(colors, pcds, bounds, pixel_size)
-            cmaps.append(cmap)
-            hmaps.append(hmap)
+            if index not in id_to_name:
+                id_to_name[index] = {obj["id"]: name for name, obj in obs.object_informations.items()
+                                     if "id" in obj and "waypoint" not in name}
+            target_obj = id_to_name[index].get(attention_id, target_obj)
+            colors = [getattr(obs, view + '_rgb') for view in FUSION_VIEWS]
+            pcds = [getattr(obs, view + '_point_cloud') for view in FUSION_VIEWS]
+            if self.batched_fusion:
+                step_colors.append(colors)
+                step_pcds.append(pcds)
+            else:
+                cmap, hmap = get_fused_heightmap(colors, pcds, bounds, pixel_size)
+                cmaps.append(cmap)
+                hmaps.append(hmap)
             lang = high_l+f" Step {num2words(i)}."
             if self.add_low_lang:
                 lang += waypoint_info['low_level_descriptions']
@@ -292,7 +363,10 @@ class VLM_dataset(Dataset):
             target_points.append(target_point)
             attention_point = obs.object_informations[target_obj]["pose"]#[0]
             attention_points.append(attention_point)
-        cmaps = np.stack(cmaps, axis=0)
+        if self.batched_fusion:
+            cmaps, hmaps = batched_fused_heightmaps(np.asarray(step_colors), np.asarray(step_pcds), bounds, pixel_size)
+        else:
+            cmaps = np.stack(cmaps, axis=0)
         hmaps = np.tile((np.stack(hmaps, axis=0))[..., None], (1,1,1,3))
         img = np.concatenate([cmaps, hmaps], axis=-1)
         attention_points = np.stack(attention_points, axis=0)
@@ -0,0 +1,202 @@
+"""
+Packs the per-waypoint observations used by VLM_dataset into memory-mapped shards.
+
+For every episode the observations selected by split_by_waypoints are loaded once
+through get_stored_demos and their RGB, depth and point cloud arrays are written
+into fixed-size .npy shards. Only the cameras the dataset loads are packed (see
+--unused_camera_list); an episode missing one of their images is left out of the
+pack and read from the source tree instead. An index maps each episode to its rows and keeps the
+pickled low-dimensional metadata, so training reads zero-copy slices and never
+touches (or rewrites) the source tree.
+
+Usage:
+    python vlm/scripts/pack_dataset.py --data_dir <root> --setd train --out_dir <packed_root>
+Then pass --packed_dir <packed_root> to train_baselines.py, with the same --unused_camera_list.
+"""
+import os
+import sys
+import argparse
+import pickle
+from os.path import join, dirname, abspath
+
+import numpy as np
+
+CURRENT_DIR = dirname(abspath(__file__))
+sys.path.insert(0, join(CURRENT_DIR, '..', '..'))  # Use local amsolver rather than installed
+
+from amsolver.utils import get_stored_demos
+
+PACKED_VIEWS = ['front', 'wrist', 'left_shoulder', 'right_shoulder', 'overhead']
+PACKED_FIELDS = {'rgb': np.uint8, 'depth': np.float32, 'point_cloud': np.float32}
+INDEX_FILE = 'index.pkl'
+PACK_VERSION = 1
+
+
+class PackedObservation(object):
+    """Stand-in for an amsolver Observation whose arrays are slices of the shards."""
+
+    def __init__(self, object_informations, current_waypoint_name, arrays):
+        self.object_informations = object_informations
+        self.current_waypoint_name = current_waypoint_name
+        # cameras that were not packed read as None, as on an Observation loaded without them
+        for view in PACKED_VIEWS:
+            for field in PACKED_FIELDS:
+                setattr(self, '{}_{}'.format(view, field), None)
+        for key, value in arrays.items():
+            setattr(self, key, value)
+
+
+class PackedShards(object):
+    """Read side of a packed split. Shards are opened lazily so that every DataLoader
+    worker maps them itself instead of receiving pickled copies."""
+
+    def __init__(self, packed_dir):
+        self.packed_dir = packed_dir
+        with open(join(packed_dir, INDEX_FILE), 'rb') as f:
+            index = pickle.load(f)
+        if index['version'] != PACK_VERSION:
+            raise RuntimeError('Unsupported packed dataset version {} in {}'.format(index['version'], packed_dir))
+        self.shards = index['shards']
+        self.episodes = index['episodes']
+        self.views = index['views']
+        self._arrays = {}
+
+    def __contains__(self, episode):
+        return episode in self.episodes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
+
+    def _shard_array(self, shard, field):
+        key = (shard, field)
+        if key not in self._arrays:
+            path = join(self.packed_dir, '{}_{}.npy'.format(self.shards[shard]['name'], field))
+            self._arrays[key] = np.load(path, mmap_mode='r')
+        return self._arrays[key]
+
+    def get_episode(self, episode):
+        entry = self.episodes[episode]
+        # metadata is unpickled per call because get_cliport_gt edits poses in place
+        meta = pickle.loads(entry['meta'])
+        start = entry['start']
+        observations = []
+        for row, (object_informations, waypoint_name) in enumerate(meta['observations']):
+            arrays = {}
+            for field in PACKED_FIELDS:
+                data = self._shard_array(entry['shard'], field)
+                for v, view in enumerate(self.views):
+                    arrays['{}_{}'.format(view, field)] = data[start + row, v]
+            observations.append(PackedObservation(object_informations, waypoint_name, arrays))
+        return observations, meta['high_level_instructions'], meta['all_waypoints']
+
+
+def _plan_episodes(dataset):
+    from vlm.scripts.VLDataloader import split_by_waypoints
+    plan = []
+    for episode in dataset.episode_list:
+        with open(dataset.dataset_path/episode/"low_dim_obs.pkl", 'rb') as f:
+            demo_temple = pickle.load(f)
+        obs_select_inds, all_waypoints = split_by_waypoints(demo_temple._observations)
+        plan.append((episode, obs_select_inds, all_waypoints, demo_temple.high_level_instructions))
+    return plan
+
+
+def _missing_image(observations, obs_select_inds, views):
+    """(attribute, observation index) of the first packed image that was not loaded, or None."""
+    for i in obs_select_inds:
+        for field in PACKED_FIELDS:
+            for view in views:
+                name = '{}_{}'.format(view, field)
+                if getattr(observations[i], name, None) is None:
+                    return name, i
+    return None
+
+
+def pack_dataset(dataset, out_dir, shard_rows=256):
+    """Writes the shards and index for a VLM_dataset split into out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    plan = _plan_episodes(dataset)
+    views = [view for view in PACKED_VIEWS if view in dataset.views]
+    height, width = dataset.img_size
+    shape_suffix = {'rgb': (height, width, 3), 'depth': (height, width), 'point_cloud': (height, width, 3)}
+
+    # Episodes are never split across shards, so a shard may exceed shard_rows by one episode.
+    shard_plan, current, rows = [], [], 0
+    for item in plan:
+        current.append(item)
+        rows += len(item[1])
+        if rows >= shard_rows:
+            shard_plan.append((current, rows))
+            current, rows = [], 0
+    if current:
+        shard_plan.append((current, rows))
+
+    shards, episodes = [], {}
+    for shard_id, (items, n_rows) in enumerate(shard_plan):
+        name = 'shard_{:05d}'.format(shard_id)
+        arrays = {field: np.lib.format.open_memmap(
+                    join(out_dir, '{}_{}.npy'.format(name, field)), mode='w+', dtype=dtype,
+                    shape=(n_rows, len(views)) + shape_suffix[field])
+                  for field, dtype in PACKED_FIELDS.items()}
+        start = 0
+        for episode, obs_select_inds, all_waypoints, high_level_instructions in items:
+            variation_number = int(episode.parents[1].name.replace('variation', ''))
+            demos = get_stored_demos(1, False, dataset.dataset_path, variation_number, episode.parents[2],
+                                     dataset.obs_config, episode.name, 'fail_cases' in str(episode), obs_select_inds)
+            observations = demos[0]._observations
+            missing = _missing_image(observations, obs_select_inds, views)
+            if missing is not None:
+                # None would not fit the uint8 rgb shards and would turn into NaN in the float ones
+                print('Skip {}: no {} in observation {}, it stays in the source tree'.format(episode, *missing))
+                continue
+            meta_observations = []
+            for row, i in enumerate(obs_select_inds):
+                obs = observations[i]
+                for field in PACKED_FIELDS:
+                    for v, view in enumerate(views):
+                        arrays[field][start + row, v] = getattr(obs, '{}_{}'.format(view, field))
+                meta_observations.append((obs.object_informations, obs.current_waypoint_name))
+            episodes[str(episode)] = {
+                'shard': shard_id,
+                'start': start,
+                'length': len(obs_select_inds),
+                'meta': pickle.dumps({'observations': meta_observations,
+                                      'all_waypoints': all_waypoints,
+                                      'high_level_instructions': high_level_instructions}),
+            }
+            start += len(obs_select_inds)
+        for array in arrays.values():
+            array.flush()
+        del arrays
+        shards.append({'name': name, 'rows': n_rows})
+        print('Finish {} ({} rows)'.format(name, n_rows))
+
+    # The index is written last, so an interrupted run never leaves a readable half pack.
+    tmp_path = join(out_dir, INDEX_FILE + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': PACK_VERSION, 'img_size': tuple(dataset.img_size), 'views': views,
+                     'shards': shards, 'episodes': episodes}, f)
+    os.replace(tmp_path, join(out_dir, INDEX_FILE))
+    return len(episodes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pack VLM_dataset observations into memory-mapped shards.')
+    parser.add_argument('--data_dir', type=str, required=True)
+    parser.add_argument('--setd', type=str, nargs='+', default=['train', 'valid'])
+    parser.add_argument('--out_dir', type=str, required=True)
+    parser.add_argument('--img_size', nargs='+', type=int, default=[360, 360])
+    parser.add_argument('--shard_rows', type=int, default=256)
+    parser.add_argument('--use_fail_cases', action='store_true', help="add if use the fail cases")
+    parser.add_argument('--unused_camera_list', nargs='+', default=[None], help="cameras not packed, as in train_baselines.py")
+    parser.add_argument('--train_tasks', nargs='+', type=str, default=None)
+    args = parser.parse_args()
+
+    from vlm.scripts.VLDataloader import VLM_dataset
+    for setd in args.setd:
+        dataset = VLM_dataset(args.data_dir, setd, img_size=tuple(args.img_size), unused_camera_list=args.unused_camera_list,
+                              preprocess=False, use_fail_cases=args.use_fail_cases, train_tasks=args.train_tasks)
+        n = pack_dataset(dataset, join(args.out_dir, setd), shard_rows=args.shard_rows)
+        print('Packed {} episodes of {} into {}'.format(n, setd, join(args.out_dir, setd)))
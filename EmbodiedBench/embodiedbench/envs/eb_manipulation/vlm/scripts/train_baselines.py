@@ -438,6 +438,7 @@ if __name__=="__main__":
     parser.add_argument('--preprocess', action='store_true', 
                 help="whether preprocess the data. Next time can directly use. Add if you don't want it.")
     parser.add_argument('--unused_camera_list', nargs='+', default=[None])
+    parser.add_argument('--packed_dir', type=str, default=None, help="root written by vlm/scripts/pack_dataset.py")
     parser.add_argument('--use_fail_cases', action='store_true', help="add if use the fail cases")
     parser.add_argument('--sample_numbers', type=int, default=0, help="downsample from total demonstrations")
     parser.add_argument('--pin_memory', action='store_true', help="do not use if the RAM is small")
@@ -445,6 +446,7 @@ if __name__=="__main__":
     parser.add_argument('--relative', type=lambda x:bool(strtobool(x)), default=False)
     parser.add_argument('--renew_obs', type=lambda x:bool(strtobool(x)), default=True)
     parser.add_argument('--add_low_lang', type=lambda x:bool(strtobool(x)), default=False)
+    parser.add_argument('--batched_fusion', type=lambda x:bool(strtobool(x)), default=True, help="fuse all steps' heightmaps in one vectorized pass")
     #traning
     parser.add_argument('--start_epoch', default=0, type=int)
     parser.add_argument('--epochs', default=15, type=int,
@@ -9,7 +9,10 @@ import sys
 import math
 from ai2thor.platform import CloudRendering
 from embodiedbench.envs.eb_navigation.utils import draw_target_box, draw_boxes
+from embodiedbench.envs.simulator_pool import SimulatorPool
+from embodiedbench.envs.log_sink import get_log_sink
 from embodiedbench.main import logger
+from embodiedbench import tracing
 import copy
 
 SUCCESS_THRESHOLD = 1
@@ -40,7 +43,8 @@ DISCRETE_SKILLSET = [
 
 
 class EBNavigationEnv(gym.Env):
-    def __init__(self, eval_set='base', exp_name='test_base', down_sample_ratio=1.0, fov = 100, multiview = False, boundingbox = False, multistep = False,  resolution = 500, selected_indexes =[]):
+    def __init__(self, eval_set='base', exp_name='test_base', down_sample_ratio=1.0, fov = 100, multiview = False, boundingbox = False, multistep = False,  resolution = 500, selected_indexes =[],
+                 sim_pool_size = 1, sim_step_timeout = 300):
         """
         A wrapper for AI2-THOR ManipulaTHOR environment.
 
@@ -58,10 +62,13 @@ class EBNavigationEnv(gym.Env):
             "fieldOfView": fov,
             "platform": CloudRendering
         }
-        self.env = ai2thor.controller.Controller(**self.config)
+        # sim_pool_size - 1 warm spares take over if the running controller hangs or dies
+        self.sim_pool = SimulatorPool(lambda: ai2thor.controller.Controller(**self.config),
+                                      size=sim_pool_size, step_timeout=sim_step_timeout, name='Controller')
 
         # load dataset
         assert eval_set in ValidEvalSets
+        self.eval_set = eval_set
         self.down_sample_ratio = down_sample_ratio
         self.data_path = os.path.join(os.path.dirname(__file__), f"datasets/{eval_set}.json")
         self.dataset = self._load_dataset(eval_set)
@@ -69,6 +76,7 @@ class EBNavigationEnv(gym.Env):
             self.dataset = [self.dataset[i] for i in selected_indexes]
 
         self.selected_indexes = selected_indexes
+        self._eval_set_datasets = {eval_set: self.dataset}
 
         # Episode tracking
         self.number_of_episodes = len(self.dataset)
@@ -81,6 +89,7 @@ class EBNavigationEnv(gym.Env):
         self.episode_log = []
         self.episode_language_instruction = ""
         self.episode_data = None
+        self._episode_actions = []
 
         self._last_event = None
 
@@ -93,12 +102,17 @@ class EBNavigationEnv(gym.Env):
         # set log and verbosity(0 for concise)
         self.feedback_verbosity = 0
         self.log_path = 'running/eb_nav/{}'.format(exp_name)
+        self.log_sink = get_log_sink()
 
         self.multiview = multiview
         self.boundingbox = boundingbox
         self.multistep = multistep
         self.img_paths = []
 
+    @property
+    def env(self):
+        return self.sim_pool.active
+
     def _load_dataset(self, eval_set):
         with open(self.data_path) as f:
             dataset_split = json.load(f)
@@ -108,6 +122,33 @@ class EBNavigationEnv(gym.Env):
             dataset = dataset[0:len(dataset):select_every]
         return dataset
 
+    def set_eval_set(self, eval_set, exp_name):
+        """Switch to another eval set while keeping the running controller."""
+        assert eval_set in ValidEvalSets
+        if eval_set not in self._eval_set_datasets:
+            self.data_path = os.path.join(os.path.dirname(__file__), f"datasets/{eval_set}.json")
+            dataset = self._load_dataset(eval_set)
+            if len(self.selected_indexes):
+                dataset = [dataset[i] for i in self.selected_indexes]
+            self._eval_set_datasets[eval_set] = dataset
+        self.eval_set = eval_set
+        self.data_path = os.path.join(os.path.dirname(__file__), f"datasets/{eval_set}.json")
+        self.dataset = self._eval_set_datasets[eval_set]
+        self.number_of_episodes = len(self.dataset)
+        self._current_episode_num = 0
+        self._reset = False
+        self.log_path = 'running/eb_nav/{}'.format(exp_name)
+
+    def seek_episode(self, index):
+        """Make the next reset() load episode `index` of the current eval set."""
+        assert 0 <= index < self.number_of_episodes
+        self._current_episode_num = index
+
+    def episode_scenes(self):
+        """Scene name of every episode in the current eval set, in dataset order."""
+        return [traj_data["scene"] for traj_data in self.dataset]
+
+    @tracing.traced('env.reset')
     def reset(self, **kwargs):
         """
         Reset the environment.
@@ -122,7 +163,28 @@ class EBNavigationEnv(gym.Env):
         traj_data = self.dataset[self._current_episode_num]
         self.episode_data = traj_data
         self.episode_language_instruction = traj_data["instruction"]
+        self._episode_actions = []
+        self.sim_pool.run(lambda: self._reset_controller(traj_data))
+
+        # finish reset environment 
+        # reset episode information
+        self._current_episode_num += 1
+        self._current_step = 0
+
+        self.standing = True
+        obs = {
+            'head_rgb': self.env.last_event.frame
+        }
+        self._reset = True
+        self.episode_log = []
+        self._episode_start_time = time.time()
 
+        self.img_paths = []
+
+        return obs
+
+    def _reset_controller(self, traj_data):
+        """Load the scene of an episode and place the agent at its start pose."""
         scene_name = traj_data["scene"]
         logger.info(f"Restoring scene {scene_name}...")
         self._last_event = self.env.reset(
@@ -159,23 +221,14 @@ class EBNavigationEnv(gym.Env):
             standing=True
         )
 
-        # finish reset environment 
-        # reset episode information
-        self._current_episode_num += 1
-        self._current_step = 0
-
-        self.standing = True
-        obs = {
-            'head_rgb': self.env.last_event.frame
-        }
-        self._reset = True
-        self.episode_log = []
-        self._episode_start_time = time.time()
-
-        self.img_paths = []
-
-        return obs
+    def _restore_episode(self):
+        """Rebuild the current episode on a restarted controller by replaying its actions."""
+        logger.info(f"Replaying {len(self._episode_actions)} actions to restore the episode...")
+        self._reset_controller(self.episode_data)
+        for action in self._episode_actions:
+            self.discrete_action_mapper(action)
     
+    @tracing.traced('sim.step')
     def discrete_action_mapper(self, action_index):
         """
         Maps a discrete action index to the corresponding iTHOR environment action.
@@ -235,6 +288,7 @@ class EBNavigationEnv(gym.Env):
 
         
 
+    @tracing.traced('env.step')
     def step(self, action: int, reasoning, i_flag):
         """
         Perform an action in the environment.
@@ -254,7 +308,8 @@ class EBNavigationEnv(gym.Env):
             if type(action)!=int or action > 7 or action < 0:
                 action = np.random.randint(8)
 
-            self.discrete_action_mapper(action)
+            self.sim_pool.run(lambda: self.discrete_action_mapper(action), restore=self._restore_episode)
+            self._episode_actions.append(action)
             reward, distance = self.measure_success()
             done = True
             info['action_description'] = self.language_skill_set[action]
@@ -263,7 +318,8 @@ class EBNavigationEnv(gym.Env):
             if type(action)!=int or action > 7 or action < 0:
                 action = np.random.randint(8)
 
-            self.discrete_action_mapper(action)
+            self.sim_pool.run(lambda: self.discrete_action_mapper(action), restore=self._restore_episode)
+            self._episode_actions.append(action)
             reward, distance = self.measure_success()
             if reward>0:
                 done = True
@@ -300,6 +356,8 @@ class EBNavigationEnv(gym.Env):
             self.save_episode_log_per_step(0)
         
         self.episode_log = []
+        if done:
+            self.log_sink.end_episode()
 
         return obs, reward, done, info
         
@@ -345,12 +403,11 @@ class EBNavigationEnv(gym.Env):
         self.env.random_initilize(seed)
 
 
+    @tracing.traced('env.save_image')
     def save_image(self, *args, **kwargs):
         """Save current agent view as a PNG image."""
         episode_idx = self._current_episode_num if not len(self.selected_indexes) else self.selected_indexes[self._current_episode_num - 1] + 1
 
-        if not os.path.exists(self.log_path):
-            os.makedirs(self.log_path)
         if self.multiview:
             img1 = Image.fromarray(self.env.last_event.frame)
             img2 = Image.fromarray(self.env.last_event.third_party_camera_frames[-1])
@@ -358,8 +415,8 @@ class EBNavigationEnv(gym.Env):
             # image_path = 'episode_{}_step_{}_{}.png'.format(self._current_episode_num, self._current_step, time_stamp)
             image_path1 = os.path.join(self.log_path, 'episode_{}_step_{}_{}_front.png'.format(episode_idx, self._current_step, time_stamp))
             image_path2 = os.path.join(self.log_path, 'episode_{}_step_{}_{}_top.png'.format(episode_idx, self._current_step, time_stamp))
-            img1.save(image_path1)
-            img2.save(image_path2)
+            self.log_sink.save_image(img1, image_path1)
+            self.log_sink.save_image(img2, image_path2)
             return [image_path1, image_path2]
         
         elif self.multistep:
@@ -368,7 +425,7 @@ class EBNavigationEnv(gym.Env):
             time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
             # image_path = 'episode_{}_step_{}_{}.png'.format(self._current_episode_num, self._current_step, time_stamp)
             image_path = os.path.join(self.log_path, 'episode_{}_step_{}_{}_front.png'.format(episode_idx, self._current_step, time_stamp))
-            img.save(image_path)
+            self.log_sink.save_image(img, image_path)
             self.img_paths.append(image_path)
             if self._current_step<3:
                 return self.img_paths
@@ -381,8 +438,7 @@ class EBNavigationEnv(gym.Env):
                 time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
                 # image_path = 'episode_{}_step_{}_{}.png'.format(self._current_episode_num, self._current_step, time_stamp)
                 image_path = os.path.join(self.log_path, 'episode_{}_step_{}_{}_front.png'.format(episode_idx, self._current_step, time_stamp))
-                img.save(image_path)
-                return image_path
+                return self.log_sink.save_image(img, image_path)
             else:
                 img = Image.fromarray(self.env.last_event.frame)
                 time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
@@ -391,39 +447,20 @@ class EBNavigationEnv(gym.Env):
                 # if self.target_only:
                 # draw_target_box(img, self.env.last_event.instance_detections2D, self.episode_data["targetObjectIds"], image_path)
                 # else:
-                draw_boxes(img,self.env.last_event.instance_detections2D, image_path)
-                # img.save(image_path)
-                return image_path
+                img = draw_boxes(img,self.env.last_event.instance_detections2D)
+                return self.log_sink.save_image(img, image_path)
 
+    @tracing.traced('env.save_log')
     def save_episode_log_per_step(self, flag):
 
         episode_idx = self._current_episode_num if not len(self.selected_indexes) else self.selected_indexes[self._current_episode_num - 1] + 1
 
-        if not os.path.exists(self.log_path):
-            os.makedirs(self.log_path)
-        time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         filename = 'episode_{}.json'.format(episode_idx)
         if len(self.episode_log):
-            with open(os.path.join(self.log_path, filename), 'a') as f:
-                if flag == 1:
-                    f.write('\n\n')
-                    for item in self.episode_log:
-                        if 'object_states' in item:
-                            item.pop('object_states')
-                        try:
-                            json.dump(item, f, ensure_ascii=False)
-                        except:
-                            import pdb;pdb.set_trace()
-                        f.write('\n') 
-                else:
-                    for item in self.episode_log:
-                        if 'object_states' in item:
-                            item.pop('object_states')
-                        try:
-                            json.dump(item, f, ensure_ascii=False)
-                        except:
-                            import pdb;pdb.set_trace()
-                        f.write('\n') 
+            for item in self.episode_log:
+                if 'object_states' in item:
+                    item.pop('object_states')
+            self.log_sink.append_jsonl(os.path.join(self.log_path, filename), self.episode_log, prefix='\n\n' if flag == 1 else '')
 
     # def save_episode_log(self):
     #     if not os.path.exists(self.log_path):
@@ -443,7 +480,7 @@ class EBNavigationEnv(gym.Env):
 
     def close(self):
         """Close the environment."""
-        self.env.stop()
+        self.sim_pool.close()
 
 
 if __name__ == "__main__":
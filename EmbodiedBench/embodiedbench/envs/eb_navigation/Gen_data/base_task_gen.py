@@ -1,5 +1,9 @@
+import os
 import json
+import queue
 import random
+import argparse
+import multiprocessing as mp
 import numpy as np
 from ai2thor.controller import Controller
 from ai2thor.platform import CloudRendering
@@ -39,7 +43,7 @@ def get_object_ids_by_type(metadata, object_type):
 def calculate_distance(pos1, pos2):
     return np.sqrt((pos1['x'] - pos2['x'])**2 + (pos1['z'] - pos2['z'])**2)
 
-def get_valid_pose(controller, target_object_id):
+def get_valid_pose(controller, target_object_id, obj_position, rng=random):
 
     event = controller.step(
         action="GetInteractablePoses",
@@ -51,17 +55,9 @@ def get_valid_pose(controller, target_object_id):
 
     print(len(event.metadata["actionReturn"]))
     
-    # Get object position
-    obj_metadata = next(obj for obj in controller.last_event.metadata["objects"] 
-                       if obj["objectId"] == target_object_id)
-    obj_position = {
-        'x': obj_metadata['position']['x'],
-        'z': obj_metadata['position']['z']
-    }
-    
     valid_poses = []
     poses = event.metadata["actionReturn"]
-    random.shuffle(poses)
+    rng.shuffle(poses)
     for pose in poses:
         pos = {'x': pose['x'], 'z': pose['z']}
         if calculate_distance(pos, obj_position) >= min_distance and calculate_distance(pos, obj_position) <= max_distance:
@@ -71,10 +67,8 @@ def get_valid_pose(controller, target_object_id):
     return None
     #random.choice(valid_poses) if valid_poses else None
 
-def generate_dataset(mapping_filepath, output_filepath):
-    """Generate the complete navigation dataset."""
-    # Initialize controller
-    controller = Controller(
+def make_controller():
+    return Controller(
         agentMode="default",
         visibilityDistance=5,
         scene="FloorPlan1",
@@ -86,60 +80,145 @@ def generate_dataset(mapping_filepath, output_filepath):
         fieldOfView = 90,
         platform = CloudRendering
     )
+
+def generate_task(controller, scene, target_type, seed=0):
+    """Generate the navigation task of one scene, or None if the scene has no valid task.
+    The pose sampling is seeded per scene, so the result does not depend on which worker runs it."""
+    rng = random.Random(f"{seed}-{scene}")
+
+    # Initialize scene
+    controller.reset(scene=scene)
+    objects = {obj["objectId"]: obj for obj in controller.last_event.metadata["objects"]}
     
-    scene_mapping = load_scene_object_mapping(mapping_filepath)
-    tasks = []
+    # Get all objects of target type
+    target_objects = get_object_ids_by_type(controller.last_event.metadata, target_type)
     
-    for scene, target_type in scene_mapping.items():
-        # Initialize scene
-        controller.reset(scene=scene)
+    if not target_objects:
+        print(f"Warning: No {target_type} found in {scene}")
+        return None
         
-        # Get all objects of target type
-        target_objects = get_object_ids_by_type(controller.last_event.metadata, target_type)
+    # Select first target object
+    target_object_id = target_objects[0]
+    target_position = objects[target_object_id]["position"]
+    
+    # Get other objects to hide (all objects of same type except the target)
+    objects_to_hide = target_objects[1:] if len(target_objects) > 1 else []
+
+    # Get valid initial pose
+    pose = get_valid_pose(controller, target_object_id, {'x': target_position['x'], 'z': target_position['z']}, rng)
+    if not pose:
+        print(f"Warning: Could not find valid pose in {scene}")
+        return None
         
-        if not target_objects:
-            print(f"Warning: No {target_type} found in {scene}")
-            continue
-            
-        # Select first target object
-        target_object_id = target_objects[0]
+    # Create task entry
+    return {
+        "targetObjectType": target_type,
+        "targetObjectIds": target_object_id,
+        "target_position": target_position,
+        "agentPose": {
+            "position": {
+                "x": pose["x"],
+                "y": pose["y"],
+                "z": pose["z"]
+            },
+            "rotation": pose["rotation"],
+            "horizon": pose["horizon"]
+        },
+        "scene": scene,
+        "object_to_hide": objects_to_hide,
+        "instruction": f"navigate to the {target_type} in the room and be as close as possible to it"
+    }
+
+def load_checkpoint(checkpoint_path):
+    """Scenes already generated, from the JSONL checkpoint: scene -> task (None if the scene has no task)."""
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    records, truncated = [], False
+    with open(checkpoint_path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:  # line cut short by an interrupted run
+                truncated = True
+    if truncated:
+        # drop the partial line so that new records are appended after a clean newline
+        with open(checkpoint_path, 'w') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+    for record in records:
+        done[record["scene"]] = record["task"]
+    return done
 
-        for obj in controller.last_event.metadata["objects"]:
-            if obj["objectId"] == target_object_id:
-                target_position = obj["position"]
+def _worker(scene_queue, result_queue, seed):
+    # every worker process owns its controller and takes whole scenes from the queue
+    controller = make_controller()
+    try:
+        while True:
+            try:
+                scene, target_type = scene_queue.get(timeout=1)
+            except queue.Empty:
                 break
-        
-        # Get other objects to hide (all objects of same type except the target)
-        objects_to_hide = target_objects[1:] if len(target_objects) > 1 else []
+            try:
+                result_queue.put((scene, generate_task(controller, scene, target_type, seed), None))
+            except Exception as e:
+                result_queue.put((scene, None, repr(e)))
+    finally:
+        controller.stop()
 
-        # print(target_object_id)
-        
-        # Get valid initial pose
-        pose = get_valid_pose(controller, target_object_id)
-        if not pose:
-            print(f"Warning: Could not find valid pose in {scene}")
+def _generate_parallel(todo, num_workers, seed):
+    scene_queue, result_queue = mp.Queue(), mp.Queue()
+    for item in todo:
+        scene_queue.put(item)
+    procs = [mp.Process(target=_worker, args=(scene_queue, result_queue, seed)) for _ in range(min(num_workers, len(todo)))]
+    for proc in procs:
+        proc.start()
+    received = 0
+    while received < len(todo):
+        try:
+            result = result_queue.get(timeout=10)
+        except queue.Empty:
+            if not any(proc.is_alive() for proc in procs):
+                break
             continue
-            
-        # Create task entry
-        task = {
-            "targetObjectType": target_type,
-            "targetObjectIds": target_object_id,
-            "target_position": target_position,
-            "agentPose": {
-                "position": {
-                    "x": pose["x"],
-                    "y": pose["y"],
-                    "z": pose["z"]
-                },
-                "rotation": pose["rotation"],
-                "horizon": pose["horizon"]
-            },
-            "scene": scene,
-            "object_to_hide": objects_to_hide,
-            "instruction": f"navigate to the {target_type} in the room and be as close as possible to it"
-        }
-        
-        tasks.append(task)
+        received += 1
+        yield result
+    for proc in procs:
+        proc.join()
+
+def _generate_serial(todo, seed):
+    controller = make_controller()
+    try:
+        for scene, target_type in todo:
+            yield scene, generate_task(controller, scene, target_type, seed), None
+    finally:
+        controller.stop()
+
+def generate_dataset(mapping_filepath, output_filepath, num_workers=1, checkpoint_path=None, seed=0):
+    """Generate the complete navigation dataset.
+    Tasks are streamed to a JSONL checkpoint as scenes finish, so an interrupted run resumes
+    where it stopped. The dataset is then merged in the order of the scene mapping."""
+    scene_mapping = load_scene_object_mapping(mapping_filepath)
+    checkpoint_path = checkpoint_path or output_filepath + '.jsonl'
+    done = load_checkpoint(checkpoint_path)
+    todo = [(scene, target_type) for scene, target_type in scene_mapping.items() if scene not in done]
+    print(f"{len(scene_mapping) - len(todo)} scenes already generated, {len(todo)} to go")
+
+    if todo:
+        results = _generate_parallel(todo, num_workers, seed) if num_workers > 1 else _generate_serial(todo, seed)
+        with open(checkpoint_path, 'a') as f:
+            for scene, task, error in results:
+                if error is not None:
+                    # not checkpointed, the scene is retried on the next run
+                    print(f"Warning: generating {scene} failed: {error}")
+                    continue
+                f.write(json.dumps({"scene": scene, "task": task}) + '\n')
+                f.flush()
+                done[scene] = task
+
+    missing = [scene for scene in scene_mapping if scene not in done]
+    if missing:
+        print(f"Warning: {len(missing)} scenes not generated yet, run again to resume: {missing}")
+    tasks = [done[scene] for scene in scene_mapping if done.get(scene) is not None]
     
     # Save dataset
     dataset = {"tasks": tasks}
@@ -150,6 +229,11 @@ def generate_dataset(mapping_filepath, output_filepath):
     return dataset
 
 if __name__ == "__main__":
-    mapping_filepath = "FloorPlan.json"  # Your input JSON file
-    output_filepath = "base_navigation_new.json"     # Output dataset file
-    dataset = generate_dataset(mapping_filepath, output_filepath)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mapping', type=str, default="FloorPlan.json", help="scene -> target object type")
+    parser.add_argument('--output', type=str, default="base_navigation_new.json")
+    parser.add_argument('--checkpoint', type=str, default=None, help="JSONL checkpoint, <output>.jsonl by default")
+    parser.add_argument('--num_workers', type=int, default=1, help="worker processes, each with its own controller")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    dataset = generate_dataset(args.mapping, args.output, args.num_workers, args.checkpoint, args.seed)
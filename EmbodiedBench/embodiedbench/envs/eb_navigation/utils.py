@@ -53,7 +53,7 @@ valid_objs = ['Cart', 'Potato', 'Faucet', 'Ottoman', 'CoffeeMachine', 'Candle',
 def random_color():
     return tuple(np.random.choice(range(256), size=3))
 
-def draw_boxes(image, classes_and_boxes, image_path):
+def draw_boxes(image, classes_and_boxes, image_path=None):
     draw = ImageDraw.Draw(image)
     font = ImageFont.load_default()
     font.size = 8
@@ -72,8 +72,9 @@ def draw_boxes(image, classes_and_boxes, image_path):
             # Add class name above the rectangle
             # text_position = (x1, max(0, y1 - 12))  # Position text above box
             # draw.text(text_position, name, fill=color, font=font)
-    image.save(image_path)
-    # return image
+    if image_path is not None:
+        image.save(image_path)
+    return image
 
 
 
@@ -0,0 +1,222 @@
+"""
+Buffered, asynchronous writer for episode logs and frames.
+
+Envs hand JSONL records and PNG frames to the process-wide sink returned by
+`get_log_sink()` instead of touching the filesystem on the step path. A single
+background thread takes jobs from a bounded queue in batches, creates folders
+once, coalesces consecutive appends to the same file and encodes frames.
+Frames that are still queued can be read back through `read_file_bytes`. It
+returns once the frame is written, so callers may also reopen or overwrite the
+file afterwards, as the EB-Manipulation drawing helpers do.
+
+`end_episode()` queues an fsync of every file written during the episode
+without blocking the caller. `drain()` blocks until everything queued so far is
+written and `flush()` until it is also synced to disk. The sink is flushed and
+closed when the interpreter exits, also after an uncaught exception.
+"""
+import atexit
+import io
+import json
+import logging
+import os
+import queue
+import threading
+
+from embodiedbench import tracing
+
+logger = logging.getLogger("EB_logger")
+
+_STOP = ('stop',)
+
+
+class _PendingFrame:
+    def __init__(self):
+        self.ready = threading.Event()
+        self.data = None
+
+
+class EpisodeLogSink:
+    def __init__(self, max_queue=256, batch_size=64, name='episode-log-writer'):
+        """
+        Args:
+            max_queue (int): jobs buffered before callers block
+            batch_size (int): jobs the writer handles per wake-up
+        """
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._dirs = set()
+        self._dirty = set()
+        self._closed = False
+        self.jobs = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # ---- producer side, called from the step path ----
+
+    def save_image(self, image, path):
+        """Queue a PIL image to be written as PNG; returns path."""
+        pending = _PendingFrame()
+        with self._pending_lock:
+            self._pending[path] = pending
+        self._put(('image', path, image, pending))
+        return path
+
+    def append_jsonl(self, path, records, prefix=''):
+        """Queue records to be appended to path, one JSON object per line. The sink owns records from here on."""
+        self._put(('text', path, 'a', prefix, list(records)))
+
+    def write_jsonl(self, path, records):
+        """Like append_jsonl, but replaces the file."""
+        self._put(('text', path, 'w', '', list(records)))
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the writer thread, e.g. to encode a video."""
+        self._put(('call', fn, args))
+
+    def end_episode(self):
+        """Make the files written so far durable, without waiting for it."""
+        self._put(('sync', None))
+
+    def flush(self):
+        """Block until every queued job is written and synced to disk."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._put(('sync', done))
+        done.wait()
+
+    def drain(self):
+        """Block until every queued job is written, without syncing; for readers in other processes."""
+        if not self._closed:
+            self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def read_bytes(self, path):
+        """Contents of path; a queued frame is waited for until it is written and served from memory."""
+        with self._pending_lock:
+            pending = self._pending.get(path)
+        if pending is not None:
+            pending.ready.wait()
+            if pending.data is not None:
+                return pending.data
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _put(self, job):
+        if self._closed:
+            raise RuntimeError('episode log sink is closed')
+        self._queue.put(job)
+
+    # ---- writer thread ----
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._process(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _process(self, batch):
+        i = 0
+        while i < len(batch):
+            job = batch[i]
+            i += 1
+            if job is _STOP:
+                return True
+            self.jobs += 1
+            try:
+                if job[0] == 'text':
+                    _, path, mode, prefix, records = job
+                    chunks = [prefix] + [json.dumps(record, ensure_ascii=False) + '\n' for record in records]
+                    # consecutive appends to the same file share one open()
+                    while i < len(batch) and batch[i][0] == 'text' and batch[i][1] == path and batch[i][2] == 'a':
+                        _, _, _, prefix, records = batch[i]
+                        chunks.append(prefix)
+                        chunks.extend(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+                        i += 1
+                        self.jobs += 1
+                    with tracing.span('sink.write_text'):
+                        self._write(path, mode, ''.join(chunks).encode('utf-8'))
+                elif job[0] == 'image':
+                    self._write_image(*job[1:])
+                elif job[0] == 'call':
+                    job[1](*job[2])
+                elif job[0] == 'sync':
+                    with tracing.span('sink.sync'):
+                        self._sync()
+                    if job[1] is not None:
+                        job[1].set()
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"episode log writer failed on {job[0]} job: {type(e).__name__}: {e}")
+                if job[0] == 'sync' and job[1] is not None:
+                    job[1].set()
+        return False
+
+    def _write_image(self, path, image, pending):
+        try:
+            buffer = io.BytesIO()
+            with tracing.span('sink.encode_image'):
+                image.save(buffer, format='PNG')
+            pending.data = buffer.getvalue()
+            with tracing.span('sink.write_image'):
+                self._write(path, 'w', pending.data)
+        finally:
+            pending.ready.set()
+            with self._pending_lock:
+                if self._pending.get(path) is pending:
+                    del self._pending[path]
+
+    def _write(self, path, mode, data):
+        folder = os.path.dirname(path)
+        if folder and folder not in self._dirs:
+            os.makedirs(folder, exist_ok=True)
+            self._dirs.add(folder)
+        with open(path, mode + 'b') as f:
+            f.write(data)
+        self._dirty.add(path)
+
+    def _sync(self):
+        dirty, self._dirty = self._dirty, set()
+        for path in dirty:
+            with open(path, 'ab') as f:
+                os.fsync(f.fileno())
+
+
+_sink = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink():
+    """The process-wide sink shared by all envs."""
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = EpisodeLogSink()
+            atexit.register(_sink.close)
+        return _sink
+
+
+def read_file_bytes(path):
+    """Read a file that may still be queued in the sink."""
+    if _sink is not None:
+        return _sink.read_bytes(path)
+    with open(path, 'rb') as f:
+        return f.read()
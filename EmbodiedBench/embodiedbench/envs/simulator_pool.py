@@ -0,0 +1,232 @@
+"""
+Warm pool of AI2-THOR simulator instances with a watchdog.
+
+The env talks to `pool.active`. Every simulator call made through `pool.run`
+is guarded by a per-step timeout, and a heartbeat thread checks that the Unity
+process of the active instance (and of the warm spares) is still alive between
+calls. The heartbeat only notices a process that died; a hung step is caught
+by the timeout alone, so with step_timeout=None a hang blocks the run. When the active instance hangs or dies it is killed, a warm spare takes
+its place, the caller's restore callback rebuilds the current episode on it and
+the failed call is retried once. Spares are relaunched in the background so the
+pool stays warm.
+"""
+import os
+import signal
+import threading
+import time
+
+from embodiedbench.main import logger
+
+
+class SimulatorTimeout(RuntimeError):
+    pass
+
+
+def unity_process_alive(controller):
+    """Return False once the Unity process behind an ai2thor controller has exited."""
+    server = getattr(controller, 'server', None)
+    proc = getattr(server, 'unity_proc', None)
+    if proc is not None:
+        return proc.poll() is None
+    pid = getattr(controller, 'unity_pid', None)
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _kill_unity(controller):
+    pid = getattr(controller, 'unity_pid', None)
+    if pid is not None:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    # stop() may block on a dead server, so it gets a bounded amount of time
+    stopper = threading.Thread(target=lambda: _quiet_stop(controller), daemon=True)
+    stopper.start()
+    stopper.join(10)
+
+
+def _quiet_stop(controller):
+    try:
+        controller.stop()
+    except Exception:
+        pass
+
+
+class SimulatorPool:
+    def __init__(self, factory, size=1, step_timeout=None, heartbeat_interval=30, is_alive=unity_process_alive, name='simulator'):
+        """
+        Args:
+            factory: callable returning a started simulator
+            size (int): instances kept launched, the active one plus size - 1 warm spares
+            step_timeout (float): seconds a single call may take before the instance is
+                considered hung, None to call without a watchdog (a hung call then blocks forever)
+            heartbeat_interval (float): seconds between liveness checks, 0 to disable
+            is_alive: callable telling whether an instance is still usable
+        """
+        self.factory = factory
+        self.size = max(1, int(size))
+        self.step_timeout = step_timeout
+        self.is_alive = is_alive
+        self.name = name
+
+        self._call_lock = threading.RLock()
+        self._spare_lock = threading.Lock()
+        self._spares = []
+        self._pending_spares = 0
+
+        self.active = factory()
+        for _ in range(self.size - 1):
+            self._spares.append(factory())
+        self._healthy = True
+
+        self.restarts = 0
+        self.timeouts = 0
+        self.failed_heartbeats = 0
+        self.calls = 0
+        self._busy_seconds = 0.0
+        self._start_time = time.time()
+
+        self._stop = threading.Event()
+        self._heartbeat = None
+        if heartbeat_interval:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, args=(heartbeat_interval,), daemon=True)
+            self._heartbeat.start()
+
+    def run(self, fn, restore=None):
+        """
+        Call fn() on the active simulator. If the call times out, or raises while the
+        simulator is dead, the instance is replaced, restore() is called on the new
+        one and fn() is retried once. Errors from a healthy simulator are re-raised.
+        """
+        if not self._healthy:
+            self._recover(restore)
+        try:
+            return self._call(fn)
+        except Exception as e:
+            if not isinstance(e, SimulatorTimeout) and self.is_alive(self.active):
+                raise
+            logger.warning(f"{self.name} failed ({type(e).__name__}: {e}), restarting")
+        self._recover(restore)
+        return self._call(fn)
+
+    def _recover(self, restore):
+        self.restart()
+        if restore is not None:
+            try:
+                self._call(restore)
+            except Exception:
+                # the episode is not on the new instance, so the next run() has to recover again
+                self._healthy = False
+                raise
+
+    def _call(self, fn):
+        with self._call_lock:
+            self.calls += 1
+            start = time.time()
+            try:
+                if self.step_timeout is None:
+                    return fn()
+                result = {}
+
+                def target():
+                    try:
+                        result['value'] = fn()
+                    except BaseException as e:
+                        result['error'] = e
+
+                worker = threading.Thread(target=target, daemon=True)
+                worker.start()
+                worker.join(self.step_timeout)
+                if worker.is_alive():
+                    # the worker is left behind; it unblocks once restart() kills the process
+                    self.timeouts += 1
+                    self._healthy = False
+                    raise SimulatorTimeout(f"{self.name} call exceeded {self.step_timeout}s")
+                if 'error' in result:
+                    raise result['error']
+                return result.get('value')
+            finally:
+                self._busy_seconds += time.time() - start
+
+    def restart(self):
+        """Replace the active instance with a warm spare, or a fresh one if none is ready."""
+        with self._call_lock:
+            self.restarts += 1
+            _kill_unity(self.active)
+            with self._spare_lock:
+                spare = self._spares.pop(0) if self._spares else None
+            self.active = spare if spare is not None else self.factory()
+            self._healthy = True
+            logger.info(f"{self.name} restarted ({'warm spare' if spare is not None else 'cold start'})")
+        self._replenish()
+
+    def _replenish(self):
+        with self._spare_lock:
+            missing = self.size - 1 - len(self._spares) - self._pending_spares
+            self._pending_spares += max(missing, 0)
+        for _ in range(max(missing, 0)):
+            threading.Thread(target=self._launch_spare, daemon=True).start()
+
+    def _launch_spare(self):
+        try:
+            spare = self.factory()
+        except Exception as e:
+            logger.warning(f"failed to launch a spare {self.name}: {e}")
+            spare = None
+        with self._spare_lock:
+            self._pending_spares -= 1
+            if spare is not None and not self._stop.is_set():
+                self._spares.append(spare)
+                spare = None
+        if spare is not None:
+            _quiet_stop(spare)
+
+    def _heartbeat_loop(self, interval):
+        while not self._stop.wait(interval):
+            # skip the beat while a call is running, the step timeout covers that case
+            if self._call_lock.acquire(blocking=False):
+                try:
+                    if self._healthy and not self.is_alive(self.active):
+                        self.failed_heartbeats += 1
+                        self._healthy = False
+                        logger.warning(f"{self.name} heartbeat failed, restarting before the next call")
+                finally:
+                    self._call_lock.release()
+            with self._spare_lock:
+                dead = [s for s in self._spares if not self.is_alive(s)]
+                self._spares = [s for s in self._spares if s not in dead]
+            if dead:
+                self.failed_heartbeats += len(dead)
+                for spare in dead:
+                    _kill_unity(spare)
+                self._replenish()
+
+    def stats(self):
+        uptime = time.time() - self._start_time
+        return {
+            'pool_size': self.size,
+            'warm_spares': len(self._spares),
+            'calls': self.calls,
+            'restarts': self.restarts,
+            'timeouts': self.timeouts,
+            'failed_heartbeats': self.failed_heartbeats,
+            'busy_seconds': round(self._busy_seconds, 2),
+            'uptime_seconds': round(uptime, 2),
+            'utilization': round(self._busy_seconds / uptime, 4) if uptime > 0 else 0.0,
+        }
+
+    def close(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(1)
+        logger.info(f"{self.name} pool stats: {self.stats()}")
+        with self._spare_lock:
+            spares, self._spares = self._spares, []
+        for sim in [self.active] + spares:
+            _quiet_stop(sim)
@@ -7,9 +7,12 @@ from embodiedbench.envs.eb_alfred.EBAlfEnv import EBAlfEnv, ValidEvalSets
 # from embodiedbench.planner.vlm_planner import VLMPlanner
 from embodiedbench.planner.custom_vlm_planner import VLMPlanner
 from embodiedbench.evaluator.summarize_result import average_json_values
+from embodiedbench.evaluator.results_index import get_results_index
 from embodiedbench.evaluator.evaluator_utils import load_saved_data, update_config_with_args
+from embodiedbench.evaluator.episode_scheduler import SceneAffinitySchedule
 from embodiedbench.evaluator.config.system_prompts import alfred_system_prompt
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 example_path = os.path.join(os.path.dirname(__file__), 'config/alfred_examples.json')
 exploration_example_path = os.path.join(os.path.dirname(__file__), 'config/alfred_long_horizon_examples.json')
@@ -33,6 +36,8 @@ class EB_AlfredEvaluator():
                 self.config['multistep'] = 0
         
     def save_episode_metric(self, episode_info):
+        tracing.count('episodes')
+        tracing.count('planner_output_errors', episode_info.get('planner_output_error', 0))
         episode_idx = self.env._current_episode_num if not len(self.env.selected_indexes) else self.env.selected_indexes[self.env._current_episode_num - 1] + 1
         filename = 'episode_{}_final_res.json'.format(episode_idx)
         res_path = os.path.join(self.env.log_path, 'results')
@@ -40,133 +45,196 @@ class EB_AlfredEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        get_results_index().add_episode(res_path, filename, episode_info, benchmark='eb-alf', model=self.model_name,
+                                        exp_name=self.config['exp_name'], eval_set=self.env.eval_set, episode=episode_idx)
+
+    def get_exp_name(self, eval_set):
+        return f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
+
+    def make_env(self, eval_set):
+        return EBAlfEnv(eval_set=eval_set, down_sample_ratio=self.config['down_sample_ratio'], 
+                        exp_name=self.get_exp_name(eval_set), selected_indexes=self.config.get('selected_indexes', []), 
+                        detection_box=self.config.get('detection_box', False),
+                        resolution=self.config.get('resolution', 500), 
+                        sim_pool_size=self.config.get('sim_pool_size', 1),
+                        sim_step_timeout=self.config.get('sim_step_timeout', 300),
+                        reward_type=self.config.get('reward_type', 'dense'),
+                        skill_macro=self.config.get('skill_macro', False),
+                        )
+
+    def load_examples(self, eval_set):
+        return json.load(open(example_path, 'r+')) if eval_set != 'long_horizon' else json.load(open(exploration_example_path, 'r+'))
+
+    def make_planner(self):
+        examples = self.load_examples(self.eval_set)
+        model_type = self.config.get('model_type', 'remote')
+        return VLMPlanner(self.model_name, model_type, self.env.language_skill_set, system_prompt, examples, n_shot=self.config['n_shots'], 
+                          obs_key='head_rgb', chat_history=self.config['chat_history'], language_only=self.config['language_only'],
+                          use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1))
+
+    def save_summary(self):
+        average_json_values(os.path.join(self.env.log_path, 'results'), output_file='summary.json')
+        with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
+            f.write(str(self.config))
+        tracing.export_run(self.env.log_path)
 
     def evaluate_main(self):
+        tracing.configure(self.config)
         valid_eval_sets = self.config.get('eval_sets', ValidEvalSets)
         valid_eval_sets = list(valid_eval_sets)
         if type(valid_eval_sets) == list and len(valid_eval_sets) == 0:
             valid_eval_sets = ValidEvalSets
 
+        if self.config.get('scene_affinity', False):
+            self.evaluate_scheduled(valid_eval_sets)
+            return
+
         for eval_set in valid_eval_sets:
             if self.env is not None:
                 self.env.close()
             self.eval_set = eval_set
             logger.info(f'Current eval set: {eval_set}')
-            exp_name = f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
-            self.env = EBAlfEnv(eval_set=self.eval_set, down_sample_ratio=self.config['down_sample_ratio'], 
-                                          exp_name=exp_name, selected_indexes=self.config.get('selected_indexes', []), 
-                                          detection_box=self.config.get('detection_box', False),
-                                          resolution=self.config.get('resolution', 500), 
-                                          )
-            examples = json.load(open(example_path, 'r+')) if self.eval_set != 'long_horizon' else json.load(open(exploration_example_path, 'r+'))
-            model_type = self.config.get('model_type', 'remote')
-            self.planner = VLMPlanner(self.model_name, model_type, self.env.language_skill_set, system_prompt, examples, n_shot=self.config['n_shots'], 
-                                            obs_key='head_rgb', chat_history=self.config['chat_history'], language_only=self.config['language_only'],
-                                            use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1))
+            self.env = self.make_env(self.eval_set)
+            self.planner = self.make_planner()
 
             self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), output_file='summary.json')
-            with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
-                f.write(str(self.config))
+            self.save_summary()
+
+    def evaluate_scheduled(self, eval_sets):
+        """Run all eval sets on one simulator, visiting episodes grouped by scene."""
+        if self.env is not None:
+            self.env.close()
+        self.eval_set = eval_sets[0]
+        self.env = self.make_env(self.eval_set)
+        self.planner = self.make_planner()
+
+        eval_set_scenes = {}
+        for eval_set in eval_sets:
+            self.env.set_eval_set(eval_set, self.get_exp_name(eval_set))
+            eval_set_scenes[eval_set] = self.env.episode_scenes()
+        schedule = SceneAffinitySchedule(eval_set_scenes)
+        logger.info(f'Scheduled {len(schedule)} episodes of {eval_sets}: {schedule.scene_switches} scene switches instead of {schedule.unscheduled_scene_switches}')
+
+        progress_bar = tqdm(total=len(schedule), desc="Episodes")
+        current_set = None
+        for eval_set, index, _ in schedule:
+            if eval_set != current_set:
+                current_set = eval_set
+                self.env.set_eval_set(eval_set, self.get_exp_name(eval_set))
+                self.eval_set = eval_set
+                self.planner.examples = self.load_examples(eval_set)
+            self.env.seek_episode(index)
+            self.evaluate_episode()
+            progress_bar.update()
+            if schedule.finish(eval_set):
+                self.save_summary()
 
     def evaluate(self):
         progress_bar = tqdm(total=self.env.number_of_episodes, desc="Episodes")
         while self.env._current_episode_num < self.env.number_of_episodes:
-            logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
-            episode_info = {'reward': [], 'num_invalid_actions': 0, 'empty_plan': 0}
-            obs = self.env.reset()
-            img_path = self.env.save_image(obs)
-            user_instruction = self.env.episode_language_instruction
-            print(f"Instruction: {user_instruction}")
-
-            self.planner.reset()
-            # update the action space for alfred due to dynamic objects
-            self.planner.set_actions(self.env.language_skill_set)
-            done = False
-            while not done:
-                try: 
-                    action, reasoning = self.planner.act(img_path, user_instruction)
-                    print(f"Planner Output Action: {action}")
-                    if action == -2: # empty plan stop here
-                        episode_info['empty_plan'] = 1
-                        self.env.episode_log.append({
-                            'last_action_success': 0.0,
-                            'action_id': -2,
-                            'action_description': 'empty plan',
-                            'reasoning': reasoning,
-                        })
-                        info = {
-                            'task_success': episode_info.get('task_success', 0),
-                            'task_progress': episode_info.get("task_progress", 0),
-                            'env_step': self.env._current_step,
-                        }
-                        break 
-                    if action == -1:
-                        self.env._cur_invalid_actions += 1
-                        episode_info['reward'].append(-1)
-                        episode_info['num_invalid_actions'] += 1
-                        self.env.episode_log.append({
-                            'last_action_success': 0.0,
-                            'action_id': -1,
-                            'action_description': 'invalid action',
-                            'reasoning': reasoning,
-                        })
-                        info = {
-                            'task_success': episode_info.get('task_success', 0),
-                            'task_progress': episode_info.get("task_progress", 0),
-                            'env_step': self.env._current_step,
-                        }
-                        if self.env._cur_invalid_actions >= self.env._max_invalid_actions:
-                            break
-                        continue
-                    
-                    # mutiple actions
-                    if type(action) == list:
-                        for action_single in action[:min(self.env._max_episode_steps - self.env._current_step, len(action))]:
-                            obs, reward, done, info = self.env.step(action_single, reasoning=reasoning)
-                            action_str = action_single if type(action_single) == str else self.env.language_skill_set[action_single]
-                            print(f"Executed action: {action_str}, Task success: {info['task_success']}")
-                            logger.debug(f"reward: {reward}")
-                            logger.debug(f"terminate: {done}\n")
-                            self.planner.update_info(info)
-                            img_path = self.env.save_image(obs)
-                            episode_info['reward'].append(reward)
-                            episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
-                            if done or not info['last_action_success']:
-                                # stop or replanning
-                                print("Invalid action or task complete. If invalid then Replanning.")
-                                break
-                    else: # single action
-                        obs, reward, done, info = self.env.step(action, reasoning=reasoning)
-                        action_str = action if type(action) == str else self.env.language_skill_set[action]
+            self.evaluate_episode()
+            progress_bar.update()
+
+    @tracing.traced('episode')
+    def evaluate_episode(self):
+        logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
+        episode_info = {'reward': [], 'num_invalid_actions': 0, 'empty_plan': 0}
+        obs = self.env.reset()
+        img_path = self.env.save_image(obs)
+        user_instruction = self.env.episode_language_instruction
+        print(f"Instruction: {user_instruction}")
+
+        self.planner.reset()
+        # update the action space for alfred due to dynamic objects
+        self.planner.set_actions(self.env.language_skill_set)
+        done = False
+        while not done:
+            try: 
+                action, reasoning = self.planner.act(img_path, user_instruction)
+                print(f"Planner Output Action: {action}")
+                if action == -2: # empty plan stop here
+                    episode_info['empty_plan'] = 1
+                    self.env.episode_log.append({
+                        'last_action_success': 0.0,
+                        'action_id': -2,
+                        'action_description': 'empty plan',
+                        'reasoning': reasoning,
+                    })
+                    info = {
+                        'task_success': episode_info.get('task_success', 0),
+                        'task_progress': episode_info.get("task_progress", 0),
+                        'env_step': self.env._current_step,
+                    }
+                    break 
+                if action == -1:
+                    self.env._cur_invalid_actions += 1
+                    episode_info['reward'].append(-1)
+                    episode_info['num_invalid_actions'] += 1
+                    self.env.episode_log.append({
+                        'last_action_success': 0.0,
+                        'action_id': -1,
+                        'action_description': 'invalid action',
+                        'reasoning': reasoning,
+                    })
+                    info = {
+                        'task_success': episode_info.get('task_success', 0),
+                        'task_progress': episode_info.get("task_progress", 0),
+                        'env_step': self.env._current_step,
+                    }
+                    if self.env._cur_invalid_actions >= self.env._max_invalid_actions:
+                        break
+                    continue
+                
+                # mutiple actions
+                if type(action) == list:
+                    for action_single in action[:min(self.env._max_episode_steps - self.env._current_step, len(action))]:
+                        obs, reward, done, info = self.env.step(action_single, reasoning=reasoning)
+                        action_str = action_single if type(action_single) == str else self.env.language_skill_set[action_single]
                         print(f"Executed action: {action_str}, Task success: {info['task_success']}")
                         logger.debug(f"reward: {reward}")
                         logger.debug(f"terminate: {done}\n")
-                        
                         self.planner.update_info(info)
                         img_path = self.env.save_image(obs)
                         episode_info['reward'].append(reward)
                         episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
-                
-                except Exception as e: 
-                    print(e)
-                    time.sleep(30)
+                        if done or not info['last_action_success']:
+                            # stop or replanning
+                            print("Invalid action or task complete. If invalid then Replanning.")
+                            break
+                else: # single action
+                    obs, reward, done, info = self.env.step(action, reasoning=reasoning)
+                    action_str = action if type(action) == str else self.env.language_skill_set[action]
+                    print(f"Executed action: {action_str}, Task success: {info['task_success']}")
+                    logger.debug(f"reward: {reward}")
+                    logger.debug(f"terminate: {done}\n")
+                    
+                    self.planner.update_info(info)
+                    img_path = self.env.save_image(obs)
+                    episode_info['reward'].append(reward)
+                    episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
+            
+            except Exception as e: 
+                print(e)
+                time.sleep(30)
 
-            # evaluation metrics
-            episode_info['instruction'] = user_instruction
+        # evaluation metrics
+        episode_info['instruction'] = user_instruction
+        if self.env.reward_type == 'deferred' and len(episode_info['reward']):
+            # the dense subgoal rewards held back during the episode are added to the step rewards
+            episode_info['reward'] = (np.sum(episode_info['reward']) + self.env.get_deferred_reward()) / len(episode_info['reward'])
+        else:
             episode_info['reward'] = np.mean(episode_info['reward'])
-            episode_info['task_success'] = info['task_success']
-            episode_info["task_progress"] = info['task_progress']
-            episode_info['num_steps'] = info["env_step"]
-            episode_info['planner_steps'] = self.planner.planner_steps
-            episode_info['planner_output_error'] = self.planner.output_json_error
-            episode_info["num_invalid_actions"] = episode_info['num_invalid_actions']
-            episode_info["num_invalid_action_ratio"] = episode_info['num_invalid_actions'] / info["env_step"] if info['env_step'] > 0 else 0
-            episode_info["episode_elapsed_seconds"] = info.get("episode_elapsed_seconds", time.time() - self.env._episode_start_time)
-
-            self.env.save_episode_log()
-            self.save_episode_metric(episode_info)
-            progress_bar.update()
+        episode_info['task_success'] = info['task_success']
+        episode_info["task_progress"] = info['task_progress']
+        episode_info['num_steps'] = info["env_step"]
+        episode_info['planner_steps'] = self.planner.planner_steps
+        episode_info['planner_output_error'] = self.planner.output_json_error
+        episode_info["num_invalid_actions"] = episode_info['num_invalid_actions']
+        episode_info["num_invalid_action_ratio"] = episode_info['num_invalid_actions'] / info["env_step"] if info['env_step'] > 0 else 0
+        episode_info["episode_elapsed_seconds"] = info.get("episode_elapsed_seconds", time.time() - self.env._episode_start_time)
+
+        self.env.save_episode_log()
+        self.save_episode_metric(episode_info)
 
 
 if __name__ == '__main__':
@@ -186,6 +254,12 @@ if __name__ == '__main__':
         parser.add_argument('--resolution', type=int, help='Resolution for processing.')
         parser.add_argument('--env_feedback', type=int, help='Set to True to enable environment feedback.')
         parser.add_argument('--tp', type=int, help='number of tensor parallel splits of the model parameters')
+        parser.add_argument('--sim_pool_size', type=int, help='Number of simulator instances kept launched (active plus warm spares).')
+        parser.add_argument('--sim_step_timeout', type=float, help='Seconds before a simulator call is treated as hung and the simulator restarted (default 300).')
+        parser.add_argument('--reward_type', type=str, help='Reward computation: none, sparse, dense or deferred. Subgoals are only tracked by dense and deferred.')
+        parser.add_argument('--scene_affinity', type=int, help='Set to True to run all eval sets on one simulator grouped by scene.')
+        parser.add_argument('--skill_macro', type=int, help='Set to True to render only the final observation of multi-step skills.')
+        parser.add_argument('--trace', type=int, help='Set to True to record per-step spans and write trace.json and trace_summary.json.')
         return parser.parse_args()
 
 
@@ -204,6 +278,7 @@ if __name__ == '__main__':
         'resolution': 500, 
         'env_feedback': 1,
         'tp': 1,
+        'scene_affinity': 0,
     }
 
     args = parse_arguments()
@@ -6,9 +6,12 @@ import json
 from embodiedbench.envs.eb_habitat.EBHabEnv import EBHabEnv, ValidEvalSets
 from embodiedbench.planner.vlm_planner import VLMPlanner
 from embodiedbench.evaluator.summarize_result import average_json_values
+from embodiedbench.evaluator.results_index import get_results_index
+from embodiedbench.evaluator.episode_scheduler import SceneAffinitySchedule
 from embodiedbench.evaluator.evaluator_utils import load_saved_data, update_config_with_args
 from embodiedbench.evaluator.config.system_prompts import habitat_system_prompt
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 link_path = os.path.join(os.path.dirname(__file__), '../envs/eb_habitat/data')
 try:
@@ -42,138 +45,231 @@ class EB_HabitatEvaluator():
         
         
     def save_episode_metric(self, episode_info):
+        tracing.count('episodes')
+        tracing.count('planner_output_errors', episode_info.get('planner_output_error', 0))
         filename = 'episode_{}_final_res.json'.format(self.env._current_episode_num)
         res_path = os.path.join(self.env.log_path, 'results')
         if not os.path.exists(res_path):
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        get_results_index().add_episode(res_path, filename, episode_info, benchmark='eb-hab', model=self.model_name,
+                                        exp_name=self.config['exp_name'], eval_set=self.env.eval_set, episode=self.env._current_episode_num)
+
+    def get_exp_name(self, eval_set):
+        return f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
+
+    def make_env(self, eval_set, start_epi_index=0):
+        return EBHabEnv(eval_set=eval_set, down_sample_ratio=self.config['down_sample_ratio'], exp_name=self.get_exp_name(eval_set),
+                        start_epi_index=start_epi_index, resolution=self.config.get('resolution', 500))
+
+    def get_log_path(self, eval_set):
+        return 'running/eb_habitat/{}'.format(self.get_exp_name(eval_set))
+
+    def make_planner(self, language_skill_set=None):
+        model_type = self.config.get('model_type', 'remote')
+        if language_skill_set is None:
+            language_skill_set = self.env.language_skill_set
+        return VLMPlanner(self.model_name, model_type, language_skill_set, self.system_prompt, examples, n_shot=self.config['n_shots'], obs_key='head_rgb',
+                          chat_history=self.config['chat_history'], language_only=self.config['language_only'], 
+                          use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1))
+
+    def save_summary(self, log_path=None):
+        log_path = log_path or self.env.log_path
+        average_json_values(os.path.join(log_path, 'results'), output_file='summary.json')
+        with open(os.path.join(log_path, 'config.txt'), 'w') as f:
+            f.write(str(self.config))
+        tracing.export_run(log_path)
 
     def evaluate_main(self):
+        tracing.configure(self.config)
         valid_eval_sets = self.config.get('eval_sets', ValidEvalSets)
         valid_eval_sets = list(valid_eval_sets)
         if type(valid_eval_sets) == list and len(valid_eval_sets) == 0:
             valid_eval_sets = ValidEvalSets
+
+        if self.config.get('num_envs', 1) > 1:
+            self.evaluate_vectorized(valid_eval_sets)
+            return
+
+        if self.config.get('scene_affinity', False):
+            self.evaluate_scheduled(valid_eval_sets)
+            return
             
         for eval_set in valid_eval_sets:
             if self.env is not None:
                 self.env.close()
             self.eval_set = eval_set
             logger.info(f'Current eval set: {eval_set}')
-            exp_name = f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
-            self.env = EBHabEnv(eval_set=self.eval_set, down_sample_ratio=self.config['down_sample_ratio'], exp_name=exp_name,
-                                             start_epi_index=self.config.get('start_epi_index', 0), resolution=self.config.get('resolution', 500))
-
-            model_type = self.config.get('model_type', 'remote')
-            self.planner = VLMPlanner(self.model_name, model_type, self.env.language_skill_set, self.system_prompt, examples, n_shot=self.config['n_shots'], obs_key='head_rgb',
-                                                 chat_history=self.config['chat_history'], language_only=self.config['language_only'], 
-                                                 use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1))
+            self.env = self.make_env(self.eval_set, start_epi_index=self.config.get('start_epi_index', 0))
+            self.planner = self.make_planner()
 
             self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), output_file='summary.json')
-            with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
-                f.write(str(self.config))
+            self.save_summary()
+
+    def evaluate_scheduled(self, eval_sets):
+        """Run all eval sets on one simulator, visiting episodes grouped by scene."""
+        if self.env is not None:
+            self.env.close()
+        self.eval_set = eval_sets[0]
+        self.env = self.make_env(self.eval_set)
+        self.planner = self.make_planner()
+
+        eval_set_scenes = {}
+        for eval_set in eval_sets:
+            self.env.set_eval_set(eval_set, self.get_exp_name(eval_set))
+            eval_set_scenes[eval_set] = self.env.episode_scenes()
+        schedule = SceneAffinitySchedule(eval_set_scenes)
+        logger.info(f'Scheduled {len(schedule)} episodes of {eval_sets}: {schedule.scene_switches} scene switches instead of {schedule.unscheduled_scene_switches}')
+
+        progress_bar = tqdm(total=len(schedule), desc="Episodes")
+        current_set = None
+        for eval_set, index, _ in schedule:
+            if eval_set != current_set:
+                current_set = eval_set
+                self.env.set_eval_set(eval_set, self.get_exp_name(eval_set))
+                self.eval_set = eval_set
+            self.env.seek_episode(index)
+            self.evaluate_episode()
+            progress_bar.update()
+            if schedule.finish(eval_set):
+                self.save_summary()
+
+    def evaluate_vectorized(self, eval_sets):
+        """Run the episodes of eval_sets on num_envs simulators in subprocesses, see habitat_vector_runner."""
+        from embodiedbench.evaluator.habitat_vector_runner import HabitatVectorRunner
+        if self.config.get('stream_plan', False):
+            logger.warning("stream_plan is ignored with num_envs > 1, the other envs already use the simulator time a streamed plan would save")
+        HabitatVectorRunner(self, self.config['num_envs']).run(eval_sets)
 
     def evaluate(self):
         progress_bar = tqdm(total=self.env.number_of_episodes, desc="Episodes")
         while self.env._current_episode_num < self.env.number_of_episodes:
-            logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
-            episode_info = {'reward': [], 'num_invalid_actions': 0, 'empty_plan': 0}
-            obs = self.env.reset()
-            img_path = self.env.save_image(obs)
-            user_instruction = self.env.episode_language_instruction
-            print(f"Instruction: {user_instruction}")
-
-            self.planner.reset()
-            done = False
-            while not done:
-                try: 
+            self.evaluate_episode()
+            progress_bar.update()
+
+    def execute_action(self, action, reasoning, episode_info):
+        obs, reward, done, info = self.env.step(action, reasoning=reasoning)
+        action_str = action if type(action) == str else self.env.language_skill_set[action]
+        print(f"Executed action: {action_str}, Task success: {info['task_success']}")
+        logger.debug(f"reward: {reward}")
+        logger.debug(f"terminate: {done}\n")
+
+        self.planner.update_info(info)
+        img_path = self.env.save_image(obs)
+        episode_info['reward'].append(reward)
+        episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
+        return img_path, done, info
+
+    @tracing.traced('episode')
+    def evaluate_episode(self):
+        logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
+        episode_info = {'reward': [], 'num_invalid_actions': 0, 'empty_plan': 0}
+        obs = self.env.reset()
+        img_path = self.env.save_image(obs)
+        user_instruction = self.env.episode_language_instruction
+        print(f"Instruction: {user_instruction}")
+
+        self.planner.reset()
+        first_action_times = []
+        done = False
+        while not done:
+            try: 
+                early_action = None
+                if self.config.get('stream_plan', False):
+                    plan = self.planner.act_stream(img_path, user_instruction)
+                    early_action = plan.first_action()
+                    if early_action is not None:
+                        # run the first step while the rest of the plan is still being generated
+                        first_action_times.append(plan.time_to_first_action)
+                        img_path, done, info = self.execute_action(early_action, '', episode_info)
+                    action, reasoning = plan.result()
+                else:
                     action, reasoning = self.planner.act(img_path, user_instruction)
-                    print(f"Planner Output Action: {action}")
-
-                    if action == -2: # empty plan stop here
-                        episode_info['empty_plan'] = 1
-                        self.env.episode_log.append({
-                            'last_action_success': 0.0,
-                            'action_id': -2,
-                            'action_description': 'empty plan',
-                            'reasoning': reasoning,
-                        })
-                        info = {
-                            'task_success': episode_info.get('task_success', 0),
-                            'task_progress': episode_info.get("task_progress", 0),
-                            'subgoal_reward': episode_info.get("subgoal_reward", 0),
-                            'env_step': self.env._current_step,
-                        }
-                        break 
-                    if action == -1:
-                        self.env._cur_invalid_actions += 1
-                        episode_info['reward'].append(-1)
-                        episode_info['num_invalid_actions'] += 1
-                        self.env.episode_log.append({
-                            'last_action_success': 0.0,
-                            'action_id': -1,
-                            'action_description': 'invalid action',
-                            'reasoning': reasoning,
-                        })
-                        info = {
-                            'task_success': episode_info.get('task_success', 0),
-                            'task_progress': episode_info.get("task_progress", 0),
-                            'subgoal_reward': episode_info.get("subgoal_reward", 0),
-                            'env_step': self.env._current_step,
-                        }
-                        if self.env._cur_invalid_actions >= self.env._max_invalid_actions:
-                            break
+                print(f"Planner Output Action: {action}")
+
+                if early_action is not None:
+                    info['reasoning'] = reasoning
+                    if done:
                         continue
-                    # multiple actions
+                    # an empty (-2) or invalid (-1) final plan is handled below, as without streaming
                     if type(action) == list:
-                        for action_single in action[:min(self.env._max_episode_steps - self.env._current_step, len(action))]:
-                            obs, reward, done, info = self.env.step(action_single, reasoning=reasoning)
-                            action_str = action_single if type(action_single) == str else self.env.language_skill_set[action_single]
-                            print(f"Executed action: {action_str}, Task success: {info['task_success']}")
-                            logger.debug(f"reward: {reward}")
-                            logger.debug(f"terminate: {done}\n")
-                            
-                            self.planner.update_info(info)
-                            img_path = self.env.save_image(obs)
-                            episode_info['reward'].append(reward)
-                            episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
-                            if done or info['last_action_success'] == 0:
-                                # stop or replanning
-                                print("Invalid action or task complete. If invalid then Replanning.")
-                                break
-                    else:
-                        obs, reward, done, info = self.env.step(action, reasoning=reasoning)
-                        action_str = action if type(action) == str else self.env.language_skill_set[action]
-                        print(f"Executed action: {action_str}, Task success: {info['task_success']}")
-                        logger.debug(f"reward: {reward}")
-                        logger.debug(f"terminate: {done}\n")
-                            
-                        self.planner.update_info(info)
-                        img_path = self.env.save_image(obs)
-                        episode_info['reward'].append(reward)
-                        episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
-                
-                except Exception as e: 
-                    print(e)
-                    time.sleep(30)
-
-            # evaluation metrics
-            episode_info['instruction'] = user_instruction
-            episode_info['reward'] = np.mean(episode_info['reward'])
-            episode_info['task_success'] = info['task_success']
-            episode_info["task_progress"] = info['task_progress']
-            episode_info['subgoal_reward'] = info['subgoal_reward']
-            episode_info['num_steps'] = info["env_step"]
-            episode_info['planner_steps'] = self.planner.planner_steps
-            episode_info['planner_output_error'] = self.planner.output_json_error
-            episode_info["num_invalid_actions"] = episode_info['num_invalid_actions']
-            episode_info["num_invalid_action_ratio"] = episode_info['num_invalid_actions'] / info["env_step"] if info['env_step'] > 0 else 0
-            episode_info["episode_elapsed_seconds"] = info.get("episode_elapsed_seconds", time.time() - self.env._episode_start_time)
+                        if action and action[0] == early_action:
+                            action = action[1:]
+                        else:
+                            # the final plan does not start with the executed step, replan from the new state
+                            logger.warning(f"Streamed first action {early_action} does not match the final plan {action}, replanning")
+                            tracing.count('stream_plan_mismatch')
+                            action = []
+                        if info['last_action_success'] == 0 or not action:
+                            continue
+
+                if action == -2: # empty plan stop here
+                    episode_info['empty_plan'] = 1
+                    self.env.episode_log.append({
+                        'last_action_success': 0.0,
+                        'action_id': -2,
+                        'action_description': 'empty plan',
+                        'reasoning': reasoning,
+                    })
+                    info = {
+                        'task_success': episode_info.get('task_success', 0),
+                        'task_progress': episode_info.get("task_progress", 0),
+                        'subgoal_reward': episode_info.get("subgoal_reward", 0),
+                        'env_step': self.env._current_step,
+                    }
+                    break 
+                if action == -1:
+                    self.env._cur_invalid_actions += 1
+                    episode_info['reward'].append(-1)
+                    episode_info['num_invalid_actions'] += 1
+                    self.env.episode_log.append({
+                        'last_action_success': 0.0,
+                        'action_id': -1,
+                        'action_description': 'invalid action',
+                        'reasoning': reasoning,
+                    })
+                    info = {
+                        'task_success': episode_info.get('task_success', 0),
+                        'task_progress': episode_info.get("task_progress", 0),
+                        'subgoal_reward': episode_info.get("subgoal_reward", 0),
+                        'env_step': self.env._current_step,
+                    }
+                    if self.env._cur_invalid_actions >= self.env._max_invalid_actions:
+                        break
+                    continue
+                # multiple actions
+                if type(action) == list:
+                    for action_single in action[:min(self.env._max_episode_steps - self.env._current_step, len(action))]:
+                        img_path, done, info = self.execute_action(action_single, reasoning, episode_info)
+                        if done or info['last_action_success'] == 0:
+                            # stop or replanning
+                            print("Invalid action or task complete. If invalid then Replanning.")
+                            break
+                else:
+                    img_path, done, info = self.execute_action(action, reasoning, episode_info)
             
-            self.env.save_episode_log()
-            self.save_episode_metric(episode_info)
-            progress_bar.update()
+            except Exception as e: 
+                print(e)
+                time.sleep(30)
+
+        # evaluation metrics
+        episode_info['instruction'] = user_instruction
+        episode_info['reward'] = np.mean(episode_info['reward'])
+        episode_info['task_success'] = info['task_success']
+        episode_info["task_progress"] = info['task_progress']
+        episode_info['subgoal_reward'] = info['subgoal_reward']
+        episode_info['num_steps'] = info["env_step"]
+        episode_info['planner_steps'] = self.planner.planner_steps
+        episode_info['planner_output_error'] = self.planner.output_json_error
+        episode_info["num_invalid_actions"] = episode_info['num_invalid_actions']
+        episode_info["num_invalid_action_ratio"] = episode_info['num_invalid_actions'] / info["env_step"] if info['env_step'] > 0 else 0
+        episode_info["episode_elapsed_seconds"] = info.get("episode_elapsed_seconds", time.time() - self.env._episode_start_time)
+        if first_action_times:
+            episode_info['time_to_first_action'] = float(np.mean(first_action_times))
+        
+        self.env.save_episode_log()
+        self.save_episode_metric(episode_info)
 
 
 if __name__ == '__main__':
@@ -193,6 +289,10 @@ if __name__ == '__main__':
         parser.add_argument('--resolution', type=int, help='Resolution for processing.')
         parser.add_argument('--env_feedback', type=int, help='Set to True to enable environment feedback.')
         parser.add_argument('--tp', type=int, help='number of tensor parallel splits of the model parameters')
+        parser.add_argument('--scene_affinity', type=int, help='Set to True to run all eval sets on one simulator grouped by scene.')
+        parser.add_argument('--trace', type=int, help='Set to True to record per-step spans and write trace.json and trace_summary.json.')
+        parser.add_argument('--stream_plan', type=int, help='Set to True to stream the model response and run the first planned action before the response is complete.')
+        parser.add_argument('--num_envs', type=int, help='Number of simulators run in subprocesses over disjoint episode shards.')
         return parser.parse_args()
 
     config = {
@@ -209,6 +309,9 @@ if __name__ == '__main__':
         'resolution': 500, 
         'env_feedback': 1,
         'tp': 1,
+        'scene_affinity': 0,
+        'stream_plan': 0,
+        'num_envs': 1,
     }
     args = parse_arguments()
     update_config_with_args(config, args)
@@ -3,14 +3,15 @@ import os
 import numpy as np
 from tqdm import tqdm
 import json
-import copy
 import argparse
 from embodiedbench.evaluator.config.system_prompts import eb_manipulation_system_prompt
 from embodiedbench.envs.eb_manipulation.EBManEnv import EBManEnv, EVAL_SETS, ValidEvalSets
 from embodiedbench.envs.eb_manipulation.eb_man_utils import form_object_coord_for_input, draw_bounding_boxes, draw_xyz_coordinate
 from embodiedbench.planner.manip_planner import ManipPlanner
 from embodiedbench.evaluator.config.eb_manipulation_example import vlm_examples_baseline, llm_examples, vlm_examples_ablation
+from embodiedbench.evaluator.results_index import get_results_index
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 class EB_ManipulationEvaluator():
     def __init__(self, config):
@@ -44,12 +45,16 @@ class EB_ManipulationEvaluator():
         return all_examples
 
     def save_episode_metric(self, episode_info):
+        tracing.count('episodes')
+        tracing.count('planner_output_errors', episode_info.get('planner_output_error', 0))
         filename = 'episode_{}_res.json'.format(self.env._current_episode_num)
         res_path = os.path.join(self.env.log_path, 'results')
         if not os.path.exists(res_path):
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        get_results_index().add_episode(res_path, filename, episode_info, benchmark='eb-man', model=self.model_name,
+                                        exp_name=self.config.get('exp_name'), eval_set=self.eval_set, episode=self.env._current_episode_num)
     
     def save_planner_outputs(self, reasoning_list):
         filename = 'planner_output_episode_{}.txt'.format(self.env._current_episode_num)
@@ -110,7 +115,7 @@ class EB_ManipulationEvaluator():
                 camera_views = ['front_rgb']
             img_path_list = self.env.save_image(camera_views)
 
-            avg_obj_coord, all_avg_point_list, camera_extrinsics_list, camera_intrinsics_list = form_object_coord_for_input(vars(copy.deepcopy(obs)), self.env.task_class, camera_views)
+            avg_obj_coord, all_avg_point_list, camera_extrinsics_list, camera_intrinsics_list = form_object_coord_for_input(self.env.last_frame_obs, self.env.task_class, camera_views)
             if not self.config['language_only']:
                 for i, img_path in enumerate(img_path_list):
                     if 'front_rgb' in img_path:
@@ -153,7 +158,7 @@ class EB_ManipulationEvaluator():
                         if done:
                             break
                 
-                avg_obj_coord, all_avg_point_list, camera_extrinsics_list, camera_intrinsics_list = form_object_coord_for_input(copy.deepcopy(obs), self.env.task_class, camera_views)
+                avg_obj_coord, all_avg_point_list, camera_extrinsics_list, camera_intrinsics_list = form_object_coord_for_input(obs, self.env.task_class, camera_views)
                 if not done:
                     if not self.config['language_only']:
                         for i, img_path in enumerate(img_path_list):
@@ -181,6 +186,7 @@ class EB_ManipulationEvaluator():
         self.env.close()
     
     def evaluate_main(self):
+        tracing.configure(self.config)
         valid_eval_sets = self.config.get('eval_sets', ValidEvalSets)
         valid_eval_sets = list(valid_eval_sets)
         if type(valid_eval_sets) == list and len(valid_eval_sets) == 0:
@@ -223,6 +229,7 @@ class EB_ManipulationEvaluator():
             self.evaluate()
             with open(os.path.join(self.log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
+            tracing.export_run(self.log_path)
                 
     def check_config_valid(self):
         if self.config['multiview'] + self.config['multistep'] + self.config['visual_icl'] + self.config['chat_history'] > 1:
@@ -250,6 +257,7 @@ if __name__ == '__main__':
     parser.add_argument('--exp_name', type=str)
     parser.add_argument('--visual_icl', type=int, default=0)
     parser.add_argument('--tp', type=int, default=1, help='number of tensor parallel splits of the model parameters')
+    parser.add_argument('--trace', type=int, default=0, help='Set to True to record per-step spans and write trace.json and trace_summary.json.')
     args = parser.parse_args()
 
     print("\n******** Evaluating eval set: {}, model: {} ********".format(args.eval_sets, args.model_name))
@@ -266,6 +274,7 @@ if __name__ == '__main__':
         'multiview': args.multiview,
         'multistep': args.multistep,
         'visual_icl': args.visual_icl,
+        'trace': args.trace,
         'exp_name': args.exp_name,
         'tp': args.tp,
         'selected_indexes': [0, 12]
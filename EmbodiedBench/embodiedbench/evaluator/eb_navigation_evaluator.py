@@ -6,6 +6,8 @@ import json
 from embodiedbench.envs.eb_navigation.EBNavEnv import EBNavigationEnv, ValidEvalSets
 from embodiedbench.planner.nav_planner import EBNavigationPlanner
 from embodiedbench.evaluator.summarize_result import average_json_values
+from embodiedbench.evaluator.results_index import get_results_index
+from embodiedbench.evaluator.episode_scheduler import SceneAffinitySchedule
 import sys
 import warnings
 
@@ -14,6 +16,7 @@ from time import sleep
 from embodiedbench.evaluator.config.system_prompts import eb_navigation_system_prompt
 from embodiedbench.evaluator.config.eb_navigation_example import examples
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 system_prompt = eb_navigation_system_prompt
 examples = examples
@@ -30,6 +33,8 @@ class EB_NavigationEvaluator():
         self.planner = None
 
     def save_episode_metric(self, episode_info):
+        tracing.count('episodes')
+        tracing.count('planner_output_errors', episode_info.get('planner_output_error', 0))
         episode_idx = self.env._current_episode_num if not len(self.env.selected_indexes) else self.env.selected_indexes[self.env._current_episode_num - 1] + 1
         filename = 'episode_{}_final_res.json'.format(episode_idx)
         res_path = os.path.join(self.env.log_path, 'results')
@@ -37,102 +42,153 @@ class EB_NavigationEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        get_results_index().add_episode(res_path, filename, episode_info, benchmark='eb-nav', model=self.model_name,
+                                        exp_name=self.config['exp_name'], eval_set=self.env.eval_set, episode=episode_idx)
+
+    def get_exp_name(self, eval_set):
+        return f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
+
+    def make_env(self, eval_set):
+        return EBNavigationEnv(eval_set=eval_set, down_sample_ratio=self.config['down_sample_ratio'], 
+                               exp_name=self.get_exp_name(eval_set), multiview=self.config['multiview'], boundingbox=self.config['detection_box'], 
+                               multistep = self.config['multistep'], resolution = self.config['resolution'],
+                               sim_pool_size = self.config.get('sim_pool_size', 1), sim_step_timeout = self.config.get('sim_step_timeout', 300))
+
+    def make_planner(self):
+        return EBNavigationPlanner(model_name=self.model_name, model_type = self.config['model_type'], 
+                                   actions = self.env.language_skill_set, system_prompt = system_prompt, 
+                                   examples = examples, n_shot=self.config['n_shots'], obs_key='head_rgb', 
+                                   chat_history=self.config['chat_history'], language_only=self.config['language_only'], 
+                                   multiview=self.config['multiview'], multistep = self.config['multistep'], 
+                                   visual_icl = self.config['visual_icl'], truncate=self.config.get('truncate', False))
+
+    def save_summary(self):
+        average_json_values(os.path.join(self.env.log_path, 'results'), selected_key = None)
+        with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
+            f.write(str(self.config))
+        tracing.export_run(self.env.log_path)
 
     def evaluate_main(self):
 
+        tracing.configure(self.config)
         valid_eval_sets = self.config.get('eval_sets', ValidEvalSets)
         self.eval_sets = list(valid_eval_sets)
         if type(self.eval_sets) == list and len(self.eval_sets) == 0:
             self.eval_sets = ValidEvalSets
+
+        if self.config.get('scene_affinity', False):
+            self.evaluate_scheduled(self.eval_sets)
+            return
             
         for eval_set in self.eval_sets:
             if self.env is not None:
                 self.env.close()
             self.eval_set = eval_set
             logger.info(f'Current eval set: {eval_set}')
-            exp_name = f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
-
-            self.env = EBNavigationEnv(eval_set=self.eval_set, down_sample_ratio=self.config['down_sample_ratio'], 
-                                   exp_name=exp_name, multiview=self.config['multiview'], boundingbox=self.config['detection_box'], 
-                                   multistep = self.config['multistep'], resolution = self.config['resolution'])
-
-            self.planner = EBNavigationPlanner(model_name=self.model_name, model_type = self.config['model_type'], 
-                                           actions = self.env.language_skill_set, system_prompt = system_prompt, 
-                                           examples = examples, n_shot=self.config['n_shots'], obs_key='head_rgb', 
-                                           chat_history=self.config['chat_history'], language_only=self.config['language_only'], 
-                                           multiview=self.config['multiview'], multistep = self.config['multistep'], 
-                                           visual_icl = self.config['visual_icl'], truncate=self.config.get('truncate', False))
+
+            self.env = self.make_env(self.eval_set)
+            self.planner = self.make_planner()
             
             self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), selected_key = None)
-            with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
-                f.write(str(self.config))
+            self.save_summary()
+
+    def evaluate_scheduled(self, eval_sets):
+        """Run all eval sets on one controller, visiting episodes grouped by scene."""
+        if self.env is not None:
+            self.env.close()
+        self.eval_set = eval_sets[0]
+        self.env = self.make_env(self.eval_set)
+        self.planner = self.make_planner()
+
+        eval_set_scenes = {}
+        for eval_set in eval_sets:
+            self.env.set_eval_set(eval_set, self.get_exp_name(eval_set))
+            eval_set_scenes[eval_set] = self.env.episode_scenes()
+        schedule = SceneAffinitySchedule(eval_set_scenes)
+        logger.info(f'Scheduled {len(schedule)} episodes of {eval_sets}: {schedule.scene_switches} scene switches instead of {schedule.unscheduled_scene_switches}')
+
+        progress_bar = tqdm(total=len(schedule), desc="Episodes")
+        current_set = None
+        for eval_set, index, _ in schedule:
+            if eval_set != current_set:
+                current_set = eval_set
+                self.env.set_eval_set(eval_set, self.get_exp_name(eval_set))
+                self.eval_set = eval_set
+            self.env.seek_episode(index)
+            self.evaluate_episode()
+            progress_bar.update()
+            if schedule.finish(eval_set):
+                self.save_summary()
 
     def evaluate(self):
         progress_bar = tqdm(total=self.env.number_of_episodes, desc="Episodes")
         while self.env._current_episode_num < self.env.number_of_episodes:
-            logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
-            episode_info = {'reward': []}
-            obs = self.env.reset()
-            img_path = self.env.save_image(obs)
-            user_instruction = self.env.episode_language_instruction
-            print(f"Instruction: {user_instruction}")
-            self.planner.reset()
-            done = False
-            while not done:
-                try:
-                    action, reasoning = self.planner.act(img_path, user_instruction)
-                    print(f"Planner Output Action: {action}")
-                    reasoning = json.loads(reasoning)
-                    if type(action) == list:
-                        for i, action_single in enumerate( action[:min(self.env._max_episode_steps - self.env._current_step + 1, len(action))] ):
-                            if i==0:
-                                obs, reward, done, info = self.env.step(action_single,reasoning,1)
-                            else:
-                                obs, reward, done, info = self.env.step(action_single,reasoning,0)
-                            print(f"Executed action: {action_single}, Task success: {info['task_success']}")
-                            logger.debug(f"reward: {reward}")
-                            logger.debug(f"terminate: {done}\n")
-                            self.planner.update_info(info)
-                            img_path = self.env.save_image(obs)
-                            episode_info['reward'].append(reward)
-
-                            if done==True:
-                                break
-
-                            if info['last_action_success'] == 0:
-                                # stop for replanning
-                                print('invalid action, start replanning')
-                                break
-                    else:
-                        obs, reward, done, info = self.env.step(action, reasoning, 1)
-                        print(f"Executed action: {action}, Task success: {info['task_success']}")
+            self.evaluate_episode()
+            progress_bar.update()
+
+    @tracing.traced('episode')
+    def evaluate_episode(self):
+        logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
+        episode_info = {'reward': []}
+        obs = self.env.reset()
+        img_path = self.env.save_image(obs)
+        user_instruction = self.env.episode_language_instruction
+        print(f"Instruction: {user_instruction}")
+        self.planner.reset()
+        done = False
+        while not done:
+            try:
+                action, reasoning = self.planner.act(img_path, user_instruction)
+                print(f"Planner Output Action: {action}")
+                reasoning = json.loads(reasoning)
+                if type(action) == list:
+                    for i, action_single in enumerate( action[:min(self.env._max_episode_steps - self.env._current_step + 1, len(action))] ):
+                        if i==0:
+                            obs, reward, done, info = self.env.step(action_single,reasoning,1)
+                        else:
+                            obs, reward, done, info = self.env.step(action_single,reasoning,0)
+                        print(f"Executed action: {action_single}, Task success: {info['task_success']}")
                         logger.debug(f"reward: {reward}")
                         logger.debug(f"terminate: {done}\n")
                         self.planner.update_info(info)
                         img_path = self.env.save_image(obs)
                         episode_info['reward'].append(reward)
 
-                except Exception as e:
-                    sleep(1)
-                    print(e)
-                    print("retrying...")
-
-
-            # evaluation metrics
-            episode_info['instruction'] = user_instruction
-            episode_info['reward'] = np.mean(episode_info['reward'])
-            episode_info['task_success'] = info['task_success']
-            # episode_info["task_progress"] = info['task_progress']
-            # episode_info['subgoal_reward'] = info['subgoal_reward']
-            episode_info['num_steps'] = info["env_step"]
-            episode_info['planner_steps'] = self.planner.planner_steps
-            episode_info['planner_output_error'] = self.planner.output_json_error
-            # episode_info["num_invalid_actions"] = info["num_invalid_actions"]
-            # episode_info["num_invalid_action_ratio"] = info["num_invalid_actions"] / info["env_step"]
-            episode_info["episode_elapsed_seconds"] = info["episode_elapsed_seconds"]
-            self.save_episode_metric(episode_info)
-            progress_bar.update()
+                        if done==True:
+                            break
+
+                        if info['last_action_success'] == 0:
+                            # stop for replanning
+                            print('invalid action, start replanning')
+                            break
+                else:
+                    obs, reward, done, info = self.env.step(action, reasoning, 1)
+                    print(f"Executed action: {action}, Task success: {info['task_success']}")
+                    logger.debug(f"reward: {reward}")
+                    logger.debug(f"terminate: {done}\n")
+                    self.planner.update_info(info)
+                    img_path = self.env.save_image(obs)
+                    episode_info['reward'].append(reward)
+
+            except Exception as e:
+                sleep(1)
+                print(e)
+                print("retrying...")
+
+
+        # evaluation metrics
+        episode_info['instruction'] = user_instruction
+        episode_info['reward'] = np.mean(episode_info['reward'])
+        episode_info['task_success'] = info['task_success']
+        # episode_info["task_progress"] = info['task_progress']
+        # episode_info['subgoal_reward'] = info['subgoal_reward']
+        episode_info['num_steps'] = info["env_step"]
+        episode_info['planner_steps'] = self.planner.planner_steps
+        episode_info['planner_output_error'] = self.planner.output_json_error
+        # episode_info["num_invalid_actions"] = info["num_invalid_actions"]
+        # episode_info["num_invalid_action_ratio"] = info["num_invalid_actions"] / info["env_step"]
+        episode_info["episode_elapsed_seconds"] = info["episode_elapsed_seconds"]
+        self.save_episode_metric(episode_info)
 
     def check_config_valid(self):
         if self.config['multiview'] + self.config['multistep'] + self.config['visual_icl'] + self.config['chat_history'] > 1:
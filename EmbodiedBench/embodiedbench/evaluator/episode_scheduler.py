@@ -0,0 +1,52 @@
+"""
+Scene-affinity scheduling of evaluation episodes.
+
+Loading a scene is the most expensive simulator operation in a run. Instead of
+walking every eval set in dataset order with its own simulator, the episodes of
+all selected eval sets are merged into one work list in which episodes that
+share a scene are adjacent, so a single simulator serves every eval set.
+"""
+from collections import OrderedDict
+
+
+def build_scene_schedule(eval_set_scenes):
+    """
+    Group episodes of several eval sets by scene.
+
+    Args:
+        eval_set_scenes (dict): eval set -> list of scene names in dataset order
+    Returns:
+        list: (eval_set, index, scene) tuples. Scenes keep the order in which they
+            first appear, episodes keep their dataset order within a scene.
+    """
+    groups = OrderedDict()
+    for eval_set, scenes in eval_set_scenes.items():
+        for index, scene in enumerate(scenes):
+            groups.setdefault(scene, []).append((eval_set, index, scene))
+    return [item for items in groups.values() for item in items]
+
+
+def _count_switches(scenes):
+    return sum(1 for i, scene in enumerate(scenes) if i == 0 or scenes[i - 1] != scene)
+
+
+class SceneAffinitySchedule:
+    """Work list over several eval sets that tracks when each eval set is finished."""
+
+    def __init__(self, eval_set_scenes):
+        self.items = build_scene_schedule(eval_set_scenes)
+        self._remaining = {eval_set: len(scenes) for eval_set, scenes in eval_set_scenes.items()}
+        # number of scene switches with and without the schedule, for logging
+        self.scene_switches = _count_switches([scene for _, _, scene in self.items])
+        self.unscheduled_scene_switches = sum(_count_switches(scenes) for scenes in eval_set_scenes.values())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def finish(self, eval_set):
+        """Mark one episode of eval_set as done; returns True once the whole set is done."""
+        self._remaining[eval_set] -= 1
+        return self._remaining[eval_set] == 0
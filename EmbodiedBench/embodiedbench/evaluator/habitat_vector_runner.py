@@ -0,0 +1,193 @@
+"""
+Vectorized EB-Habitat evaluation.
+
+`EB_HabitatEvaluator` runs one episode at a time, so the simulator idles while
+the model answers and the model idles while the simulator steps. With
+`num_envs` > 1, the episodes of the selected eval sets are cut into that many
+disjoint, contiguous shards of the episode schedule. Each shard runs in its
+own subprocess, with its own `EBHabEnv`, through the evaluator's usual
+episode loop. Skill resolution, episode logs, images and the per-episode
+result files are the same as in a sequential run.
+
+Planners stay in the parent. Each worker gets its own `VLMPlanner`, served by
+a parent thread, and reaches it through `PlannerClient` over a pipe. Model
+calls of all envs leave from one process: remote requests overlap, and a
+local model batches them through the shared `LocalInferenceBroker`. When
+every shard is done, the parent writes the summary of each eval set.
+"""
+import os
+import threading
+import traceback
+import multiprocessing
+
+from tqdm import tqdm
+
+from embodiedbench.envs.log_sink import get_log_sink
+from embodiedbench.evaluator.episode_scheduler import SceneAffinitySchedule
+from embodiedbench.main import logger
+from embodiedbench import tracing
+
+
+def episode_items(evaluator, eval_sets):
+    """(eval_set, index) of every episode to run, grouped by scene if scene_affinity is set."""
+    eval_set_scenes = {}
+    for eval_set in eval_sets:
+        evaluator.env.set_eval_set(eval_set, evaluator.get_exp_name(eval_set))
+        eval_set_scenes[eval_set] = evaluator.env.episode_scenes()
+    if evaluator.config.get('scene_affinity', False):
+        return [(eval_set, index) for eval_set, index, _ in SceneAffinitySchedule(eval_set_scenes)]
+    start = evaluator.config.get('start_epi_index', 0)
+    return [(eval_set, index) for eval_set, scenes in eval_set_scenes.items() for index in range(start, len(scenes))]
+
+
+def shard(items, worker_id, num_envs):
+    """Contiguous slice worker_id of num_envs near-equal slices, so scene groups stay mostly on one simulator."""
+    return items[len(items) * worker_id // num_envs: len(items) * (worker_id + 1) // num_envs]
+
+
+class PlannerClient:
+    """The planner as a worker sees it: every call goes to the worker's planner in the parent."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.planner_steps = 0
+        self.output_json_error = 0
+
+    def _call(self, method, *args):
+        self.conn.send(('call', method, args))
+        status, value, self.planner_steps, self.output_json_error = self.conn.recv()
+        if status == 'error':
+            raise RuntimeError(value)
+        return value
+
+    def reset(self):
+        return self._call('reset')
+
+    def act(self, observation, user_instruction):
+        # the parent reads the frames from disk, so they have to leave the log sink first
+        get_log_sink().drain()
+        return self._call('act', observation, user_instruction)
+
+    def update_info(self, info):
+        return self._call('update_info', info)
+
+
+def _worker_main(evaluator_class, config, eval_sets, worker_id, num_envs, log_level, conn):
+    logger.setLevel(log_level)
+    try:
+        config['stream_plan'] = False
+        tracing.configure(config)
+        evaluator = evaluator_class(config)
+        evaluator.env = evaluator.make_env(eval_sets[0])
+        items = shard(episode_items(evaluator, eval_sets), worker_id, num_envs)
+        conn.send(('ready', evaluator.env.language_skill_set, len(items)))
+        evaluator.planner = PlannerClient(conn)
+
+        current_set = None
+        for eval_set, index in items:
+            if eval_set != current_set:
+                current_set = eval_set
+                evaluator.env.set_eval_set(eval_set, evaluator.get_exp_name(eval_set))
+                evaluator.eval_set = eval_set
+            evaluator.env.seek_episode(index)
+            evaluator.evaluate_episode()
+            conn.send(('episode', eval_set, index))
+
+        get_log_sink().flush()
+        if tracing.enabled():
+            tracing.export_run(os.path.join(os.path.dirname(evaluator.env.log_path), f'trace_worker_{worker_id}'))
+        evaluator.env.close()
+        conn.send(('done',))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class HabitatVectorRunner:
+    def __init__(self, evaluator, num_envs):
+        """
+        Args:
+            evaluator: EB_HabitatEvaluator (or subclass) whose config, planners and summaries are used;
+                workers build their own instance of the same class
+            num_envs (int): simulator subprocesses
+        """
+        self.evaluator = evaluator
+        self.num_envs = int(num_envs)
+        self.failed = []
+        self._lock = threading.Lock()
+        self._progress = None
+
+    def run(self, eval_sets):
+        config = self.evaluator.config
+        if not isinstance(config, dict):
+            from omegaconf import OmegaConf
+            config = OmegaConf.to_container(config)
+        # spawn: the parent may already hold a CUDA context or simulator threads
+        ctx = multiprocessing.get_context('spawn')
+        workers = []
+        for worker_id in range(self.num_envs):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker_main, name=f'habitat-worker-{worker_id}',
+                               args=(type(self.evaluator), dict(config), list(eval_sets), worker_id, self.num_envs, logger.level, child_conn))
+            proc.start()
+            child_conn.close()
+            workers.append((parent_conn, proc))
+        logger.info(f'Started {self.num_envs} habitat workers for {list(eval_sets)}')
+
+        self._progress = tqdm(total=0, desc="Episodes")
+        threads = [threading.Thread(target=self._serve, args=(worker_id, conn, proc), name=f'habitat-planner-{worker_id}')
+                   for worker_id, (conn, proc) in enumerate(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for conn, proc in workers:
+            proc.join()
+            conn.close()
+        self._progress.close()
+
+        for eval_set in eval_sets:
+            log_path = self.evaluator.get_log_path(eval_set)
+            if os.path.exists(os.path.join(log_path, 'results')):
+                self.evaluator.save_summary(log_path)
+        if self.failed:
+            raise RuntimeError(f'habitat workers {sorted(self.failed)} failed, their remaining episodes were not run')
+
+    def _serve(self, worker_id, conn, proc):
+        """Answer the planner calls of one worker until its shard is done."""
+        planner = None
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'call':
+                    _, method, args = message
+                    try:
+                        reply = ('ok', getattr(planner, method)(*args))
+                    except Exception as e:
+                        reply = ('error', f'{type(e).__name__}: {e}')
+                    conn.send(reply + (planner.planner_steps, planner.output_json_error))
+                elif message[0] == 'ready':
+                    _, language_skill_set, num_episodes = message
+                    planner = self.evaluator.make_planner(language_skill_set)
+                    with self._lock:
+                        self._progress.total += num_episodes
+                        self._progress.refresh()
+                elif message[0] == 'episode':
+                    with self._lock:
+                        self._progress.update()
+                elif message[0] == 'done':
+                    return
+                elif message[0] == 'error':
+                    logger.error(f'habitat worker {worker_id} failed:\n{message[1]}')
+                    self.failed.append(worker_id)
+                    return
+        except EOFError:
+            proc.join(10)
+            logger.error(f'habitat worker {worker_id} exited without finishing its shard (exit code {proc.exitcode})')
+            self.failed.append(worker_id)
+        except Exception:
+            # the worker would wait for its planner forever
+            logger.error(f'planner of habitat worker {worker_id} failed:\n{traceback.format_exc()}')
+            self.failed.append(worker_id)
+            proc.terminate()
@@ -0,0 +1,621 @@
+"""
+Offline replay benchmark of the EB-ALFRED evaluation loop.
+
+Recorded episodes are played back through `EB_AlfredEvaluator` and its
+planner without AI2-THOR and without a model endpoint. A recording is what an
+evaluation run leaves in its log dir: the `episode_*_step_*.json` logs and the
+frames under `images/`.
+
+- `ReplayConnector` stands in for `ThorConnector`. It serves the recorded
+  outcome and frame of every step.
+- `ReplayModelServer` is a local OpenAI-compatible endpoint. It answers each
+  chat completion request with the recorded model output, after a
+  configurable latency.
+
+Everything between the two runs for real: evaluator, planner, prompt
+building, image encoding, the HTTP client, env bookkeeping and the log
+writer. The report gives env steps per second, latency percentiles per stage
+and memory. With `--baseline` it also checks for regressions on CPU-only CI
+machines.
+
+Usage:
+    python -m embodiedbench.evaluator.replay_benchmark running/eb_alfred/gpt-4o-mini_vlm_10shots_imgsize500/base
+    python -m embodiedbench.evaluator.replay_benchmark <log_dir> [<log_dir> ...] --latency_ms 200 --output report.json
+    python -m embodiedbench.evaluator.replay_benchmark <log_dir> --baseline report.json --tolerance 0.2
+"""
+import os
+import re
+import ast
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import functools
+import contextlib
+import tracemalloc
+from types import SimpleNamespace
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from PIL import Image
+
+from embodiedbench.envs.eb_alfred.EBAlfEnv import EBAlfEnv, ValidEvalSets, get_global_action_space
+from embodiedbench.envs.log_sink import get_log_sink
+from embodiedbench.evaluator.eb_alfred_evaluator import EB_AlfredEvaluator
+from embodiedbench.planner import remote_model
+from embodiedbench.main import logger
+
+EPISODE_LOG_PATTERN = re.compile(r'^episode_(\d+)_step_(\d+)\.json$')
+# planner outputs that never reach the env: -1 invalid plan, -2 empty plan
+PLANNER_ONLY_ACTIONS = (-1, -2)
+# RemoteModel sends these to a fixed external endpoint, which cannot be redirected to the stand-in
+EXTERNAL_MODELS = ['claude', 'gemini', 'qwen', '90b-vision-instruct']
+STAGES = ['step', 'planner', 'model', 'endpoint', 'env_step', 'save_image', 'reset', 'save_log', 'save_metric']
+PERCENTILES = [50, 90, 99]
+
+
+def read_episode_log(path):
+    """Records of an episode log: JSONL, or back-to-back objects as older runs wrote them."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    records, pos = [], 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            return records
+        record, pos = decoder.raw_decode(text, pos)
+        records.append(record)
+
+
+class ReplayEpisode:
+    """One recorded episode. Entries and frames are loaded on reset and dropped after the episode."""
+
+    def __init__(self, log_dir, episode_idx, log_file):
+        self.log_dir = log_dir
+        self.episode_idx = episode_idx
+        self.log_file = log_file
+        self.entries = None
+        self.frames = None
+        # index of the next log entry, shared by the connector and the model stand-in
+        self.cursor = 0
+
+    def load(self):
+        self.entries = read_episode_log(os.path.join(self.log_dir, self.log_file))
+        self.cursor = 0
+        folder = os.path.join(self.log_dir, 'images', 'episode_{}'.format(self.episode_idx))
+        self.frames = []
+        for step in range(self.num_env_steps + 1):
+            path = os.path.join(folder, 'episode_{}_step_{}.png'.format(self.episode_idx, step))
+            if os.path.exists(path):
+                self.frames.append(np.asarray(Image.open(path).convert('RGB')))
+            else:
+                self.frames.append(self.frames[-1] if self.frames else None)
+
+    def unload(self):
+        self.entries = None
+        self.frames = None
+
+    @property
+    def num_env_steps(self):
+        return sum(1 for entry in self.entries if entry.get('action_id') not in PLANNER_ONLY_ACTIONS)
+
+    @property
+    def instruction(self):
+        for entry in self.entries:
+            if entry.get('instruction'):
+                return entry['instruction']
+        res_path = os.path.join(self.log_dir, 'results', 'episode_{}_final_res.json'.format(self.episode_idx))
+        if os.path.exists(res_path):
+            with open(res_path, 'r') as f:
+                return json.load(f).get('instruction', '')
+        return ''
+
+    def frame(self, step):
+        if not self.frames:
+            return None
+        return self.frames[min(step, len(self.frames) - 1)]
+
+
+def find_recorded_episodes(log_dir):
+    """Episodes logged in log_dir, by episode number. A re-run episode keeps its newest log."""
+    logs = {}
+    for name in os.listdir(log_dir):
+        match = EPISODE_LOG_PATTERN.match(name)
+        if match is None:
+            continue
+        idx = int(match.group(1))
+        if idx not in logs or os.path.getmtime(os.path.join(log_dir, name)) > os.path.getmtime(os.path.join(log_dir, logs[idx])):
+            logs[idx] = name
+    return [ReplayEpisode(log_dir, idx, logs[idx]) for idx in sorted(logs)]
+
+
+class ReplaySession:
+    """The episode being replayed, shared between the env side and the model stand-in."""
+
+    def __init__(self):
+        self.episode = None
+        self.load_seconds = 0.0
+        self.responses = 0
+
+    def next_response(self):
+        """Recorded model output for the planner request that is arriving now."""
+        episode = self.episode
+        self.responses += 1
+        if episode is None or not episode.entries:
+            return '{"executable_plan": []}'
+        entry = episode.entries[min(episode.cursor, len(episode.entries) - 1)]
+        # an invalid or empty plan never reaches the env, so the request consumes its entry
+        if episode.cursor < len(episode.entries) and entry.get('action_id') in PLANNER_ONLY_ACTIONS:
+            episode.cursor += 1
+        return entry.get('reasoning', '')
+
+
+class ReplayEvent:
+    def __init__(self, frame):
+        self.frame = frame
+        self.metadata = {'objects': []}
+        self.instance_detections2D = {}
+
+
+class ReplayConnector:
+    """Stand-in for ThorConnector that serves the recorded outcome and frame of each step."""
+
+    def __init__(self, x_display=None, player_screen_height=500, player_screen_width=500, macro_mode=False, **kwargs):
+        self._blank = np.zeros((player_screen_height, player_screen_width, 3), dtype=np.uint8)
+        self.episode = None
+        self.steps = 0
+        self.last_event = ReplayEvent(self._blank)
+        self.last_skill_stats = {}
+        self.cooled_objects = set()
+        self.heated_objects = set()
+        self.cleaned_objects = set()
+        # EBAlfEnv reads the transition of the dense reward, which a recording does not have
+        self.task = SimpleNamespace(last_transition=None)
+        self._success = False
+        self._progress = 0.0
+
+    def play(self, episode):
+        if self.episode is not None and self.episode is not episode:
+            self.episode.unload()
+        self.episode = episode
+        self.steps = 0
+        self._success = False
+        self._progress = 0.0
+        self.last_skill_stats = {}
+        self.last_event = ReplayEvent(self._frame(0))
+
+    def _frame(self, step):
+        frame = self.episode.frame(step) if self.episode is not None else None
+        return self._blank if frame is None else frame
+
+    def reset(self, scene_name=None):
+        return self.last_event
+
+    def restore_scene(self, *args, **kwargs):
+        pass
+
+    def step(self, action, **kwargs):
+        return self.last_event
+
+    def set_task(self, *args, **kwargs):
+        pass
+
+    def llm_skill_interact(self, instruction):
+        entries = self.episode.entries
+        while self.episode.cursor < len(entries) and entries[self.episode.cursor].get('action_id') in PLANNER_ONLY_ACTIONS:
+            self.episode.cursor += 1
+        if self.episode.cursor >= len(entries):
+            return {'action': instruction, 'success': False, 'message': 'the recording has no step left'}
+        entry = entries[self.episode.cursor]
+        self.episode.cursor += 1
+        self.steps += 1
+        self.last_event = ReplayEvent(self._frame(self.steps))
+        self._success = bool(entry.get('task_success', 0))
+        self._progress = float(entry.get('task_progress', 0))
+        self.last_skill_stats = entry.get('skill_stats') or {}
+        success = bool(entry.get('last_action_success', 0))
+        message = '' if success else entry.get('env_feedback', '').split('Last action is invalid. ', 1)[-1]
+        return {'action': instruction, 'success': success, 'message': message}
+
+    def get_transition_reward(self):
+        # step rewards are not part of the episode log
+        return 0.0, False
+
+    def get_goal_satisfied(self):
+        return self._success
+
+    def get_goal_conditions_met(self):
+        return self._progress, 1
+
+    def stop(self):
+        pass
+
+
+class ReplayAlfEnv(EBAlfEnv):
+    """EBAlfEnv over recorded episodes instead of the ALFRED splits."""
+    connector_cls = ReplayConnector
+
+    def __init__(self, recordings, session, **kwargs):
+        self.recordings = recordings
+        self.session = session
+        super().__init__(**kwargs)
+
+    def _load_dataset(self, eval_set):
+        return self.recordings[eval_set]
+
+    def _reset_controller(self, episode):
+        start = time.perf_counter()
+        episode.load()
+        self.session.load_seconds += time.perf_counter() - start
+        self.session.episode = episode
+        self.env.play(episode)
+        self.episode_language_instruction = episode.instruction
+        # ends the episode where the recording ends, as max steps, success or the invalid action limit did
+        self._max_episode_steps = max(episode.num_env_steps, 1)
+        self.generate_additional_action_space()
+
+    def generate_additional_action_space(self):
+        """Action space of the recorded run, so that recorded action ids stay valid."""
+        skill_set = get_global_action_space()
+        recorded = {entry['action_id']: entry.get('action_description', '') for entry in self._episode_task.entries
+                    if isinstance(entry.get('action_id'), int) and entry['action_id'] >= len(skill_set)}
+        if recorded:
+            skill_set += [recorded.get(i, 'find a Object_{}'.format(i)) for i in range(len(skill_set), max(recorded) + 1)]
+        self.language_skill_set = skill_set
+        self.name_to_id_dict = {}
+        self.id_to_name_dict = {}
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, obj, method, stage):
+        """Time every call of obj.method as stage."""
+        fn = getattr(obj, method)
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.samples[stage].append(time.perf_counter() - start)
+        setattr(obj, method, timed)
+
+
+class ReplayAlfredEvaluator(EB_AlfredEvaluator):
+    def __init__(self, config, recordings, session, timer):
+        super().__init__(config)
+        self.recordings = recordings
+        self.session = session
+        self.timer = timer
+        self._last_step_end = None
+
+    def make_env(self, eval_set):
+        env = ReplayAlfEnv(self.recordings, self.session, eval_set=eval_set, exp_name=self.get_exp_name(eval_set),
+                           detection_box=self.config.get('detection_box', False),
+                           resolution=self.config.get('resolution', 500),
+                           reward_type=self.config.get('reward_type', 'dense'))
+        self.timer.wrap(env, 'reset', 'reset')
+        self.timer.wrap(env, 'step', 'env_step')
+        self.timer.wrap(env, 'save_image', 'save_image')
+        self.timer.wrap(env, 'save_episode_log', 'save_log')
+        self._time_full_steps(env)
+        return env
+
+    def _time_full_steps(self, env):
+        # 'step' is the wall time from the end of one env step (or the reset) to the end of the next,
+        # i.e. everything the evaluator loop does per step, planning included
+        reset, step = env.reset, env.step
+
+        def timed_reset(*args, **kwargs):
+            obs = reset(*args, **kwargs)
+            self._last_step_end = time.perf_counter()
+            return obs
+
+        def timed_step(*args, **kwargs):
+            result = step(*args, **kwargs)
+            now = time.perf_counter()
+            self.timer.samples['step'].append(now - self._last_step_end)
+            self._last_step_end = now
+            return result
+        env.reset, env.step = timed_reset, timed_step
+
+    def make_planner(self):
+        planner = super().make_planner()
+        self.timer.wrap(planner, 'act', 'planner')
+        self.timer.wrap(planner.model, 'respond', 'model')
+        return planner
+
+    def save_episode_metric(self, episode_info):
+        start = time.perf_counter()
+        super().save_episode_metric(episode_info)
+        self.timer.samples['save_metric'].append(time.perf_counter() - start)
+
+
+class _ReplayModelHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {'error': {'message': 'unknown path {}'.format(self.path)}})
+            return
+        request = json.loads(body or b'{}')
+        server = self.server
+        content = server.session.next_response()
+        delay = server.latency + server.jitter * server.rng.random()
+        if delay > 0:
+            time.sleep(delay)
+        self._send(200, {
+            'id': 'replay-{}'.format(server.session.responses),
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'replay'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        })
+        server.request_seconds.append(time.perf_counter() - start)
+        server.request_bytes.append(len(body))
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ReplayModelServer(ThreadingHTTPServer):
+    """Local OpenAI-compatible chat completion endpoint that answers with recorded model outputs."""
+    daemon_threads = True
+
+    def __init__(self, session, latency=0.0, jitter=0.0, port=0, seed=0):
+        """
+        Args:
+            latency (float): seconds every response is held back
+            jitter (float): extra seconds, drawn uniformly from [0, jitter] per response
+        """
+        super().__init__(('127.0.0.1', port), _ReplayModelHandler)
+        self.session = session
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.request_seconds = []
+        self.request_bytes = []
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/v1'.format(self.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='replay-model-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _max_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def summarize_samples(samples):
+    if not len(samples):
+        return None
+    ms = np.asarray(samples) * 1000.0
+    summary = {'count': int(len(ms)), 'mean_ms': float(ms.mean())}
+    for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        summary['p{}_ms'.format(p)] = float(value)
+    return summary
+
+
+def load_recorded_config(log_dir):
+    """The evaluator config saved next to the recording (config.txt), or {}."""
+    path = os.path.join(log_dir, 'config.txt')
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        try:
+            return ast.literal_eval(f.read())
+        except (ValueError, SyntaxError):
+            return {}
+
+
+def build_recordings(log_dirs):
+    """eval set -> recorded episodes; the eval set is the name of the log dir, as the evaluator lays it out."""
+    recordings = defaultdict(list)
+    for log_dir in log_dirs:
+        eval_set = os.path.basename(os.path.normpath(log_dir))
+        if eval_set not in ValidEvalSets:
+            logger.warning(f"{log_dir} is not named after an eval set, replaying it as 'base'")
+            eval_set = 'base'
+        episodes = find_recorded_episodes(log_dir)
+        if not len(episodes):
+            raise ValueError(f"no episode_*_step_*.json logs in {log_dir}")
+        recordings[eval_set].extend(episodes)
+    return dict(recordings)
+
+
+def run_benchmark(log_dirs, config=None, latency=0.0, jitter=0.0, repeat=1, trace_memory=False, verbose=False):
+    """Replay the recordings in log_dirs through the evaluator and return the report dict."""
+    log_dirs = [os.path.abspath(d) for d in log_dirs]
+    recordings = build_recordings(log_dirs)
+    config = dict(config or {})
+    config['eval_sets'] = list(recordings)
+    if any(name in config['model_name'] for name in EXTERNAL_MODELS):
+        raise ValueError(f"{config['model_name']} is sent to a fixed external endpoint; replay it under an OpenAI-compatible model name such as gpt-4o-mini")
+    if config.get('reward_type', 'dense') not in ('dense', 'sparse'):
+        # the replayed task has no untracked_step or deferred_results for the 'none' and 'deferred' modes
+        raise ValueError(f"reward_type {config['reward_type']!r} cannot be replayed, use dense or sparse")
+
+    session = ReplaySession()
+    server = ReplayModelServer(session, latency=latency, jitter=jitter).start()
+    # OpenAI() reads the base url from the environment, other OpenAI-compatible models use remote_url
+    os.environ['OPENAI_BASE_URL'] = server.url
+    os.environ['OPENAI_API_KEY'] = 'replay'
+    remote_model.remote_url = server.url
+
+    timer = StageTimer()
+    rss_before = _max_rss_mb()
+    if trace_memory:
+        tracemalloc.start()
+    out = None if verbose else open(os.devnull, 'w')
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(out) if out is not None else contextlib.nullcontext():
+            for _ in range(repeat):
+                evaluator = ReplayAlfredEvaluator(config, recordings, session, timer)
+                evaluator.evaluate_main()
+                evaluator.env.close()
+            # queued logs and frames are part of the cost of a step
+            get_log_sink().flush()
+    finally:
+        wall = time.perf_counter() - start
+        if out is not None:
+            out.close()
+        server.stop()
+    heap_peak = None
+    if trace_memory:
+        heap_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    timer.samples['endpoint'] = server.request_seconds
+    env_steps = len(timer.samples['env_step'])
+    replay_seconds = wall - session.load_seconds
+    return {
+        'log_dirs': log_dirs,
+        'model_name': config['model_name'],
+        'latency_ms': latency * 1000.0,
+        'jitter_ms': jitter * 1000.0,
+        'repeat': repeat,
+        'episodes': len(timer.samples['reset']),
+        'env_steps': env_steps,
+        'planner_calls': len(timer.samples['planner']),
+        'wall_seconds': wall,
+        'recording_load_seconds': session.load_seconds,
+        'steps_per_sec': env_steps / replay_seconds if replay_seconds > 0 else 0.0,
+        'request_kb_mean': float(np.mean(server.request_bytes)) / 1024.0 if server.request_bytes else 0.0,
+        'stages': {stage: summarize_samples(timer.samples[stage]) for stage in STAGES if timer.samples[stage]},
+        'memory': {
+            'max_rss_mb': _max_rss_mb(),
+            'max_rss_growth_mb': _max_rss_mb() - rss_before,
+            'python_heap_peak_mb': heap_peak,
+        },
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2, noise_ms=1.0):
+    """Regressions of report against baseline; stage latencies within noise_ms are ignored."""
+    failures = []
+    if report['steps_per_sec'] < baseline['steps_per_sec'] * (1 - tolerance):
+        failures.append('steps/sec {:.2f} < baseline {:.2f}'.format(report['steps_per_sec'], baseline['steps_per_sec']))
+    for stage, summary in report['stages'].items():
+        base = baseline.get('stages', {}).get(stage)
+        if base is None:
+            continue
+        for key in ('p50_ms', 'p90_ms'):
+            if summary[key] > base[key] * (1 + tolerance) and summary[key] - base[key] > noise_ms:
+                failures.append('{} {} {:.2f}ms > baseline {:.2f}ms'.format(stage, key, summary[key], base[key]))
+    base_rss = baseline.get('memory', {}).get('max_rss_mb')
+    if base_rss and report['memory']['max_rss_mb'] > base_rss * (1 + tolerance):
+        failures.append('max RSS {:.1f}MB > baseline {:.1f}MB'.format(report['memory']['max_rss_mb'], base_rss))
+    return failures
+
+
+def print_report(report):
+    print('episodes: {}  env steps: {}  planner calls: {}  model latency: {:.0f}ms (+{:.0f}ms jitter)'.format(
+        report['episodes'], report['env_steps'], report['planner_calls'], report['latency_ms'], report['jitter_ms']))
+    print('steps/sec: {:.2f}  wall: {:.2f}s  (recording load {:.2f}s excluded)  mean request: {:.1f}KB'.format(
+        report['steps_per_sec'], report['wall_seconds'], report['recording_load_seconds'], report['request_kb_mean']))
+    header = ['stage', 'count', 'mean_ms'] + ['p{}_ms'.format(p) for p in PERCENTILES]
+    print('  '.join(h.ljust(12) for h in header))
+    for stage, summary in report['stages'].items():
+        row = [stage, str(summary['count'])] + ['{:.2f}'.format(summary[h]) for h in header[2:]]
+        print('  '.join(v.ljust(12) for v in row))
+    memory = report['memory']
+    heap = '' if memory['python_heap_peak_mb'] is None else '  python heap peak: {:.1f}MB'.format(memory['python_heap_peak_mb'])
+    print('max RSS: {:.1f}MB (+{:.1f}MB during replay){}'.format(memory['max_rss_mb'], memory['max_rss_growth_mb'], heap))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded EB-ALFRED episodes through the evaluator without simulator or model endpoint.')
+    parser.add_argument('log_dirs', type=str, nargs='+', help='eval set log dirs of a previous run, e.g. running/eb_alfred/<exp>/base')
+    parser.add_argument('--model_name', type=str, help='OpenAI-compatible model name the planner is built for (default: the recorded one, else gpt-4o-mini)')
+    parser.add_argument('--latency_ms', type=float, default=0.0, help='time the model stand-in takes per response')
+    parser.add_argument('--jitter_ms', type=float, default=0.0, help='extra uniform random time per response')
+    parser.add_argument('--repeat', type=int, default=1, help='replay the recordings this many times')
+    parser.add_argument('--out_dir', type=str, default=None, help='working dir for the replay logs and results (default: a temp dir)')
+    parser.add_argument('--tracemalloc', action='store_true', help='also report the Python heap peak (slows the replay down)')
+    parser.add_argument('--verbose', action='store_true', help='keep the evaluator and planner prints')
+    parser.add_argument('--trace', action='store_true', help='also write trace.json and trace_summary.json of the replay to each eval set log dir')
+    parser.add_argument('--output', type=str, default=None, help='write the report as JSON')
+    parser.add_argument('--baseline', type=str, default=None, help='report JSON to compare against; exit 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown against the baseline')
+    args = parser.parse_args()
+
+    config = {
+        'model_name': 'gpt-4o-mini',
+        'n_shots': 10,
+        'down_sample_ratio': 1.0,
+        'model_type': 'remote',
+        'language_only': 0,
+        'exp_name': 'replay',
+        'chat_history': 0,
+        'detection_box': 0,
+        'selected_indexes': [],
+        'multistep': 0,
+        'resolution': 500,
+        'env_feedback': 1,
+        'tp': 1,
+        'scene_affinity': 0,
+        'trace': args.trace,
+    }
+    recorded = load_recorded_config(args.log_dirs[0])
+    for key in ('model_name', 'n_shots', 'language_only', 'chat_history', 'detection_box', 'multistep', 'resolution', 'env_feedback'):
+        if key in recorded:
+            config[key] = recorded[key]
+    if args.model_name is not None:
+        config['model_name'] = args.model_name
+    elif any(name in config['model_name'] for name in EXTERNAL_MODELS):
+        logger.warning(f"recorded model {config['model_name']} uses a fixed external endpoint, replaying as gpt-4o-mini")
+        config['model_name'] = 'gpt-4o-mini'
+
+    # paths given on the command line are relative to the caller's working dir, not to out_dir
+    log_dirs = [os.path.abspath(d) for d in args.log_dirs]
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    out_dir = args.out_dir or tempfile.mkdtemp(prefix='eb_replay_')
+    os.makedirs(out_dir, exist_ok=True)
+    # the evaluator writes under running/ relative to the working dir, results index included
+    os.chdir(out_dir)
+    report = run_benchmark(log_dirs, config, latency=args.latency_ms / 1000.0, jitter=args.jitter_ms / 1000.0,
+                           repeat=args.repeat, trace_memory=args.tracemalloc, verbose=args.verbose)
+    print_report(report)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f)
+        failures = compare_to_baseline(report, baseline, args.tolerance)
+        for failure in failures:
+            print('REGRESSION: ' + failure)
+        sys.exit(1 if failures else 0)
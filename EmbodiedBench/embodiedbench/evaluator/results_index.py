@@ -0,0 +1,272 @@
+"""
+SQLite index of per-episode results.
+
+Every evaluator adds a row here when it writes an `episode_*_res.json` file,
+so averages, cross-run comparisons and step-count distributions are answered
+by one query instead of globbing and re-reading every result file.
+`summarize_result.average_json_values` is a thin view over this index; it
+first reconciles the rows of its directory with the files in it, so deleted
+results drop out and files the index has not seen are imported.
+
+Usage:
+    python -m embodiedbench.evaluator.results_index summary --eval_set base
+    python -m embodiedbench.evaluator.results_index compare --metric task_success
+    python -m embodiedbench.evaluator.results_index steps --model gpt-4o-mini --eval_set base
+    python -m embodiedbench.evaluator.results_index import running/eb_alfred
+"""
+import os
+import glob
+import math
+import json
+import time
+import numbers
+import sqlite3
+import argparse
+import threading
+
+DEFAULT_INDEX_PATH = os.path.join('running', 'results.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    results_dir TEXT NOT NULL,
+    file TEXT NOT NULL,
+    benchmark TEXT,
+    model TEXT,
+    exp_name TEXT,
+    eval_set TEXT,
+    episode INTEGER,
+    recorded_at REAL,
+    UNIQUE (results_dir, file)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    episode_id INTEGER NOT NULL REFERENCES episodes(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (episode_id, key)
+);
+CREATE INDEX IF NOT EXISTS episodes_run ON episodes (model, exp_name, eval_set);
+CREATE INDEX IF NOT EXISTS episodes_dir ON episodes (results_dir);
+CREATE INDEX IF NOT EXISTS metrics_key ON metrics (key, value);
+"""
+
+
+def numeric_metrics(data):
+    """The values average_json_values averages: numbers, and one-element lists of numbers. NaN is skipped."""
+    metrics = {}
+    for key, value in data.items():
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        if isinstance(value, numbers.Number) and not math.isnan(value):
+            metrics[key] = float(value)
+    return metrics
+
+
+def _under(results_dir):
+    # results_dir itself and everything below it, like the glob in average_json_values
+    results_dir = os.path.normpath(results_dir)
+    return "(e.results_dir = ? OR e.results_dir LIKE ? ESCAPE '\\')", [results_dir, _escape_like(results_dir) + '/%']
+
+
+def _escape_like(s):
+    return s.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class ResultsIndex:
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # evaluators of several benchmarks may write to the same index at once
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def add_episode(self, results_dir, file, data, benchmark=None, model=None, exp_name=None, eval_set=None, episode=None):
+        """Index one result file; a re-run of the same episode replaces the old row."""
+        results_dir = os.path.normpath(results_dir)
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM episodes WHERE results_dir = ? AND file = ?', (results_dir, file))
+            cur = self.conn.execute(
+                'INSERT INTO episodes (results_dir, file, benchmark, model, exp_name, eval_set, episode, recorded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (results_dir, file, benchmark, model, exp_name, eval_set, episode, time.time()))
+            self.conn.executemany('INSERT INTO metrics (episode_id, key, value) VALUES (?, ?, ?)',
+                                  [(cur.lastrowid, key, value) for key, value in numeric_metrics(data).items()])
+
+    @staticmethod
+    def _result_files(json_dir, target_file):
+        # the files average_json_values used to glob: json_dir and two levels below, without the summaries
+        json_files = glob.glob(os.path.join(json_dir, target_file)) + glob.glob(os.path.join(json_dir, '*', target_file)) + glob.glob(os.path.join(json_dir, '*', '*', target_file))
+        return [f for f in json_files if not os.path.basename(f).startswith('summary')]
+
+    def _import_file(self, json_file, **run_info):
+        with open(json_file, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            return False
+        self.add_episode(os.path.dirname(json_file), os.path.basename(json_file), data, **run_info)
+        return True
+
+    def import_dir(self, json_dir, target_file='*.json', **run_info):
+        """Index result files written before the index existed; returns the number of files."""
+        return sum(self._import_file(json_file, **run_info) for json_file in self._result_files(json_dir, target_file))
+
+    def sync_dir(self, json_dir, target_file='*.json', **run_info):
+        """
+        Make the rows under json_dir match the result files on disk: rows whose file
+        is gone are dropped, and files that are not indexed yet (e.g. written before
+        the index existed) or changed since are imported. Returns (imported, dropped).
+        """
+        files = {os.path.normpath(f) for f in self._result_files(json_dir, target_file)}
+        where, args = _under(json_dir)
+        rows = self.conn.execute(f'SELECT e.id, e.results_dir, e.file, e.recorded_at FROM episodes e '
+                                 f'WHERE {where} AND e.file GLOB ?', args + [target_file]).fetchall()
+        indexed, gone = {}, []
+        for episode_id, results_dir, file, recorded_at in rows:
+            path = os.path.join(results_dir, file)
+            # rows deeper than the listing are checked one by one
+            if path in files or os.path.isfile(path):
+                indexed[path] = recorded_at
+            else:
+                gone.append((episode_id,))
+        if gone:
+            with self._lock, self.conn:
+                self.conn.executemany('DELETE FROM episodes WHERE id = ?', gone)
+        imported = 0
+        for path in sorted(files):
+            if path not in indexed or os.path.getmtime(path) > indexed[path]:
+                imported += self._import_file(path, **run_info)
+        return imported, len(gone)
+
+    def averages(self, results_dir, target_file='*.json', selected_key=None):
+        """Per-metric mean over the result files under results_dir."""
+        where, args = _under(results_dir)
+        query = (f'SELECT m.key, AVG(m.value) FROM metrics m JOIN episodes e ON e.id = m.episode_id '
+                 f'WHERE {where} AND e.file GLOB ?')
+        args.append(target_file)
+        if selected_key is not None:
+            query += ' AND m.key = ?'
+            args.append(selected_key)
+        # keys keep the order in which they first appear, as in the result files
+        query += ' GROUP BY m.key ORDER BY MIN(m.rowid)'
+        return {key: value for key, value in self.conn.execute(query, args)}
+
+    def aggregate(self, metrics=None, group_by=('benchmark', 'model', 'exp_name', 'eval_set'), **filters):
+        """Rows of (*group_by, episodes, {metric: mean}) for the runs matching filters."""
+        where, args = self._filters(filters)
+        if metrics:
+            where.append('m.key IN (%s)' % ','.join('?' * len(metrics)))
+            args.extend(metrics)
+        cols = ', '.join('e.' + g for g in group_by)
+        query = (f'SELECT {cols}, m.key, COUNT(*), AVG(m.value) FROM metrics m JOIN episodes e ON e.id = m.episode_id '
+                 f'{"WHERE " + " AND ".join(where) if where else ""} GROUP BY {cols}, m.key ORDER BY {cols}')
+        rows = {}
+        for row in self.conn.execute(query, args):
+            group, key, n, mean = row[:len(group_by)], row[-3], row[-2], row[-1]
+            entry = rows.setdefault(group, [0, {}])
+            entry[0] = max(entry[0], n)
+            entry[1][key] = mean
+        return [group + (n, means) for group, (n, means) in rows.items()]
+
+    def distribution(self, metric='num_steps', **filters):
+        """Histogram {value: count} of one metric, e.g. the step counts of a run."""
+        where, args = self._filters(filters)
+        where.append('m.key = ?')
+        args.append(metric)
+        query = (f'SELECT m.value, COUNT(*) FROM metrics m JOIN episodes e ON e.id = m.episode_id '
+                 f'WHERE {" AND ".join(where)} GROUP BY m.value ORDER BY m.value')
+        return {value: count for value, count in self.conn.execute(query, args)}
+
+    @staticmethod
+    def _filters(filters):
+        where, args = [], []
+        for column in ('benchmark', 'model', 'exp_name', 'eval_set'):
+            if filters.get(column) is not None:
+                where.append(f'e.{column} = ?')
+                args.append(filters[column])
+        if filters.get('results_dir') is not None:
+            clause, clause_args = _under(filters['results_dir'])
+            where.append(clause)
+            args.extend(clause_args)
+        return where, args
+
+    def close(self):
+        self.conn.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_results_index(path=DEFAULT_INDEX_PATH):
+    """One shared connection per index file in this process."""
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = ResultsIndex(path)
+        return _indexes[path]
+
+
+def _format(value):
+    if isinstance(value, float) and not value.is_integer():
+        return f'{value:.4f}'
+    return str(int(value)) if isinstance(value, float) else str(value)
+
+
+def _print_table(header, rows):
+    rows = [[_format(v) for v in row] for row in rows]
+    widths = [max(len(str(h)), *(len(r[i]) for r in rows)) if rows else len(str(h)) for i, h in enumerate(header)]
+    print('  '.join(str(h).ljust(w) for h, w in zip(header, widths)))
+    for row in rows:
+        print('  '.join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the episode results index.')
+    parser.add_argument('--index', type=str, default=DEFAULT_INDEX_PATH, help='path of the SQLite index')
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in [('summary', 'mean of every metric per run and eval set'),
+                            ('compare', 'one metric across runs (rows) and eval sets (columns)'),
+                            ('steps', 'distribution of a count metric')]:
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--benchmark', type=str)
+        p.add_argument('--model', type=str)
+        p.add_argument('--exp_name', type=str)
+        p.add_argument('--eval_set', type=str)
+        p.add_argument('--results_dir', type=str)
+        p.add_argument('--metric', type=str, nargs='+', default=None)
+    p = sub.add_parser('import', help='index result files written before the index existed')
+    p.add_argument('directory', type=str)
+    p.add_argument('--target_file', default='*.json', type=str)
+    for column in ('benchmark', 'model', 'exp_name', 'eval_set'):
+        p.add_argument('--' + column, type=str)
+    args = parser.parse_args()
+
+    index = ResultsIndex(args.index)
+    if args.command == 'import':
+        run_info = {k: getattr(args, k) for k in ('benchmark', 'model', 'exp_name', 'eval_set')}
+        print(f'indexed {index.import_dir(args.directory, args.target_file, **run_info)} files from {args.directory}')
+    else:
+        filters = {k: getattr(args, k) for k in ('benchmark', 'model', 'exp_name', 'eval_set', 'results_dir')}
+        if args.command == 'summary':
+            rows = index.aggregate(args.metric, **filters)
+            keys = list(dict.fromkeys(k for row in rows for k in row[-1]))
+            _print_table(['benchmark', 'model', 'exp_name', 'eval_set', 'episodes'] + keys,
+                         [list(row[:-1]) + [row[-1].get(k, '-') for k in keys] for row in rows])
+        elif args.command == 'compare':
+            metric = (args.metric or ['task_success'])[0]
+            rows = index.aggregate([metric], group_by=('model', 'exp_name', 'eval_set'), **filters)
+            eval_sets = sorted({row[2] for row in rows if row[2] is not None})
+            table = {}
+            for model, exp_name, eval_set, n, means in rows:
+                table.setdefault((model, exp_name), {})[eval_set] = means.get(metric)
+            _print_table(['model', 'exp_name'] + eval_sets,
+                         [[model, exp_name] + [cells.get(s, '-') for s in eval_sets] for (model, exp_name), cells in table.items()])
+        else:
+            metric = (args.metric or ['num_steps'])[0]
+            hist = index.distribution(metric, **filters)
+            total = sum(hist.values())
+            _print_table([metric, 'episodes', 'fraction'], [[v, n, n / total] for v, n in hist.items()])
+    index.close()
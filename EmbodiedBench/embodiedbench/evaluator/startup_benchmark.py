@@ -0,0 +1,134 @@
+"""
+Startup time of an evaluation process.
+
+Every evaluation or shard worker first imports `embodiedbench.main`, then the
+evaluator of its env, then the client library of its model. The benchmark
+times these stages in fresh interpreters, so nothing is cached between runs,
+and lists the backends that got imported along the way. Each backend should
+only show up when the config needs it:
+
+- lmdeploy, only for `model_type=local`;
+- anthropic, only for Claude;
+- openai, only for the other remote models;
+- ultralytics (YOLO), only once EB-Manipulation draws detection boxes;
+- torch and transformers, never directly.
+
+One extra run with `python -X importtime` gives the slowest imported modules.
+
+Usage:
+    python -m embodiedbench.evaluator.startup_benchmark --env eb-hab --model_name gpt-4o-mini
+    python -m embodiedbench.evaluator.startup_benchmark --env eb-alf --model_name Qwen/Qwen2-VL-7B-Instruct --model_type local --repeat 5
+    python -m embodiedbench.evaluator.startup_benchmark --env eb-nav --output startup.json --max_seconds 5
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+import numpy as np
+
+BACKENDS = ['lmdeploy', 'torch', 'transformers', 'ultralytics', 'openai', 'anthropic', 'google.generativeai', 'hydra']
+
+# runs in the child interpreter; the last stdout line is the JSON result
+CHILD = r'''
+import sys, json, time
+env, model_name, model_type, backends = sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4].split(',')
+stages, error = {}, None
+start = time.perf_counter()
+try:
+    from embodiedbench.main import get_evaluator
+    stages['main'] = time.perf_counter() - start
+    t = time.perf_counter()
+    get_evaluator(env)
+    stages['evaluator'] = time.perf_counter() - t
+    if model_type != 'custom':
+        t = time.perf_counter()
+        from embodiedbench.planner.remote_model import load_backend
+        load_backend(model_name, model_type)
+        stages['backend'] = time.perf_counter() - t
+except BaseException as e:
+    error = '{}: {}'.format(type(e).__name__, e)
+stages['total'] = time.perf_counter() - start
+print(json.dumps({'stages': stages, 'error': error, 'loaded': [m for m in backends if m in sys.modules]}))
+'''
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def run_child(env, model_name, model_type, importtime=False):
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD, env, model_name, model_type, ','.join(BACKENDS)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError('startup child failed:\n' + proc.stderr[-2000:])
+    return json.loads(lines[-1]), proc.stderr
+
+
+def slowest_imports(importtime_output, top=15):
+    """Top-level (package) imports by cumulative time, from `python -X importtime` output."""
+    packages = {}
+    for self_us, cumulative_us, indent, name in IMPORTTIME_LINE.findall(importtime_output):
+        # one space of indent is a top-level import; nested ones are part of their parent's cumulative time
+        if len(indent) == 1:
+            root = name.split('.')[0]
+            packages[root] = packages.get(root, 0) + int(cumulative_us)
+    rows = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{'module': name, 'cumulative_ms': us / 1000.0} for name, us in rows]
+
+
+def run_benchmark(env, model_name, model_type='remote', repeat=3, top=15):
+    runs = [run_child(env, model_name, model_type)[0] for _ in range(repeat)]
+    profiled, importtime_output = run_child(env, model_name, model_type, importtime=True)
+    stages = {}
+    for name in runs[0]['stages']:
+        seconds = [run['stages'][name] for run in runs if name in run['stages']]
+        stages[name] = {'median_s': float(np.median(seconds)), 'min_s': float(np.min(seconds)), 'max_s': float(np.max(seconds))}
+    return {
+        'env': env,
+        'model_name': model_name,
+        'model_type': model_type,
+        'repeat': repeat,
+        'stages': stages,
+        'loaded_backends': profiled['loaded'],
+        # an import that failed in any run, the timings stop at it
+        'error': next((run['error'] for run in runs + [profiled] if run['error']), None),
+        'slowest_imports': slowest_imports(importtime_output, top),
+    }
+
+
+def print_report(report):
+    print('env: {}  model: {} ({})  runs: {}'.format(report['env'], report['model_name'], report['model_type'], report['repeat']))
+    if report['error']:
+        print('startup stopped early: {}'.format(report['error']))
+    for name, summary in report['stages'].items():
+        print('{:<10}  median {:.3f}s  min {:.3f}s  max {:.3f}s'.format(name, summary['median_s'], summary['min_s'], summary['max_s']))
+    print('backends imported: {}'.format(', '.join(report['loaded_backends']) or 'none'))
+    print('slowest top-level imports:')
+    for row in report['slowest_imports']:
+        print('  {:<30} {:>9.1f}ms'.format(row['module'], row['cumulative_ms']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the imports an evaluation process pays before its first episode.')
+    parser.add_argument('--env', type=str, default='eb-hab', help='eb-alf, eb-hab, eb-nav or eb-man')
+    parser.add_argument('--model_name', type=str, default='gpt-4o-mini')
+    parser.add_argument('--model_type', type=str, default='remote', help='remote, local or custom')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters to time')
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to list')
+    parser.add_argument('--output', type=str, default=None, help='write the report as JSON')
+    parser.add_argument('--max_seconds', type=float, default=None, help='exit 1 if the median total startup exceeds this; a failed import always exits 1')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.env, args.model_name, args.model_type, args.repeat, args.top)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if report['error']:
+        # the timings stop at the failed import, so they say nothing about the startup
+        sys.exit(1)
+    if args.max_seconds is not None and report['stages']['total']['median_s'] > args.max_seconds:
+        print('median startup {:.2f}s exceeds {:.2f}s'.format(report['stages']['total']['median_s'], args.max_seconds))
+        sys.exit(1)
@@ -1,9 +1,11 @@
 import os
-import hydra
-from omegaconf import DictConfig, OmegaConf
 import logging
+from typing import TYPE_CHECKING
 import yaml
 
+if TYPE_CHECKING:
+    from omegaconf import DictConfig
+
 logger = logging.getLogger("EB_logger")
 if not logger.hasHandlers():
     formatter = logging.Formatter("[%(asctime)s][%(levelname)s] - %(message)s")
@@ -35,6 +37,7 @@ module_names = {
 }
 
 def get_evaluator(env_name: str):
+    # evaluators are imported on demand, so a run only loads the simulator and model backends of its env
 
     if env_name not in module_names:
         raise ValueError(f"Unknown environment: {env_name}")
@@ -45,8 +48,8 @@ def get_evaluator(env_name: str):
     module = __import__(module_name, fromlist=[evaluator_name])
     return getattr(module, evaluator_name)
 
-@hydra.main(config_path="./configs", config_name="config", version_base=None)
-def main(cfg: DictConfig) -> None:
+def main(cfg: "DictConfig") -> None:
+    from omegaconf import OmegaConf
     logging.getLogger().handlers.clear()
     
     if 'log_level' not in cfg or cfg.log_level == "INFO":
@@ -79,4 +82,6 @@ def main(cfg: DictConfig) -> None:
     logger.info("Evaluation completed")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # hydra is only needed by the command line entry point, not by the modules importing the logger
+    import hydra
+    hydra.main(config_path="./configs", config_name="config", version_base=None)(main)()
\ No newline at end of file
@@ -1,8 +1,9 @@
 import requests
-import torch
 import os
 import io
 import requests
+from embodiedbench.envs.log_sink import read_file_bytes
+from embodiedbench import tracing
 
 temperature = 0
 max_completion_tokens = 2048
@@ -15,11 +16,12 @@ class CustomModel():
         self.model_type = 'custom'
         
 
+    @tracing.traced('model.respond')
     def respond(self, prompt, obs=None):        
-        with open(obs, "rb") as img_file:
-            files = {"image": img_file}
-            data = {"sentence": prompt}
-            response = requests.post(server_url, files=files, data=data)
+        # the frame may still be queued in the episode log writer
+        files = {"image": (os.path.basename(obs), read_file_bytes(obs))}
+        data = {"sentence": prompt}
+        response = requests.post(server_url, files=files, data=data)
 
         res= response.json()['response']
         if response.status_code != 200:
@@ -1,4 +1,3 @@
-import torch
 import re
 import os
 import time
@@ -9,6 +8,7 @@ from embodiedbench.planner.planner_config.generation_guide import llm_generation
 from embodiedbench.planner.planner_utils import local_image_to_data_url, template, template_lang
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 class VLMPlanner():
     def __init__(self, model_name, model_type, actions, system_prompt, examples, n_shot=0, obs_key='head_rgb', 
@@ -47,6 +47,7 @@ class VLMPlanner():
         return available_action_str
 
 
+    @tracing.traced('planner.prompt')
     def process_prompt(self, user_instruction, prev_act_feedback=[]):
         # user_instruction = user_instruction.rstrip('.')
         # if len(prev_act_feedback) == 0:
@@ -94,6 +95,7 @@ class VLMPlanner():
         return user_instruction #prompt
     
 
+    @tracing.traced('planner.message')
     def get_message(self, image, prompt, messages=[]):
         if len(messages) == 0:
             messages = [
@@ -193,6 +195,7 @@ class VLMPlanner():
             action = np.random.randint(len(self.actions))
         return action
     
+    @tracing.traced('planner.parse')
     def extract_results(self, content):
         action_list = ["find", "pick up", "put down", "open", "close", "slice", "turn on", "turn off", "done"]
         action_pattern = r'Action:\s*(.*?)(?=\n|$)'  # 匹配 Action 后面的内容直到换行或结束
@@ -246,6 +249,7 @@ class VLMPlanner():
     #     return action, out
 
 
+    @tracing.traced('planner.act')
     def act(self, observation, user_instruction):
         if type(observation) == dict:
             obs = observation[self.obs_key]
@@ -0,0 +1,285 @@
+"""
+Dynamic batching of local (lmdeploy) model calls.
+
+An lmdeploy `pipeline` takes a list of prompts and runs them as one GPU
+batch, but every planner calls it with a single prompt. `LocalInferenceBroker`
+sits between the planners and the pipeline: each call is queued, and a
+single worker thread collects the pending ones into a batch, up to
+`max_batch_size`, waiting at most `max_wait_ms` after the first. The batch
+goes to the pipeline in one call and each response is routed back to the
+planner that asked for it.
+
+Each planner calls the broker through its own client from `register()`.
+The worker does not wait for more requests once every active client is
+already waiting. A client is active while it has a call in flight or has
+finished one within the last `idle_seconds`. A client that was dropped,
+for example the planner of a finished eval set, stops counting. A single
+episode loop therefore dispatches right away and pays no batching delay.
+Concurrent episodes or env workers in one process share the broker, and
+the pipeline, through `get_local_broker`.
+
+The batch size and deadline come from EB_LOCAL_BATCH_SIZE and
+EB_LOCAL_MAX_WAIT_MS. Running the module benchmarks the broker on CPU against
+a simulated pipeline:
+
+    python -m embodiedbench.planner.local_inference --clients 8 --calls 10
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+import weakref
+from concurrent.futures import Future
+
+from embodiedbench.main import logger
+from embodiedbench import tracing
+
+_STOP = object()
+
+
+class _Request:
+    __slots__ = ('prompt', 'gen_config', 'future', 'queued_at')
+
+    def __init__(self, prompt, gen_config):
+        self.prompt = prompt
+        self.gen_config = gen_config
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+class _Client:
+    """One planner's handle on the broker, called like the pipeline."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.in_flight = 0
+        self.last_active = time.perf_counter()
+
+    def __call__(self, prompt, gen_config=None):
+        self.in_flight += 1
+        try:
+            return self.broker.submit(prompt, gen_config).result()
+        finally:
+            self.in_flight -= 1
+            self.last_active = time.perf_counter()
+
+
+class LocalInferenceBroker:
+    def __init__(self, pipe, max_batch_size=16, max_wait_ms=20, idle_seconds=10.0, name='local-inference'):
+        """
+        Args:
+            pipe: lmdeploy pipeline, or anything called as pipe(prompts, gen_config=[...]) returning one response per prompt
+            max_batch_size (int): prompts per pipeline call
+            max_wait_ms (float): time the first request of a batch may wait for others
+            idle_seconds (float): time after its last call during which a client is still waited for
+        """
+        self.pipe = pipe
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self.idle_seconds = idle_seconds
+        self.name = name
+        self._queue = queue.Queue()
+        self._clients = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+        self._queue_wait = 0.0
+        self._busy_seconds = 0.0
+        self._start_time = time.time()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def register(self):
+        """
+        A new client (planner) of the broker, called like the pipeline. A batch never
+        waits for more requests than there are active clients; the client stops
+        counting once it is dropped or has been idle for idle_seconds.
+        """
+        client = _Client(self)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unregister(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def active_clients(self):
+        now = time.perf_counter()
+        with self._lock:
+            clients = list(self._clients)
+        return sum(1 for c in clients if c.in_flight or now - c.last_active < self.idle_seconds)
+
+    def submit(self, prompt, gen_config=None):
+        """Queue one prompt; returns a Future of its response."""
+        if self._closed:
+            raise RuntimeError(f'{self.name} broker is closed')
+        request = _Request(prompt, gen_config)
+        self._queue.put(request)
+        return request.future
+
+    def __call__(self, prompt, gen_config=None):
+        """Same call as on the pipeline, for a single prompt; blocks until its batch is done."""
+        return self.submit(prompt, gen_config).result()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            clients = self.active_clients()
+            while len(batch) < self.max_batch_size:
+                try:
+                    # whatever is queued already joins without waiting
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0 or len(batch) >= clients:
+                        break
+                    try:
+                        request = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                if request is _STOP:
+                    stop = True
+                    break
+                batch.append(request)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        start = time.perf_counter()
+        self._queue_wait += sum(start - r.queued_at for r in batch)
+        try:
+            with tracing.span('model.local_batch', size=len(batch)):
+                responses = self.pipe([r.prompt for r in batch], gen_config=[r.gen_config for r in batch])
+            if len(responses) != len(batch):
+                raise RuntimeError(f'pipeline returned {len(responses)} responses for {len(batch)} prompts')
+            for request, response in zip(batch, responses):
+                request.future.set_result(response)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        finally:
+            self._busy_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.requests += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            tracing.count('local_batch_requests', len(batch))
+
+    def stats(self):
+        uptime = time.time() - self._start_time
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'mean_batch_size': round(self.requests / self.batches, 2) if self.batches else 0.0,
+            'largest_batch': self.largest_batch,
+            'mean_queue_wait_ms': round(self._queue_wait / self.requests * 1000, 2) if self.requests else 0.0,
+            'busy_seconds': round(self._busy_seconds, 2),
+            'utilization': round(self._busy_seconds / uptime, 4) if uptime > 0 else 0.0,
+        }
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        logger.info(f"{self.name} broker stats: {self.stats()}")
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+
+def get_local_broker(model_name, tp, make_pipeline):
+    """
+    The broker of (model_name, tp) in this process. The first caller builds the
+    pipeline with make_pipeline(); later ones share it instead of loading the
+    weights again.
+    """
+    key = (model_name, tp)
+    with _brokers_lock:
+        if key not in _brokers:
+            _brokers[key] = LocalInferenceBroker(
+                make_pipeline(),
+                max_batch_size=int(os.environ.get('EB_LOCAL_BATCH_SIZE', 16)),
+                max_wait_ms=float(os.environ.get('EB_LOCAL_MAX_WAIT_MS', 20)),
+                name=f"local-inference[{model_name.split('/')[-1]}]",
+            )
+        return _brokers[key]
+
+
+class SimulatedPipeline:
+    """CPU stand-in for an lmdeploy pipeline: a call takes base_ms plus per_prompt_ms for every prompt in the batch."""
+
+    class Response:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, base_ms=200.0, per_prompt_ms=10.0):
+        self.base = base_ms / 1000.0
+        self.per_prompt = per_prompt_ms / 1000.0
+        self.calls = 0
+
+    def __call__(self, prompts, gen_config=None):
+        single = not isinstance(prompts, list) or (prompts and isinstance(prompts[0], dict))
+        batch = [prompts] if single else prompts
+        self.calls += 1
+        time.sleep(self.base + self.per_prompt * len(batch))
+        responses = [self.Response('{"executable_plan": [{"action_id": 0, "action_name": "prompt %d"}]}' % len(p)) for p in batch]
+        return responses[0] if single else responses
+
+
+def _run_clients(make_call, clients, calls, think_ms):
+    calls_of = [make_call() for _ in range(clients)]
+
+    def client(i):
+        for j in range(calls):
+            calls_of[i]([{'role': 'user', 'content': [{'type': 'text', 'text': f'client {i} call {j}'}]}])
+            # the env step between two planner calls
+            time.sleep(think_ms / 1000.0)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the local inference broker against a simulated pipeline.')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent episodes calling the model')
+    parser.add_argument('--calls', type=int, default=10, help='model calls per client')
+    parser.add_argument('--base_ms', type=float, default=200.0, help='simulated time of a pipeline call')
+    parser.add_argument('--per_prompt_ms', type=float, default=10.0, help='simulated extra time per prompt in a batch')
+    parser.add_argument('--think_ms', type=float, default=50.0, help='time a client spends between calls')
+    parser.add_argument('--max_batch_size', type=int, default=16)
+    parser.add_argument('--max_wait_ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    total = args.clients * args.calls
+    pipe = SimulatedPipeline(args.base_ms, args.per_prompt_ms)
+    lock = threading.Lock()
+
+    def unbatched(prompt):
+        # one pipeline shared by all clients, called with one prompt at a time
+        with lock:
+            return pipe(prompt)
+
+    seconds = _run_clients(lambda: unbatched, args.clients, args.calls, args.think_ms)
+    print(f'unbatched: {total} calls in {seconds:.2f}s, {total / seconds:.1f} calls/s')
+
+    broker = LocalInferenceBroker(SimulatedPipeline(args.base_ms, args.per_prompt_ms), args.max_batch_size, args.max_wait_ms)
+    seconds = _run_clients(broker.register, args.clients, args.calls, args.think_ms)
+    print(f'batched:   {total} calls in {seconds:.2f}s, {total / seconds:.1f} calls/s')
+    print(f'broker stats: {broker.stats()}')
+    broker.close()
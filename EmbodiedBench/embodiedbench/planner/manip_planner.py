@@ -11,8 +11,9 @@ from mimetypes import guess_type
 from embodiedbench.envs.eb_manipulation.eb_man_utils import ROTATION_RESOLUTION, VOXEL_SIZE
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
-from embodiedbench.planner.planner_utils import local_image_to_data_url, template_manip, template_lang_manip
+from embodiedbench.planner.planner_utils import local_image_to_data_url, template_manip, template_lang_manip, fix_json, loads_tolerant
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 VISUAL_ICL_EXAMPLES_PATH = "embodiedbench/evaluator/config/visual_icl_examples/eb_manipulation"
 VISUAL_ICL_EXAMPLE_CATEGORY = {
@@ -44,6 +45,7 @@ class ManipPlanner():
         self.multi_step_image = multistep
         self.visual_icl = visual_icl
     
+    @tracing.traced('planner.prompt')
     def process_prompt(self, user_instruction, avg_obj_coord, task_variation, prev_act_feedback=[]):
         user_instruction = user_instruction.rstrip('.')
         if len(prev_act_feedback) == 0:
@@ -68,6 +70,7 @@ class ManipPlanner():
                 task_prompt += f"{action_feedback}, "
         return general_prompt, task_prompt
 
+    @tracing.traced('planner.prompt')
     def process_prompt_visual_icl(self, user_instruction, avg_obj_coord, prev_act_feedback=[]):
         user_instruction = user_instruction.rstrip('.')
         if len(prev_act_feedback) == 0:
@@ -92,6 +95,7 @@ class ManipPlanner():
                 task_prompt += f"{action_feedback}, "
         return general_prompt, task_prompt
     
+    @tracing.traced('planner.message')
     def get_message(self, images, prompt, task_prompt, messages=[]):
         if self.language_only and not self.visual_icl:
             return messages + [
@@ -216,6 +220,7 @@ class ManipPlanner():
         
             return current_message
     
+    @tracing.traced('planner.message')
     def get_message_visual_icl(self, images, first_prompt, task_prompt, task_variation, messages=[]):
         current_message = [
             {
@@ -277,9 +282,10 @@ class ManipPlanner():
             )
         return current_message
     
+    @tracing.traced('planner.parse')
     def json_to_action(self, output_text):
         try:
-            json_object = json.loads(output_text)
+            json_object, _ = loads_tolerant(output_text)
             action = []
             try:
                 executable_plan = json_object['executable_plan'] if 'executable_plan' in json_object else json_object["properties"]["executable_plan"]
@@ -357,14 +363,14 @@ class ManipPlanner():
     def act_custom(self, prompt, obs):
         assert type(obs) == str # input image path
         out = self.model.respond(prompt, obs)
-        out = out.replace("'",'"')
-        out = out.replace('\"s ', "\'s ")
-        out = out.replace('```json', '').replace('```', '')
+        # fix common generated json errors
+        out = fix_json(out)
         logger.debug(f"Model Output:\n{out}\n")
         action, _ = self.json_to_action(out)
         self.planner_steps += 1
         return action, out
     
+    @tracing.traced('planner.act')
     def act(self, observation, user_instruction, avg_obj_coord, task_variation):
         if type(observation) == dict:
             obs = observation[self.obs_key]
@@ -6,15 +6,15 @@ import cv2
 import json
 # import lmdeploy
 # from lmdeploy import pipeline, GenerationConfig, PytorchEngineConfig
-from openai import OpenAI
 from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
-from embodiedbench.planner.planner_utils import local_image_to_data_url, truncate_message_prompts
+from embodiedbench.planner.planner_utils import local_image_to_data_url, truncate_message_prompts, fix_json, loads_tolerant
 # from embodiedbench.planner.eb_navigation.RemoteModel_claude import RemoteModel
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
 from embodiedbench.evaluator.config.visual_icl_examples.eb_navigation.ebnav_visual_icl import create_example_json_list
 from embodiedbench.planner.planner_utils import template, template_lang
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 template = template
 template_lang = template_lang
@@ -89,6 +89,7 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
         return available_action_str
 
 
+    @tracing.traced('planner.prompt')
     def process_prompt(self, user_instruction, prev_act_feedback=[]):
 
         user_instruction = user_instruction.rstrip('.')
@@ -136,6 +137,7 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
         return prompt
     
 
+    @tracing.traced('planner.message')
     def get_message(self, image, prompt, messages=[]):
 
         if self.language_only:
@@ -232,10 +234,11 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
             action = np.random.randint(len(self.actions))
         return action
     
+    @tracing.traced('planner.parse')
     def json_to_action(self, output_text, json_key='executable_plan'):
         valid = True
         try:
-            json_object = json.loads(output_text)
+            json_object, _ = loads_tolerant(output_text, json_key)
             action = [x[self.action_key] for x in json_object[json_key]]
             if not len(action):
                 print('empty plan, using random action instead')
@@ -258,9 +261,8 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
     def act_custom(self, prompt, obs):
         assert type(obs) == str # input image path
         out = self.model.respond(prompt, obs)
-        out = out.replace("'",'"')
-        out = out.replace('\"s ', "\'s ")
-        out = out.replace('```json', '').replace('```', '')
+        # fix common generated json errors
+        out = fix_json(out)
         logger.debug(f"Model Output:\n{out}\n")
         self.planner_steps += 1
         action, valid = self.json_to_action(out)
@@ -272,6 +274,7 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
             return action, out
 
 
+    @tracing.traced('planner.act')
     def act(self, observation, user_instruction):
         if type(observation) == dict:
             obs = observation[self.obs_key]
@@ -1,10 +1,12 @@
 import os
 import re
+import json
 import base64
 import copy
+from collections import Counter
 from mimetypes import guess_type
-import google.generativeai as genai
-from openai import OpenAI, AzureOpenAI
+from embodiedbench.envs.log_sink import read_file_bytes
+from embodiedbench import tracing
 import typing_extensions as typing
 from pydantic import BaseModel, Field
 
@@ -48,40 +50,251 @@ The fields in above JSON follows the purpose below:
 !!! When generating content for JSON strings, avoid using any contractions or abbreviated forms (like 's, 're, 've, 'll, 'd, n't) that use apostrophes. Instead, write out full forms (is, are, have, will, would, not) to prevent parsing errors in JSON. Please do not output any other thing more than the above-mentioned JSON, do not include ```json and ```!!!.
 '''
 
+# characters that end a run of plain text inside / outside a string
+_STRING_SPECIAL = re.compile(r'["\'\\\x00-\x1f]')
+_STRUCTURE = re.compile(r'["\'{}\[\]:,`]')
+_COMPLETE_SCALAR = re.compile(r'\s*(-?\d+(\.\d+)?([eE][-+]?\d+)?|true|false|null)\s*$')
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+# repairs made by repair_json in this process, by kind
+json_repair_stats = Counter()
+
+
+def _closes_string(text, i):
+    """Whether the quote at text[i] ends its string, i.e. only JSON structure follows it."""
+    n = len(text)
+    j = i + 1
+    while j < n and text[j] in ' \t\r\n':
+        j += 1
+    if j >= n or text[j] in ':}]`':
+        return True
+    if text[j] != ',':
+        return False
+    j += 1
+    while j < n and text[j] in ' \t\r\n':
+        j += 1
+    return j >= n or text[j] in '"\'{[]}-0123456789' or text.startswith(('true', 'false', 'null'), j)
+
+
+def _strip_trailing_comma(out):
+    while out and not out[-1].strip():
+        out.pop()
+    if out and out[-1].rstrip().endswith(','):
+        out[-1] = out[-1].rstrip()[:-1]
+        return True
+    return False
+
+
+def repair_json(text, start=None):
+    """
+    Repair the JSON faults LLMs commonly make in one left-to-right scan, and
+    return (repaired text, Counter of the repairs made):
+
+    - text around the JSON value, e.g. ```json fences (code_fence, extra_text)
+    - single quoted strings, with apostrophes inside them kept (single_quote)
+    - unescaped double quotes inside strings (inner_quote)
+    - raw newlines and other control characters inside strings (control_char)
+    - invalid escapes such as \\' (bad_escape)
+    - trailing commas and mismatched brackets (trailing_comma, bracket)
+    - output cut off before the end (truncated): open brackets are closed and
+      the last incomplete value is dropped. An array element that was not
+      closed, e.g. a half written plan step, is dropped whole; only a value of
+      the top level object may be kept cut off, a string as is and a number
+      if it still reads as one
+
+    A quote ends a string only if structure (`:`, `,` and a value, `}` or `]`)
+    follows it, which is what tells inner quotes and apostrophes apart.
+    """
+    repairs = Counter()
+    if start is None:
+        start = text.find('{')
+        if start < 0:
+            start = text.find('[')
+        if start < 0:
+            return text, repairs
+    if text[:start].strip():
+        repairs['code_fence' if '`' in text[:start] else 'extra_text'] += 1
+
+    out = []
+    stack = []
+    opened_at = []  # where each open bracket of stack starts in out
+    expect_key = False
+    in_string = False
+    quote = is_key = None
+    safe, safe_depth = 0, 0  # out[:safe] ends with a complete value at depth safe_depth
+    value_start = 0  # where the scalar being read outside strings starts
+    n = len(text)
+    i = start
+    while i < n:
+        if in_string:
+            m = _STRING_SPECIAL.search(text, i)
+            if m is None:
+                out.append(text[i:])
+                i = n
+                break
+            out.append(text[i:m.start()])
+            ch = m.group()
+            i = m.end()
+            if ch == '\\':
+                if i >= n:
+                    break
+                nxt = text[i]
+                i += 1
+                if nxt in '"\\/bfnrtu':
+                    out.append('\\' + nxt)
+                elif nxt == "'":
+                    out.append("'")
+                    if quote == '"':
+                        repairs['bad_escape'] += 1
+                else:
+                    out.append('\\\\' + nxt)
+                    repairs['bad_escape'] += 1
+            elif ch == quote and _closes_string(text, i - 1):
+                out.append('"')
+                in_string = False
+                if not is_key:
+                    safe, safe_depth = len(out), len(stack)
+            elif ch == '"':
+                out.append('\\"')
+                if quote == '"':
+                    repairs['inner_quote'] += 1
+            elif ch == "'":
+                out.append(ch)
+            else:
+                out.append(_CONTROL_ESCAPES.get(ch, '\\u%04x' % ord(ch)))
+                repairs['control_char'] += 1
+            continue
+
+        m = _STRUCTURE.search(text, i)
+        if m is None:
+            out.append(text[i:])
+            i = n
+            break
+        out.append(text[i:m.start()])
+        ch = m.group()
+        i = m.end()
+        if ch == '"' or ch == "'":
+            in_string, quote = True, ch
+            is_key = bool(stack) and stack[-1] == '{' and expect_key
+            out.append('"')
+            if ch == "'":
+                repairs['single_quote'] += 1
+        elif ch == '{' or ch == '[':
+            stack.append(ch)
+            opened_at.append(len(out))
+            expect_key = ch == '{'
+            out.append(ch)
+            safe, safe_depth = len(out), len(stack)
+            value_start = len(out)
+        elif ch == '}' or ch == ']':
+            if not stack:
+                repairs['extra_text'] += 1
+                break
+            if _strip_trailing_comma(out):
+                repairs['trailing_comma'] += 1
+            closer = '}' if stack.pop() == '{' else ']'
+            opened_at.pop()
+            if ch != closer:
+                repairs['bracket'] += 1
+            out.append(closer)
+            safe, safe_depth = len(out), len(stack)
+            if not stack:
+                break
+            expect_key = False
+        elif ch == ':':
+            out.append(ch)
+            expect_key = False
+            value_start = len(out)
+        elif ch == ',':
+            if stack:
+                safe, safe_depth = len(out), len(stack)
+                expect_key = stack[-1] == '{'
+            out.append(ch)
+            value_start = len(out)
+        else:
+            # a code fence inside the value
+            repairs['code_fence'] += 1
+
+    if stack:
+        repairs['truncated'] += 1
+        element = next((k for k in range(1, len(stack)) if stack[k - 1] == '['), None)
+        if element is not None:
+            # a step cut off in the middle may have lost digits or words; it is not run
+            del out[opened_at[element]:]
+            del stack[element:]
+        elif stack != ['{']:
+            del out[safe:]
+            del stack[safe_depth:]
+        elif in_string and not is_key:
+            out.append('"')
+        elif in_string or expect_key or not _COMPLETE_SCALAR.match(''.join(out[value_start:])):
+            del out[safe:]
+            del stack[safe_depth:]
+        _strip_trailing_comma(out)
+        out.extend('}' if opener == '{' else ']' for opener in reversed(stack))
+    elif text[i:].strip(' \t\r\n`'):
+        repairs['extra_text'] += 1
+    return ''.join(out), repairs
+
+
+def _extract_plan(text, plan_key):
+    m = re.search(r'["\']%s["\']\s*:\s*\[' % re.escape(plan_key), text)
+    if m is None:
+        return None
+    repaired, _ = repair_json(text, m.end() - 1)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError:
+        return None
+
+
+def loads_tolerant(text, plan_key='executable_plan'):
+    """
+    json.loads for model outputs. Valid JSON is parsed as is; anything else goes
+    through repair_json, and if the repaired text still has no usable plan_key,
+    the plan array alone is recovered from the output. Returns (object, Counter
+    of repairs); raises json.JSONDecodeError if nothing could be recovered.
+    Repairs are added to json_repair_stats and to the trace counters.
+    """
+    try:
+        return json.loads(text), Counter()
+    except json.JSONDecodeError as e:
+        error = e
+    repaired, repairs = repair_json(text)
+    try:
+        obj = json.loads(repaired)
+    except json.JSONDecodeError:
+        obj = None
+    if plan_key is not None and not (isinstance(obj, dict) and plan_key in obj):
+        plan = _extract_plan(text, plan_key)
+        if plan is not None:
+            obj = obj if isinstance(obj, dict) else {}
+            obj[plan_key] = plan
+            repairs['plan_extracted'] += 1
+    if obj is None:
+        raise error
+    _record_repairs(repairs)
+    return obj, repairs
+
+
+def _record_repairs(repairs):
+    json_repair_stats.update(repairs)
+    for kind, value in repairs.items():
+        tracing.count('json_repair.' + kind, value)
+
+
 def fix_json(json_str):
     """
-    Locates the substring between the keys "reasoning_and_reflection" and "language_plan"
-    and escapes any inner double quotes that are not already escaped.
-    
-    The regex uses a positive lookahead to stop matching when reaching the delimiter for the next key.
+    Fix common errors in generated json, see repair_json. Valid json is returned
+    unchanged; output that cannot be repaired comes back as the best effort.
     """
-    # first fix common errors
-    json_str = json_str.replace("'",'"') 
-    json_str = json_str.replace('\"s ', "\'s ")
-    json_str = json_str.replace('\"re ', "\'re ")
-    json_str = json_str.replace('\"ll ', "\'ll ")
-    json_str = json_str.replace('\"t ', "\'t ")
-    json_str = json_str.replace('\"d ', "\'d ")
-    json_str = json_str.replace('\"m ', "\'m ")
-    json_str = json_str.replace('\"ve ', "\'ve ")
-    json_str = json_str.replace('```json', '').replace('```', '')
-
-    # Then fix some situations. Pattern explanation:
-    # 1. ("reasoning_and_reflection"\s*:\s*") matches the key and the opening quote.
-    # 2. (?P<value>.*?) lazily captures everything in a group named 'value'.
-    # 3. (?=",\s*"language_plan") is a positive lookahead that stops matching before the closing quote
-    #    that comes before the "language_plan" key.
-    pattern = r'("reasoning_and_reflection"\s*:\s*")(?P<value>.*?)(?=",\s*"language_plan")'
-    
-    def replacer(match):
-        prefix = match.group(1)            # Contains the key and the opening quote.
-        value = match.group("value")         # The raw value that might contain unescaped quotes.
-        # Escape any double quote that is not already escaped.
-        fixed_value = re.sub(r'(?<!\\)"', r'\\"', value)
-        return prefix + fixed_value
-
-    # Use re.DOTALL so that newlines in the value are included.
-    fixed_json = re.sub(pattern, replacer, json_str, flags=re.DOTALL)
+    try:
+        json.loads(json_str)
+        return json_str
+    except json.JSONDecodeError:
+        pass
+    fixed_json, repairs = repair_json(json_str)
+    _record_repairs(repairs)
     return fixed_json
 
 
@@ -211,15 +424,15 @@ class ActionPlan_lang_manip(BaseModel):
     executable_plan: str
 
 # Function to encode a local image into data URL 
+@tracing.traced('planner.encode_image')
 def local_image_to_data_url(image_path):
     # Guess the MIME type of the image based on the file extension
     mime_type, _ = guess_type(image_path)
     if mime_type is None:
         mime_type = 'application/octet-stream'  # Default MIME type if none is found
 
-    # Read and encode the image file
-    with open(image_path, "rb") as image_file:
-        base64_encoded_data = base64.b64encode(image_file.read()).decode('utf-8')
+    # Read and encode the image file, which may still be queued in the episode log writer
+    base64_encoded_data = base64.b64encode(read_file_bytes(image_path)).decode('utf-8')
 
     # Construct the data URL
     return f"data:{mime_type};base64,{base64_encoded_data}"
@@ -276,4 +489,85 @@ def truncate_message_prompts(message_history: list):
             
             processed_messages.append(processed_message)
     
-    return processed_messages
\ No newline at end of file
+    return processed_messages
+
+
+class PlanStreamParser:
+    """
+    Incremental parser for a JSON plan that arrives in chunks.
+
+    feed() takes the next chunk of model output and returns the executable_plan
+    steps that the chunk completed, so the first action can be executed while
+    the rest of the response is still being generated. Strings are tracked
+    across chunks, so braces or the key name inside descriptions do not confuse
+    it; text before the opening brace (e.g. ```json) is skipped.
+    """
+
+    def __init__(self, plan_key='executable_plan'):
+        self.plan_key = plan_key
+        self.steps = []
+        self.plan_closed = False  # the whole plan array has been received
+        self.failed = False  # a step was not valid JSON, later steps are not trusted
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_chars = None  # characters of the string being read at the top level
+        self._last_key = None
+        self._plan_next = False  # the value after the current ':' is the plan
+        self._plan_depth = None  # depth of the plan array while inside it
+        self._step_chars = None  # characters of the step object being read
+
+    def feed(self, chunk):
+        completed = []
+        for ch in chunk:
+            if self._step_chars is not None:
+                self._step_chars.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._last_key = ''.join(self._key_chars)
+                        self._key_chars = None
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._key_chars = [] if self._depth == 1 else None
+            elif ch == '{' or ch == '[':
+                self._depth += 1
+                if ch == '[' and self._plan_next and self._depth == 2:
+                    self._plan_depth = 2
+                elif ch == '{' and self._plan_depth is not None and self._depth == self._plan_depth + 1:
+                    self._step_chars = ['{']
+            elif ch == '}' or ch == ']':
+                if ch == '}' and self._step_chars is not None and self._depth == self._plan_depth + 1:
+                    step = self._parse_step(''.join(self._step_chars))
+                    self._step_chars = None
+                    if step is not None:
+                        completed.append(step)
+                elif ch == ']' and self._plan_depth is not None and self._depth == self._plan_depth:
+                    self._plan_depth = None
+                    self.plan_closed = True
+                self._depth -= 1
+            elif ch == ':' and self._depth == 1:
+                self._plan_next = self._last_key == self.plan_key
+            elif ch == ',' and self._depth == 1:
+                self._plan_next = False
+        self.steps.extend(completed)
+        return completed
+
+    def _parse_step(self, text):
+        if self.failed:
+            return None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            self.failed = True
+            return None
+
@@ -2,21 +2,32 @@ import json
 import sys
 import os
 import base64
-import anthropic
-import google.generativeai as genai
-from openai import OpenAI
-import typing_extensions as typing
-import lmdeploy
-from lmdeploy import pipeline, GenerationConfig, PytorchEngineConfig
 from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
 from embodiedbench.planner.planner_config.generation_guide_manip import llm_generation_guide_manip, vlm_generation_guide_manip
 from embodiedbench.planner.planner_utils import convert_format_2claude, convert_format_2gemini, ActionPlan_1, ActionPlan, ActionPlan_lang, \
                                              ActionPlan_1_manip, ActionPlan_manip, ActionPlan_lang_manip, fix_json
+from embodiedbench import tracing
 
 temperature = 0
 max_completion_tokens = 2048
 remote_url = os.environ.get('remote_url')
 
+def load_backend(model_name, model_type='remote'):
+    """
+    Import the client library a model needs: lmdeploy for local models, anthropic
+    for Claude and openai for every other remote model. Nothing else is imported,
+    since lmdeploy alone takes seconds.
+    """
+    if model_type == 'local':
+        import lmdeploy
+        return lmdeploy
+    if "claude" in model_name:
+        import anthropic
+        return anthropic
+    import openai
+    return openai
+
+
 class RemoteModel:
     def __init__(
         self,
@@ -31,15 +42,20 @@ class RemoteModel:
         self.language_only = language_only
         self.task_type = task_type
 
+        backend = load_backend(model_name, model_type)
         if self.model_type == 'local':
-            backend_config = PytorchEngineConfig(session_len=12000, dtype='float16', tp=tp)
-            self.model = pipeline(self.model_name, backend_config=backend_config)
+            # planners of the same model share one pipeline; their calls are batched by the broker
+            from embodiedbench.planner.local_inference import get_local_broker
+            backend_config = backend.PytorchEngineConfig(session_len=12000, dtype='float16', tp=tp)
+            broker = get_local_broker(self.model_name, tp, lambda: backend.pipeline(self.model_name, backend_config=backend_config))
+            self.model = broker.register()
+        elif "claude" in self.model_name:
+            self.model = backend.Anthropic(
+                api_key=os.environ.get("ANTHROPIC_API_KEY"),
+            )
         else:
-            if "claude" in self.model_name:
-                self.model = anthropic.Anthropic(
-                    api_key=os.environ.get("ANTHROPIC_API_KEY"),
-                )
-            elif "gemini" in self.model_name:
+            OpenAI = backend.OpenAI
+            if "gemini" in self.model_name:
                 self.model = OpenAI(
                     api_key=os.environ.get("GEMINI_API_KEY"),
                     base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
@@ -71,6 +87,7 @@ class RemoteModel:
                     raise ValueError(f"Unsupported model name: {model_name}")
 
 
+    @tracing.traced('model.respond')
     def respond(self, message_history: list):
         if self.model_type == 'local':
             return self._call_local(message_history)
@@ -106,6 +123,87 @@ class RemoteModel:
             else:
                 raise ValueError(f"Unsupported model name: {self.model_name}")
 
+    def _stream_options(self):
+        """
+        How respond() calls this model, for respond_stream(): 'claude', or a tuple
+        (convert to the gemini message format, send the json schema, fix the json).
+        None if the backend is not streamed.
+        """
+        name = self.model_name
+        if self.model_type == 'local':
+            return None
+        if "claude" in name:
+            return 'claude'
+        if "gemini" in name:
+            # structured outputs through beta.chat.completions.parse
+            return None
+        if "gpt" in name or 'qwen' in name:
+            return (False, True, False)
+        if "Qwen2-VL-7B-Instruct" in name or "Qwen2.5-VL-7B-Instruct" in name or "Llama-3.2-11B-Vision-Instruct" in name:
+            return (True, True, False)
+        if "Qwen2-VL-72B-Instruct" in name or "Qwen2.5-VL-72B-Instruct" in name or "meta-llama/Llama-3.2-90B-Vision-Instruct" in name:
+            return (True, True, True)
+        if "OpenGVLab/InternVL" in name:
+            return (False, False, True)
+        return None
+
+    def supports_streaming(self):
+        return self._stream_options() is not None
+
+    def _response_format(self):
+        if self.task_type == 'manip':
+            schema = llm_generation_guide_manip if self.language_only else vlm_generation_guide_manip
+        else:
+            schema = llm_generation_guide if self.language_only else vlm_generation_guide
+        return dict(type='json_schema', json_schema=dict(name='embodied_planning', schema=schema))
+
+    def respond_stream(self, message_history: list):
+        """
+        Yield the response text in chunks while the model generates it. Backends
+        that are not streamed yield the whole respond() output once. The joined
+        chunks are the raw output, postprocess() turns them into what respond() returns.
+        """
+        options = self._stream_options()
+        if options is None:
+            yield self.respond(message_history)
+            return
+
+        if options == 'claude':
+            if not self.language_only:
+                message_history = convert_format_2claude(message_history)
+            with self.model.messages.stream(
+                model=self.model_name,
+                max_tokens=max_completion_tokens,
+                temperature=temperature,
+                messages=message_history
+            ) as stream:
+                for text in stream.text_stream:
+                    yield text
+            return
+
+        gemini_format, use_schema, _ = options
+        if gemini_format and not self.language_only:
+            message_history = convert_format_2gemini(message_history)
+        kwargs = dict(
+            model=self.model_name,
+            messages=message_history,
+            temperature=temperature,
+            max_tokens=max_completion_tokens,
+            stream=True,
+        )
+        if use_schema:
+            kwargs['response_format'] = self._response_format()
+        for chunk in self.model.chat.completions.create(**kwargs):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def postprocess(self, text):
+        """Apply to the joined respond_stream() chunks the fixes respond() applies."""
+        options = self._stream_options()
+        if options is not None and options != 'claude' and options[2]:
+            return fix_json(text)
+        return text
+
     def _call_local(self, message_history: list):
         if self.task_type == 'manip':
             response_format = {
@@ -123,6 +221,7 @@ class RemoteModel:
                     "schema": llm_generation_guide if self.language_only else vlm_generation_guide
                 }
             }
+        from lmdeploy import GenerationConfig
         response = self.model(
             message_history,
             gen_config=GenerationConfig(
@@ -1,15 +1,16 @@
-import torch
 import re
 import os
 import time
 import numpy as np
 import cv2
 import json
+import threading
 from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
-from embodiedbench.planner.planner_utils import local_image_to_data_url, template, template_lang, fix_json
+from embodiedbench.planner.planner_utils import local_image_to_data_url, template, template_lang, fix_json, loads_tolerant, PlanStreamParser
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
 from embodiedbench.main import logger
+from embodiedbench import tracing
 
 class VLMPlanner():
     def __init__(self, model_name, model_type, actions, system_prompt, examples, n_shot=0, obs_key='head_rgb', 
@@ -48,6 +49,7 @@ class VLMPlanner():
         return available_action_str
 
 
+    @tracing.traced('planner.prompt')
     def process_prompt(self, user_instruction, prev_act_feedback=[]):
         user_instruction = user_instruction.rstrip('.')
         if len(prev_act_feedback) == 0:
@@ -95,6 +97,7 @@ class VLMPlanner():
         return prompt
     
 
+    @tracing.traced('planner.message')
     def get_message(self, image, prompt, messages=[]):
         if self.language_only:
             return messages + [
@@ -150,9 +153,10 @@ class VLMPlanner():
             action = np.random.randint(len(self.actions))
         return action
     
+    @tracing.traced('planner.parse')
     def json_to_action(self, output_text, json_key='executable_plan'):
         try:
-            json_object = json.loads(output_text)
+            json_object, _ = loads_tolerant(output_text, json_key)
             action = [x[self.action_key] for x in json_object[json_key]]
             if not len(action):
                 print('empty plan, stop here')
@@ -191,7 +195,8 @@ class VLMPlanner():
         return action, out
 
 
-    def act(self, observation, user_instruction):
+    def _prepare(self, observation, user_instruction):
+        """Build the prompt and the message list of the next call; returns (obs, prompt)."""
         if type(observation) == dict:
             obs = observation[self.obs_key]
         else:
@@ -203,7 +208,7 @@ class VLMPlanner():
             prompt = prompt + template_lang if self.language_only else prompt + template
 
         if self.model_type == 'custom':
-            return self.act_custom(prompt, obs) 
+            return obs, prompt
 
         if len(self.episode_messages) == 0:
              self.episode_messages = self.get_message(obs, prompt)
@@ -218,26 +223,17 @@ class VLMPlanner():
                 if content_item["type"] == "text":
                     text_content = content_item["text"]
                     logger.debug(f"Model Input:\n{text_content}\n")
+        return obs, prompt
 
-        if 'gemini-1.5-pro' in self.model_name or 'gemini-2.0-flash' in self.model_name:
-            try: 
-                out = self.model.respond(self.episode_messages)
-                time.sleep(15)
-            except Exception as e:
-                print("An unexpected error occurred:", e)
-                time.sleep(60)
-                out = self.model.respond(self.episode_messages)
+    def _retry_respond(self, error):
+        print("An unexpected error occurred:", error)
+        if self.model_type != 'local':
+            time.sleep(60)
         else:
-            try: 
-                out = self.model.respond(self.episode_messages)
-            except Exception as e:
-                print("An unexpected error occurred:", e)
+            time.sleep(20)
+        return self.model.respond(self.episode_messages)
 
-                if self.model_type != 'local':
-                    time.sleep(60)
-                else:
-                    time.sleep(20)
-                out = self.model.respond(self.episode_messages)
+    def _finish(self, out):
         logger.debug(f"Model Output:\n{out}\n")
 
         if self.chat_history:
@@ -251,6 +247,39 @@ class VLMPlanner():
         self.planner_steps += 1
         return action, out
 
+    @tracing.traced('planner.act')
+    def act(self, observation, user_instruction):
+        obs, prompt = self._prepare(observation, user_instruction)
+        if self.model_type == 'custom':
+            return self.act_custom(prompt, obs) 
+
+        if 'gemini-1.5-pro' in self.model_name or 'gemini-2.0-flash' in self.model_name:
+            try: 
+                out = self.model.respond(self.episode_messages)
+                time.sleep(15)
+            except Exception as e:
+                print("An unexpected error occurred:", e)
+                time.sleep(60)
+                out = self.model.respond(self.episode_messages)
+        else:
+            try: 
+                out = self.model.respond(self.episode_messages)
+            except Exception as e:
+                out = self._retry_respond(e)
+        return self._finish(out)
+
+    def act_stream(self, observation, user_instruction):
+        """
+        Like act, but the response is read from the model stream on a background thread.
+        Returns a StreamingPlan: first_action() is available as soon as the first step of
+        executable_plan is complete in the stream, result() returns what act would.
+        Models that cannot stream give a plan without an early first action.
+        """
+        if self.model_type == 'custom' or not self.model.supports_streaming():
+            return StreamingPlan.completed(self.act(observation, user_instruction))
+        self._prepare(observation, user_instruction)
+        return StreamingPlan(self)
+
     def update_info(self, info):
         """Update episode feedback history."""
         self.episode_act_feedback.append([
@@ -259,5 +288,69 @@ class VLMPlanner():
         ])
 
 
-        
+class StreamingPlan:
+    """A planner call whose model response is streamed and parsed on a background thread."""
+    def __init__(self, planner=None):
+        self.planner = planner
+        self.parser = PlanStreamParser()
+        self.chunks = []
+        self.error = None
+        # seconds from the request to the first complete plan step
+        self.time_to_first_action = None
+        self._result = None
+        self._done = threading.Event()
+        self._cond = threading.Condition()
+        self._start = time.time()
+        if planner is not None:
+            self._thread = threading.Thread(target=self._consume, args=(planner.episode_messages,), daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def completed(cls, result):
+        plan = cls()
+        plan._result = result
+        plan._done.set()
+        return plan
+
+    def _consume(self, messages):
+        try:
+            with tracing.span('model.stream'):
+                for chunk in self.planner.model.respond_stream(messages):
+                    self.chunks.append(chunk)
+                    if self.parser.feed(chunk) and self.time_to_first_action is None:
+                        with self._cond:
+                            self.time_to_first_action = time.time() - self._start
+                            self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self._done.set()
+                self._cond.notify_all()
 
+    @tracing.traced('planner.first_action')
+    def first_action(self):
+        """Action id of the first plan step once it is complete in the stream, None if there is none to trust."""
+        if self.planner is None:
+            return None
+        with self._cond:
+            self._cond.wait_for(lambda: self.time_to_first_action is not None or self._done.is_set())
+        if self.parser.failed or not self.parser.steps:
+            return None
+        action = self.parser.steps[0].get(self.planner.action_key)
+        if type(action) != int or action < 0 or action >= len(self.planner.actions):
+            return None
+        return action
+
+    @tracing.traced('planner.act')
+    def result(self):
+        """(action, output) of the whole response, as returned by VLMPlanner.act."""
+        if self._result is None:
+            self._done.wait()
+            planner = self.planner
+            if self.error is not None:
+                out = planner._retry_respond(self.error)
+            else:
+                out = planner.model.postprocess(''.join(self.chunks))
+            self._result = planner._finish(out)
+        return self._result
@@ -0,0 +1,245 @@
+"""
+Span tracing of evaluation runs.
+
+Evaluators, planners, models, envs and simulator connectors mark their stages
+with `span(...)` or `@traced(...)` and bump counters with `count(...)`.
+Tracing is off by default. While it is off, each call returns right away:
+`span` hands back a shared no-op context manager and records nothing, so the
+hooks can stay on the step path.
+
+`enable()` starts recording. Spans are kept per thread with their nesting,
+so a stage's self time excludes the stages nested in it. `export_run(dir)`
+writes two files and starts a new recording:
+
+- `trace.json`, a Chrome trace that chrome://tracing or
+  https://ui.perfetto.dev can open;
+- `trace_summary.json`, per-stage count, total, self time and latency
+  percentiles, also logged as a table.
+
+The evaluators enable tracing with `trace: True` in their config, or with
+EB_TRACE=1 in the environment. They export after every eval set, next to its
+summary.
+"""
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+from embodiedbench.main import logger
+
+PERCENTILES = [50, 90, 99]
+
+_tracer = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'args', 'start', 'child_ns')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+        self.child_ns = 0
+
+    def set(self, **args):
+        """Attach values that are only known inside the span, e.g. a result size."""
+        self.args.update(args)
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter_ns() - self.start
+        stack = self.tracer._stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_ns += duration
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._record(self, duration)
+        return False
+
+
+class Tracer:
+    def __init__(self, max_events=1000000):
+        """
+        Args:
+            max_events (int): trace events kept for export; later spans still count in the summary
+        """
+        self.max_events = max_events
+        self.origin_ns = time.perf_counter_ns()
+        self.wall_origin = time.time()
+        self.events = []
+        self.dropped_events = 0
+        self.durations = defaultdict(list)
+        self.self_ns = defaultdict(int)
+        self.counters = defaultdict(float)
+        self._threads = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add_event(self, event):
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        if len(self.events) < self.max_events:
+            self.events.append(event + (tid,))
+        else:
+            self.dropped_events += 1
+
+    def _record(self, span, duration):
+        with self._lock:
+            self.durations[span.name].append(duration)
+            self.self_ns[span.name] += duration - span.child_ns
+            self._add_event(('X', span.name, span.start, duration, span.args))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+            self._add_event(('C', name, time.perf_counter_ns(), 0, {'value': self.counters[name]}))
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                        for tid, name in self._threads.items()]
+        for phase, name, start, duration, args, tid in self.events:
+            event = {'name': name, 'ph': phase, 'pid': pid, 'tid': tid, 'ts': (start - self.origin_ns) / 1000.0}
+            if phase == 'X':
+                event['dur'] = duration / 1000.0
+            if args:
+                event['args'] = args
+            trace_events.append(event)
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                'otherData': {'start_time': self.wall_origin, 'dropped_events': self.dropped_events}}
+
+    def summary(self):
+        """Per-stage statistics in ms, the stages that took the most time first, plus the counters."""
+        stages = []
+        for name, durations in self.durations.items():
+            ms = sorted(d / 1e6 for d in durations)
+            row = {'stage': name, 'count': len(ms), 'total_ms': sum(ms), 'self_ms': self.self_ns[name] / 1e6,
+                   'mean_ms': sum(ms) / len(ms), 'max_ms': ms[-1]}
+            for p in PERCENTILES:
+                row['p{}_ms'.format(p)] = ms[min(len(ms) - 1, int(round(p / 100.0 * (len(ms) - 1))))]
+            stages.append(row)
+        stages.sort(key=lambda row: row['total_ms'], reverse=True)
+        return {'wall_seconds': (time.perf_counter_ns() - self.origin_ns) / 1e9, 'stages': stages,
+                'counters': dict(self.counters)}
+
+    def format_summary(self, summary=None):
+        summary = summary or self.summary()
+        header = ['stage', 'count', 'total_ms', 'self_ms', 'mean_ms'] + ['p{}_ms'.format(p) for p in PERCENTILES] + ['max_ms']
+        rows = [[row['stage'], str(row['count'])] + ['{:.2f}'.format(row[h]) for h in header[2:]] for row in summary['stages']]
+        widths = [max([len(h)] + [len(r[i]) for r in rows]) for i, h in enumerate(header)]
+        lines = ['  '.join(h.ljust(w) for h, w in zip(header, widths))]
+        lines += ['  '.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows]
+        lines += ['{}: {:g}'.format(name, value) for name, value in sorted(summary['counters'].items())]
+        return '\n'.join(lines)
+
+    def export(self, out_dir):
+        """Write trace.json and trace_summary.json to out_dir."""
+        os.makedirs(out_dir, exist_ok=True)
+        with self._lock:
+            trace = self.chrome_trace()
+            summary = self.summary()
+        with open(os.path.join(out_dir, 'trace.json'), 'w') as f:
+            json.dump(trace, f, default=str)
+        with open(os.path.join(out_dir, 'trace_summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+def enable(max_events=1000000):
+    """Start recording spans and counters in this process."""
+    global _tracer
+    _tracer = Tracer(max_events)
+    return _tracer
+
+
+def disable():
+    """Stop recording; returns the tracer with what was recorded so far."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def get_tracer():
+    return _tracer
+
+
+def configure(config):
+    """Enable tracing if the evaluator config or EB_TRACE asks for it."""
+    if (config.get('trace', False) or os.environ.get('EB_TRACE', '0') not in ('', '0')) and _tracer is None:
+        enable()
+
+
+def span(name, **args):
+    """Context manager timing the enclosed block as stage `name`; args show up in the trace."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return Span(tracer, name, args)
+
+
+def traced(name):
+    """Decorator timing every call of a function or method as stage `name`."""
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            with Span(tracer, name, {}):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__qualname__ = fn.__qualname__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value)
+
+
+def export_run(out_dir):
+    """Write the trace of the run so far to out_dir, log its stage table and start a fresh recording."""
+    tracer = _tracer
+    if tracer is None:
+        return None
+    summary = tracer.export(out_dir)
+    logger.info(f"Trace written to {os.path.join(out_dir, 'trace.json')}\n{tracer.format_summary(summary)}")
+    enable(tracer.max_events)
+    return summary
@@ -0,0 +1,160 @@
+"""
+The indexed goal-condition check of every ALFRED task type must give the same
+(satisfied, total) as the reference scan over the event metadata, also when
+replaying a sequence of events through the per-event cache.
+"""
+import os
+import random
+from types import SimpleNamespace
+
+import pytest
+
+tasks = pytest.importorskip("embodiedbench.envs.eb_alfred.env.tasks")
+
+REWARD_CONFIG = os.path.join(os.path.dirname(tasks.__file__), '..', 'models', 'config', 'rewards.json')
+
+TASK_TYPES = [
+    'pick_and_place_simple',
+    'pick_two_obj_and_place',
+    'look_at_obj_in_light',
+    'pick_heat_then_place_in_recep',
+    'pick_cool_then_place_in_recep',
+    'pick_clean_then_place_in_recep',
+    'pick_and_place_with_movable_recep',
+]
+NAMES = ['Apple', 'AppleSliced', 'Fridge', 'Bowl', 'DeskLamp', 'CounterTop', 'Mug']
+
+
+class FakeEvent:
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+
+def make_env():
+    return SimpleNamespace(last_event=None, heated_objects=set(), cooled_objects=set(), cleaned_objects=set())
+
+
+def make_task(task_type, env, sliced=False):
+    traj = {
+        'task_type': task_type,
+        'plan': {'high_pddl': [{'planner_action': {'action': 'GotoLocation'}},
+                               {'planner_action': {'action': 'End'}}],
+                 'low_actions': []},
+        'pddl_params': {'object_target': 'Apple', 'parent_target': 'Fridge', 'toggle_target': 'DeskLamp',
+                        'mrecep_target': 'Bowl', 'object_sliced': sliced},
+        'scene': {'floor_plan': 'FloorPlan1', 'scene_num': 1},
+    }
+    return tasks.get_task(task_type, traj, env, SimpleNamespace(reward_config=REWARD_CONFIG))
+
+
+def random_metadata(rng):
+    objects = []
+    for name in NAMES:
+        for i in range(rng.randint(1, 3)):
+            objects.append({
+                'objectId': '{}|{}|0|0'.format(name, i),
+                'receptacle': rng.random() < 0.5 or name == 'Fridge',
+                'pickupable': rng.random() < 0.7,
+                'toggleable': rng.random() < 0.5,
+                'isToggled': rng.random() < 0.5,
+                'visible': rng.random() < 0.5,
+                'receptacleObjectIds': None,
+                'parentReceptacles': None,
+            })
+    ids = [obj['objectId'] for obj in objects]
+    for obj in objects:
+        if obj['receptacle'] and rng.random() < 0.8:
+            obj['receptacleObjectIds'] = rng.sample(ids, rng.randint(0, 4))
+        if rng.random() < 0.6:
+            obj['parentReceptacles'] = rng.sample(ids, rng.randint(0, 2))
+        if obj['receptacle'] and rng.random() < 0.1:
+            obj['receptacleObjectIds'] = []
+    inventory = [rng.choice(objects)] if rng.random() < 0.5 else []
+    return {'objects': objects, 'inventoryObjects': inventory}
+
+
+def random_env_state(env, metadata, rng):
+    ids = [obj['objectId'] for obj in metadata['objects']]
+    env.heated_objects = set(rng.sample(ids, rng.randint(0, 3)))
+    env.cooled_objects = set(rng.sample(ids, rng.randint(0, 3)))
+    env.cleaned_objects = set(rng.sample(ids, rng.randint(0, 3)))
+
+
+@pytest.mark.parametrize('task_type', TASK_TYPES)
+@pytest.mark.parametrize('sliced', [False, True])
+def test_indexed_matches_scan_on_random_events(task_type, sliced):
+    rng = random.Random(TASK_TYPES.index(task_type) * 2 + sliced)
+    env = make_env()
+    task = make_task(task_type, env, sliced)
+    for _ in range(300):
+        event = FakeEvent(random_metadata(rng))
+        random_env_state(env, event.metadata, rng)
+        assert task.goal_conditions_met(event) == task.scan_goal_conditions_met(event)
+
+
+@pytest.mark.parametrize('task_type', TASK_TYPES)
+def test_replayed_episode_matches_scan(task_type):
+    """One scene stepped through a heat-and-place episode; every step is checked twice to go through the cache."""
+    env = make_env()
+    task = make_task(task_type, env)
+    apple = {'objectId': 'Apple|0|0|0', 'receptacle': False, 'pickupable': True, 'toggleable': False,
+             'isToggled': False, 'visible': True, 'receptacleObjectIds': None, 'parentReceptacles': None}
+    bowl = {'objectId': 'Bowl|0|0|0', 'receptacle': True, 'pickupable': True, 'toggleable': False,
+            'isToggled': False, 'visible': True, 'receptacleObjectIds': [], 'parentReceptacles': ['CounterTop|0|0|0']}
+    fridge = {'objectId': 'Fridge|0|0|0', 'receptacle': True, 'pickupable': False, 'toggleable': False,
+              'isToggled': False, 'visible': True, 'receptacleObjectIds': [], 'parentReceptacles': None}
+    lamp = {'objectId': 'DeskLamp|0|0|0', 'receptacle': False, 'pickupable': False, 'toggleable': True,
+            'isToggled': False, 'visible': False, 'receptacleObjectIds': None, 'parentReceptacles': None}
+
+    def snapshot(inventory=()):
+        objects = [dict(obj, receptacleObjectIds=list(obj['receptacleObjectIds']) if obj['receptacleObjectIds'] is not None else None)
+                   for obj in (apple, bowl, fridge, lamp)]
+        return FakeEvent({'objects': objects, 'inventoryObjects': [dict(o) for o in inventory]})
+
+    steps = []
+    steps.append(snapshot())
+    steps.append(snapshot(inventory=[apple]))
+    lamp.update(isToggled=True, visible=True)
+    steps.append(snapshot(inventory=[apple]))
+    env.heated_objects.add(apple['objectId'])
+    env.cooled_objects.add(apple['objectId'])
+    env.cleaned_objects.add(apple['objectId'])
+    steps.append(snapshot(inventory=[apple]))
+    bowl['receptacleObjectIds'].append(apple['objectId'])
+    steps.append(snapshot())
+    fridge['receptacleObjectIds'].extend([bowl['objectId'], apple['objectId']])
+    bowl['parentReceptacles'] = [fridge['objectId']]
+    steps.append(snapshot())
+
+    for event in steps:
+        expected = task.scan_goal_conditions_met(event)
+        assert task.goal_conditions_met(event) == expected
+        assert task.goal_conditions_met(event) == expected
+    # the goal is reached at the end of the replay, except for the tasks needing a lamp view or a second object
+    if task_type not in ('look_at_obj_in_light', 'pick_two_obj_and_place'):
+        s, ts = task.goal_conditions_met(steps[-1])
+        assert s == ts
+
+
+def test_cache_follows_env_state_on_the_same_event():
+    env = make_env()
+    task = make_task('pick_heat_then_place_in_recep', env)
+    event = FakeEvent({'objects': [
+        {'objectId': 'Apple|0|0|0', 'receptacle': False, 'pickupable': True, 'receptacleObjectIds': None},
+        {'objectId': 'Fridge|0|0|0', 'receptacle': True, 'pickupable': False, 'receptacleObjectIds': ['Apple|0|0|0']},
+    ], 'inventoryObjects': []})
+    assert task.goal_conditions_met(event) == task.scan_goal_conditions_met(event) == (1, 3)
+    env.heated_objects.add('Apple|0|0|0')
+    assert task.goal_conditions_met(event) == task.scan_goal_conditions_met(event) == (3, 3)
+
+
+def test_two_object_task_without_parent_raises_on_both_paths():
+    env = make_env()
+    task = make_task('pick_two_obj_and_place', env)
+    event = FakeEvent({'objects': [
+        {'objectId': 'Apple|0|0|0', 'receptacle': False, 'pickupable': True, 'receptacleObjectIds': None},
+    ], 'inventoryObjects': []})
+    with pytest.raises(ValueError):
+        task.scan_goal_conditions_met(event)
+    with pytest.raises(ValueError):
+        task.goal_conditions_met(event)
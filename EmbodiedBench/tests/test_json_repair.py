@@ -0,0 +1,90 @@
+"""
+repair_json and loads_tolerant on the faults listed in the repair_json
+docstring, one kind at a time, and on plans cut off in the middle of a step.
+"""
+import json
+
+import pytest
+
+planner_utils = pytest.importorskip("embodiedbench.planner.planner_utils")
+repair_json = planner_utils.repair_json
+loads_tolerant = planner_utils.loads_tolerant
+
+STEP = '{"action_id": 2, "action_name": "go to the sink"}'
+
+
+def repaired(text):
+    out, repairs = repair_json(text)
+    return json.loads(out), repairs
+
+
+def test_valid_json_is_untouched():
+    text = '{"executable_plan": [%s]}' % STEP
+    assert loads_tolerant(text) == (json.loads(text), {})
+    assert planner_utils.fix_json(text) == text
+
+
+@pytest.mark.parametrize('text, kind, expected', [
+    ('```json\n{"a": 1}\n```', 'code_fence', {'a': 1}),
+    ('Here is my plan: {"a": 1} Hope it helps.', 'extra_text', {'a': 1}),
+    ("{'a': 'the apple's color'}", 'single_quote', {'a': "the apple's color"}),
+    ('{"a": "say "hi" now"}', 'inner_quote', {'a': 'say "hi" now'}),
+    ('{"a": "line one\nline two\ttab"}', 'control_char', {'a': 'line one\nline two\ttab'}),
+    ('{"a": "it\\\'s", "b": "\\d"}', 'bad_escape', {'a': "it's", 'b': '\\d'}),
+    ('{"a": [1, 2,], "b": 3,}', 'trailing_comma', {'a': [1, 2], 'b': 3}),
+    ('{"a": [1, 2}}', 'bracket', {'a': [1, 2]}),
+])
+def test_repair_kinds(text, kind, expected):
+    obj, repairs = repaired(text)
+    assert obj == expected
+    assert repairs[kind] >= 1
+
+
+def test_truncated_top_level_string_is_kept():
+    obj, repairs = repaired('{"reasoning": "r", "language_plan": "1. go to the si')
+    assert obj == {'reasoning': 'r', 'language_plan': '1. go to the si'}
+    assert repairs['truncated'] == 1
+
+
+def test_truncated_top_level_number_is_kept():
+    assert repaired('{"reasoning": "r", "score": 12')[0] == {'reasoning': 'r', 'score': 12}
+
+
+def test_truncated_key_is_dropped():
+    assert repaired('{"reasoning": "r", "langu')[0] == {'reasoning': 'r'}
+
+
+@pytest.mark.parametrize('tail', [
+    '{"action_id": 1',
+    '{"action_id": 1, "action_name": "find a Ap',
+    '{"action_id": 1, "action_name": "find an apple"',
+    '{"action_',
+    '{',
+])
+def test_step_cut_off_is_dropped(tail):
+    text = '{"reasoning": "r", "executable_plan": [%s, %s' % (STEP, tail)
+    obj, repairs = loads_tolerant(text)
+    assert obj == {'reasoning': 'r', 'executable_plan': [json.loads(STEP)]}
+    assert repairs['truncated'] == 1
+
+
+def test_nested_array_step_cut_off_is_dropped():
+    obj, _ = loads_tolerant('{"executable_plan": [[1, 2, 3], [4, 5')
+    assert obj == {'executable_plan': [[1, 2, 3]]}
+
+
+def test_scalar_cut_off_in_array_is_dropped():
+    assert repaired('{"ids": [1, 2, 3')[0] == {'ids': [1, 2]}
+    assert repaired('{"names": ["a", "b')[0] == {'names': ['a']}
+
+
+def test_plan_is_extracted_when_the_object_is_broken():
+    text = 'I will now plan. "executable_plan": [%s, {"action_id": 17, "action_name": "x"}, {"action_id": 1' % STEP
+    obj, repairs = loads_tolerant(text)
+    assert obj['executable_plan'] == [json.loads(STEP), {'action_id': 17, 'action_name': 'x'}]
+    assert repairs['plan_extracted'] == 1
+
+
+def test_unrecoverable_output_raises():
+    with pytest.raises(json.JSONDecodeError):
+        loads_tolerant('no json here')
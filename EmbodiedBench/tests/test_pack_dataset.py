@@ -0,0 +1,115 @@
+"""
+pack_dataset.py on a synthetic split: the packed episode read back through
+VLM_dataset must give the arrays get_stored_demos loaded, only the cameras the
+dataset loads are packed, and an episode missing one of their images is left
+out of the pack instead of aborting it.
+"""
+import os
+import sys
+import pickle
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+EB_MANIPULATION = os.path.join(os.path.dirname(__file__), '..', 'embodiedbench', 'envs', 'eb_manipulation')
+sys.path.insert(0, os.path.abspath(EB_MANIPULATION))
+# needs the amsolver simulator stack (pyrep, open3d, ...) and torch
+pack_dataset = pytest.importorskip("vlm.scripts.pack_dataset")
+VLM_dataset = pytest.importorskip("vlm.scripts.VLDataloader").VLM_dataset
+
+IMG_SIZE = (8, 8)
+UNUSED = ['overhead']
+WAYPOINTS = ['waypoint0', 'waypoint0', 'waypoint1', 'waypoint2', 'waypoint2']
+
+
+def episode_dir(root, name):
+    return Path(root) / 'train' / 'pick_cube_shape' / 'variation0' / 'episodes' / name
+
+
+def make_observation(seed, waypoint, views, missing=()):
+    rng = np.random.RandomState(seed)
+    obs = SimpleNamespace(object_informations={'cube': {'pose': [seed, 0, 0]}}, current_waypoint_name=waypoint)
+    for view in pack_dataset.PACKED_VIEWS:
+        loaded = view in views
+        obs.__dict__['{}_rgb'.format(view)] = rng.randint(0, 255, IMG_SIZE + (3,)).astype(np.uint8) if loaded else None
+        obs.__dict__['{}_depth'.format(view)] = rng.rand(*IMG_SIZE).astype(np.float32) if loaded else None
+        obs.__dict__['{}_point_cloud'.format(view)] = rng.rand(*IMG_SIZE, 3).astype(np.float32) if loaded else None
+    for name in missing:
+        obs.__dict__[name] = None
+    return obs
+
+
+@pytest.fixture
+def split(tmp_path, monkeypatch):
+    views = [v for v in pack_dataset.PACKED_VIEWS if v not in UNUSED]
+    demos = {
+        'episode0': [make_observation(i, w, views) for i, w in enumerate(WAYPOINTS)],
+        'episode1': [make_observation(10 + i, w, views, missing=['left_shoulder_rgb'] if i == 2 else ())
+                     for i, w in enumerate(WAYPOINTS)],
+    }
+    for name, observations in demos.items():
+        path = episode_dir(tmp_path, name)
+        path.mkdir(parents=True)
+        low_dim = SimpleNamespace(_observations=[SimpleNamespace(current_waypoint_name=o.current_waypoint_name)
+                                                 for o in observations],
+                                  high_level_instructions=['pick up the cube'])
+        with open(path / 'low_dim_obs.pkl', 'wb') as f:
+            pickle.dump(low_dim, f)
+
+    def get_stored_demos(amount, image_paths, dataset_root, variation_number, task_name, obs_config,
+                         episode_number, fail_demos, selected_frame=None):
+        return [SimpleNamespace(_observations=demos[episode_number])]
+
+    monkeypatch.setattr(pack_dataset, 'get_stored_demos', get_stored_demos)
+    return tmp_path, demos
+
+
+def test_packed_episode_reads_back_through_the_dataset(split):
+    root, demos = split
+    dataset = VLM_dataset(str(root), 'train', img_size=IMG_SIZE, unused_camera_list=UNUSED,
+                          preprocess=False, use_fail_cases=False)
+    assert pack_dataset.pack_dataset(dataset, str(root / 'packed' / 'train'), shard_rows=2) == 1
+
+    packed = VLM_dataset(str(root), 'train', img_size=IMG_SIZE, unused_camera_list=UNUSED,
+                         preprocess=False, use_fail_cases=False, packed_dir=str(root / 'packed'))
+    assert packed.packed.views == [v for v in pack_dataset.PACKED_VIEWS if v not in UNUSED]
+    episodes = [str(e) for e in packed.episode_list]
+    packed_episode = next(e for e in episodes if e.endswith('episode0'))
+    assert packed_episode in packed.packed
+    assert not any(e.endswith('episode1') and e in packed.packed for e in episodes)
+
+    seen = {}
+
+    def get_cliport_gt(data, languages, episode):
+        seen.update(data=data, languages=languages)
+        return {'valid': True}
+
+    packed.get_cliport_gt = get_cliport_gt
+    assert packed[episodes.index(packed_episode)] == {'valid': True}
+    assert seen['languages'] == ['pick up the cube']
+    assert packed.all_waypoints == ['waypoint0', 'waypoint1', 'waypoint2']
+
+    expected = [demos['episode0'][i] for i in (0, 2, 3)]
+    assert len(seen['data']) == len(expected)
+    for got, want in zip(seen['data'], expected):
+        assert got.current_waypoint_name == want.current_waypoint_name
+        assert got.object_informations == want.object_informations
+        for view in pack_dataset.PACKED_VIEWS:
+            for field in pack_dataset.PACKED_FIELDS:
+                name = '{}_{}'.format(view, field)
+                if view in UNUSED:
+                    assert getattr(got, name) is None
+                else:
+                    np.testing.assert_array_equal(getattr(got, name), getattr(want, name))
+
+
+def test_dataset_rejects_a_pack_without_its_cameras(split):
+    root, _ = split
+    dataset = VLM_dataset(str(root), 'train', img_size=IMG_SIZE, unused_camera_list=UNUSED,
+                          preprocess=False, use_fail_cases=False)
+    pack_dataset.pack_dataset(dataset, str(root / 'packed' / 'train'))
+    with pytest.raises(ValueError):
+        VLM_dataset(str(root), 'train', img_size=IMG_SIZE, unused_camera_list=[],
+                    preprocess=False, use_fail_cases=False, packed_dir=str(root / 'packed'))
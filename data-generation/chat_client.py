@@ -0,0 +1,331 @@
+"""
+Shared pieces of the data-generation pipelines.
+
+- AsyncChatClient: one pooled aiohttp session to an OpenAI-compatible chat
+  completions endpoint (the vLLM server started by generate_process_reasoning_fin.sh),
+  with a bound on in-flight requests and retries with exponential backoff.
+- RequestStats: request latency and throughput, reported at the end of a run.
+- iter_dataset: reads a JSON array or JSONL dataset one entry at a time.
+- JsonlCheckpoint: appends finished records to a JSONL file keyed by entry id,
+  so a rerun skips the entries that are already done.
+- ImagePayloadCache: base64 payloads of (optionally resized) images keyed by
+  their content, so frames repeated across steps, entries and runs are encoded once.
+"""
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+DEFAULT_API_URL = "http://0.0.0.0:8000/v1/chat/completions"
+
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.time()
+        self.latencies = []
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.completion_tokens = 0
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        latencies = sorted(self.latencies)
+        summary = {
+            'requests': self.requests,
+            'failures': self.failures,
+            'retries': self.retries,
+            'elapsed_seconds': round(elapsed, 2),
+            'requests_per_second': round(len(latencies) / elapsed, 3) if elapsed > 0 else 0.0,
+            'completion_tokens_per_second': round(self.completion_tokens / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        for p in (50, 90, 99):
+            summary[f'p{p}_latency_seconds'] = round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))], 3) if latencies else None
+        return summary
+
+
+class AsyncChatClient:
+    def __init__(self, api_url=DEFAULT_API_URL, model="qwen2vl", api_key="sk-111", max_in_flight=100,
+                 timeout=30, retries=3, retry_delay=1):
+        """
+        Args:
+            max_in_flight (int): requests sent to the server at the same time; also the connection pool size
+            timeout (float): seconds per request attempt
+            retries (int): attempts after the first one, on connection errors, timeouts and 429/5xx
+            retry_delay (float): seconds before the first retry, doubled on each further one
+        """
+        self.api_url = api_url
+        self.model = model
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.stats = RequestStats()
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"},
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.stats = RequestStats()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._session.close()
+
+    async def chat(self, messages, max_tokens=300, temperature=0.7, top_p=0.9):
+        """Content of the first choice; raises once the retries are used up."""
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+        }
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                self.stats.requests += 1
+                start = time.time()
+                try:
+                    async with self._session.post(self.api_url, json=payload) as response:
+                        if response.status in RETRY_STATUS:
+                            raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                              status=response.status, message=response.reason)
+                        response.raise_for_status()
+                        result = await response.json(content_type=None)
+                    self.stats.latencies.append(time.time() - start)
+                    self.stats.completion_tokens += result.get("usage", {}).get("completion_tokens", 0)
+                    return result["choices"][0]["message"]["content"].strip()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retryable = not isinstance(e, aiohttp.ClientResponseError) or e.status in RETRY_STATUS
+                    if not retryable or attempt == self.retries:
+                        self.stats.failures += 1
+                        raise Exception(f"Failing after {attempt} retries: {type(e).__name__}: {e}")
+                    self.stats.retries += 1
+                    await asyncio.sleep(self.retry_delay * (2 ** attempt))
+
+
+def iter_dataset(path, chunk_size=1 << 20):
+    """Entries of a JSON array file, or of a JSONL file, without loading the whole file."""
+    with open(path) as f:
+        head = f.read(chunk_size)
+        stripped = head.lstrip()
+        if not stripped.startswith('['):
+            for line in (head + f.readline()).splitlines():
+                if line.strip():
+                    yield json.loads(line)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = stripped[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']') or (not buffer and eof):
+                return
+            try:
+                entry, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield entry
+            buffer = buffer[end:]
+            if not buffer and not eof:
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = chunk
+
+
+def entry_id(entry):
+    """The entry's own id if it has one, else a hash of its content."""
+    if isinstance(entry, dict) and entry.get("id") is not None:
+        return str(entry["id"])
+    return hashlib.sha1(json.dumps(entry, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class JsonlCheckpoint:
+    def __init__(self, path, key="id"):
+        """Records already in path (a partial last line from a crash is ignored) count as done."""
+        self.path = path
+        self.key = key
+        self.done = set()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            complete = data[:data.rfind(b'\n') + 1]
+            for line in complete.splitlines():
+                if line.strip():
+                    self.done.add(json.loads(line)[key])
+            if len(complete) < len(data):
+                with open(path, 'r+b') as f:
+                    f.truncate(len(complete))
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, record_id):
+        return record_id in self.done
+
+    def append(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self.done.add(record[self.key])
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def records(self):
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class ImagePayloadCache:
+    def __init__(self, max_bytes=512 << 20, cache_dir=None, max_side=None):
+        """
+        Args:
+            max_bytes (int): memory budget of the encoded payloads, least recently used ones are dropped first
+            cache_dir (str): optional on-disk tier, kept across runs
+            max_side (int): shrink images whose longer side exceeds this before encoding (needs PIL); None sends the file as is
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_side = max_side
+        self.variant = f"max{max_side}" if max_side else "raw"
+        self._payloads = OrderedDict()
+        self._bytes = 0
+        self._digests = {}  # (path, size, mtime) -> content hash, to skip hashing files seen before
+        self._encoding = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def encode(self, image_path):
+        """Base64 payload of the image; safe to call from several threads."""
+        st = os.stat(image_path)
+        file_key = (image_path, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(file_key)
+        data = None
+        if digest is None:
+            with open(image_path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha1(data).hexdigest()
+            with self._lock:
+                self._digests[file_key] = digest
+
+        while True:
+            with self._lock:
+                payload = self._payloads.get(digest)
+                if payload is not None:
+                    self._payloads.move_to_end(digest)
+                    self.hits += 1
+                    return payload
+                pending = self._encoding.get(digest)
+                if pending is None:
+                    pending = self._encoding[digest] = threading.Event()
+                    break
+            # another thread is encoding the same content
+            pending.wait()
+
+        try:
+            payload = self._load(digest)
+            if payload is None:
+                if data is None:
+                    with open(image_path, "rb") as f:
+                        data = f.read()
+                payload = base64.b64encode(self._resize(data)).decode('utf-8')
+                self._store(digest, payload)
+            self._remember(digest, payload)
+            return payload
+        finally:
+            with self._lock:
+                del self._encoding[digest]
+            pending.set()
+
+    def _resize(self, data):
+        if not self.max_side:
+            return data
+        from PIL import Image
+        image = Image.open(io.BytesIO(data))
+        if max(image.size) <= self.max_side:
+            return data
+        image.thumbnail((self.max_side, self.max_side))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def _disk_path(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}_{self.variant}.b64")
+
+    def _load(self, digest):
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(digest)) as f:
+                    payload = f.read()
+                with self._lock:
+                    self.disk_hits += 1
+                return payload
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _store(self, digest, payload):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+
+    def _remember(self, digest, payload):
+        with self._lock:
+            if digest in self._payloads or len(payload) > self.max_bytes:
+                return
+            self._payloads[digest] = payload
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes:
+                _, dropped = self._payloads.popitem(last=False)
+                self._bytes -= len(dropped)
+
+    def summary(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'lookups': lookups,
+            'memory_hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            'cached_mb': round(self._bytes / (1 << 20), 1),
+        }
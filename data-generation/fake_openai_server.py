@@ -0,0 +1,83 @@
+"""
+Local stand-in for the vLLM OpenAI-compatible server, to try the data-generation
+pipelines without GPUs. Every chat completion returns a short canned answer after
+a configurable latency; a fraction of the requests can fail with 503.
+
+    python fake_openai_server.py --port 8001 --latency_ms 500 --fail_rate 0.05
+    python generate_enhanced_instructions.py --input data.json --output_dir out \
+        --api_url http://127.0.0.1:8001/v1/chat/completions
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.requests += 1
+        time.sleep(max(0.0, random.gauss(server.latency, server.jitter)))
+        if random.random() < server.fail_rate:
+            self._send(503, {'error': 'fake overload'})
+            return
+        request = json.loads(body)
+        text = next(part['text'] for part in request['messages'][-1]['content'] if part['type'] == 'text')
+        answer = f"Reasoning: fake answer to a {len(text)} character prompt.\nAction: done"
+        self._send(200, {
+            'id': f'fake-{server.requests}',
+            'object': 'chat.completion',
+            'model': request.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(text) // 4, 'completion_tokens': len(answer) // 4},
+        })
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        try:
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up on the request, e.g. a killed run
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port=0, latency_ms=200, jitter_ms=50, fail_rate=0.0):
+    """Serve on a background thread; returns the server, whose server_address holds the port."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeChatHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.jitter = jitter_ms / 1000
+    server.fail_rate = fail_rate
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="fake OpenAI-compatible chat completions server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency_ms", type=float, default=200)
+    parser.add_argument("--jitter_ms", type=float, default=50)
+    parser.add_argument("--fail_rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = start_server(args.port, args.latency_ms, args.jitter_ms, args.fail_rate)
+    print(f"Serving fake chat completions on http://127.0.0.1:{server.server_address[1]}/v1/chat/completions")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,36 +1,19 @@
+import os
 import json
 import time
-import base64
-import requests
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import argparse
 from tqdm import tqdm
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-
-def create_retry_session(retries=5, backoff_factor=1):
-    session = requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-        status_forcelist=[500, 502, 503, 504],
-        allowed_methods=frozenset(['POST'])
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
+from chat_client import AsyncChatClient, ImagePayloadCache, JsonlCheckpoint, DEFAULT_API_URL, iter_dataset, entry_id
 
-def image_to_base64(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+_image_cache = ImagePayloadCache()
 
-def enhance_instruction(data_entry, max_retries=3, retry_delay=1):
-    human_instruction = data_entry["conversations"][0]["value"]
-    image_url = data_entry["images"][-1]
 
-    messages = [
+def image_to_base64(image_path):
+    return _image_cache.encode(image_path)
+
+def build_messages(human_instruction, image_base64):
+    return [
         {
             "role": "user",
             "content": [
@@ -56,62 +39,24 @@ Enhanced: """
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{image_to_base64(image_url)}"
+                        "url": f"data:image/png;base64,{image_base64}"
                     }
                 }
             ]
         }
     ]
 
-    # 使用带重试的Session
-    session = create_retry_session()
-    
-    for attempt in range(max_retries + 1):
-        try:
-            response = session.post(
-                "http://0.0.0.0:8000/v1/chat/completions",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer sk-111"
-                },
-                json={
-                    "model": "qwen2vl",
-                    "messages": messages,
-                    "max_tokens": 300,
-                    "temperature": 0.7,
-                    "top_p": 0.9
-                },
-                timeout=30
-            )
-            response.raise_for_status()  
-            return response.json()["choices"][0]["message"]["content"].strip()
-            
-        except Exception as e:
-            if attempt < max_retries:
-                wait_time = retry_delay * (2 ** attempt)  
-                print(f"Attempt {attempt+1}/{max_retries} fails: retrying after {str(e)}，{wait_time} seconds...")
-                time.sleep(wait_time)
-            else:
-                raise Exception(f"Failing after {max_retries} retries: {str(e)}")
-
-def process_entry(entry):
-    try:
-        enhanced = enhance_instruction(entry)
-        return {
-            "original": entry["conversations"][0]["value"],
-            "enhanced": enhanced,
-            "image": entry["images"][-1]
-        }
-    except Exception as e:
-        print(f"Final failure: {str(e)}")
-        return None
-
-json_list = ["path/to/data"]
+async def enhance_instruction(client, data_entry):
+    human_instruction = data_entry["conversations"][0]["value"]
+    # file reads stay off the event loop
+    image_base64 = await asyncio.to_thread(image_to_base64, data_entry["images"][-1])
+    return await client.chat(build_messages(human_instruction, image_base64))
 
-def process_entry(entry):
+async def process_entry(client, entry, record_id):
     try:
-        enhanced = enhance_instruction(entry)
+        enhanced = await enhance_instruction(client, entry)
         return {
+            "id": record_id,
             "original": entry["conversations"][0]["value"],
             "enhanced": enhanced,
             "image": entry["images"][-1]
@@ -120,35 +65,88 @@ def process_entry(entry):
         print(f"Failure: {str(e)}")
         return None
 
-for path in json_list:
-    name = path.split("/")[-1].split(".")[0]
-    with open(path) as f:
-        dataset = json.load(f)
-
-    enhanced_data = []
-    failed_count = 0
-
-    with ThreadPoolExecutor(max_workers=100) as executor: 
-        futures = [executor.submit(process_entry, entry) for entry in dataset]
-        
-        progress = tqdm(total=len(futures), desc=f"Processing {name}", ncols=100)
-        for future in futures:
-            result = future.result()
+async def process_dataset(client, path, checkpoint, max_pending):
+    """Stream the entries of path through the client, appending each result to the checkpoint as it completes."""
+    name = os.path.basename(path).split(".")[0]
+    success, failed_count, skipped = 0, 0, 0
+    pending = set()
+    queued = set()
+    progress = tqdm(desc=f"Processing {name}", ncols=100)
+
+    def collect(done):
+        nonlocal success, failed_count
+        for task in done:
+            result = task.result()
             if result:
-                enhanced_data.append(result)
+                checkpoint.append(result)
+                success += 1
             else:
                 failed_count += 1
             progress.update()
-        progress.close()
-
-    print(f"Success {len(enhanced_data)} ,Failure {failed_count} ")
-
-    save_path = f"path/to/save"
 
+    for entry in iter_dataset(path):
+        record_id = entry_id(entry)
+        if record_id in checkpoint or record_id in queued:
+            skipped += 1
+            continue
+        queued.add(record_id)
+        pending.add(asyncio.create_task(process_entry(client, entry, record_id)))
+        if len(pending) >= max_pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            collect(done)
+    if pending:
+        done, _ = await asyncio.wait(pending)
+        collect(done)
+    progress.close()
+    # failed entries are not in the checkpoint file, the next run retries them
+    print(f"Success {success} ,Failure {failed_count}, Skipped (already done) {skipped}")
+
+def export_json(path, checkpoint, save_path):
+    """Write the finished records as one JSON list in dataset order, like the old output."""
+    records = {r["id"]: r for r in checkpoint.records()}
+    enhanced_data = []
+    for entry in iter_dataset(path):
+        record = records.pop(entry_id(entry), None)
+        if record is not None:
+            enhanced_data.append({k: v for k, v in record.items() if k != "id"})
     with open(save_path, "w") as f:
         json.dump(enhanced_data, f, indent=2)
     print(f"Saving to {save_path}")
 
-
-
-    
\ No newline at end of file
+async def main(args):
+    global _image_cache
+    os.makedirs(args.output_dir, exist_ok=True)
+    _image_cache = ImagePayloadCache(args.image_cache_mb << 20, args.image_cache_dir, args.image_max_side)
+    async with AsyncChatClient(args.api_url, args.model, max_in_flight=args.max_in_flight,
+                               timeout=args.timeout, retries=args.retries) as client:
+        for path in args.input:
+            name = os.path.basename(path).split(".")[0]
+            checkpoint = JsonlCheckpoint(os.path.join(args.output_dir, f"{name}_enhanced.jsonl"))
+            try:
+                # keep a few entries ready beyond the in-flight ones so the server never idles
+                await process_dataset(client, path, checkpoint, max_pending=2 * args.max_in_flight)
+            finally:
+                checkpoint.close()
+            if args.export_json:
+                export_json(path, checkpoint, os.path.join(args.output_dir, f"{name}_enhanced.json"))
+
+        stats = client.stats.summary()
+    stats['image_cache'] = _image_cache.summary()
+    print("Request stats: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+    with open(os.path.join(args.output_dir, f"stats_{int(time.time())}.json"), "w") as f:
+        json.dump(stats, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enhance instructions with a vLLM-served model, resuming from earlier runs.")
+    parser.add_argument("--input", nargs="+", default=["path/to/data"], help="JSON list or JSONL datasets")
+    parser.add_argument("--output_dir", default="path/to/save", help="where <name>_enhanced.jsonl is appended to")
+    parser.add_argument("--api_url", default=DEFAULT_API_URL)
+    parser.add_argument("--model", default="qwen2vl")
+    parser.add_argument("--max_in_flight", type=int, default=100, help="concurrent requests to the server")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds per request attempt")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--image_cache_dir", default=None, help="keep encoded images on disk for later runs")
+    parser.add_argument("--image_cache_mb", type=int, default=512, help="memory for encoded images")
+    parser.add_argument("--image_max_side", type=int, default=None, help="shrink larger images before sending them")
+    parser.add_argument("--export_json", type=int, default=1, help="also write <name>_enhanced.json in dataset order at the end")
+    asyncio.run(main(parser.parse_args()))
@@ -1,37 +1,24 @@
-import base64
-import json
-import requests
+import os
 import copy
+import json
+import heapq
+import asyncio
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from chat_client import AsyncChatClient, ImagePayloadCache, JsonlCheckpoint, DEFAULT_API_URL, iter_dataset, entry_id
 
-_session = requests.Session()
-
-# HTTP retry
-retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-_session.mount('http://', HTTPAdapter(max_retries=retries))
-_session.mount('https://', HTTPAdapter(max_retries=retries))
+_image_cache = ImagePayloadCache()
 
 def image_to_base64(image_path):
     """img2base64"""
-    
+
     try:
-        with open(image_path, "rb") as image_file:
-            encoded = base64.b64encode(image_file.read()).decode('utf-8')
-            # _image_cache[image_path] = encoded
-            return encoded
+        return _image_cache.encode(image_path)
     except Exception as e:
         print(f"img faliure: {image_path} - {str(e)}")
         return ""
 
-def generate_reasoning(user_instruction, previous_steps, current_image, original_action):
-    image_base64 = image_to_base64(current_image)
-    if not image_base64:
-        return ""
-
-    messages = [
+def build_messages(user_instruction, previous_steps, image_base64, original_action):
+    return [
         {
             "role": "user",
             "content": [
@@ -65,97 +52,183 @@ Enhanced data:
         }
     ]
 
-    try:
-        response = _session.post(
-            "http://0.0.0.0:8000/v1/chat/completions",
-            headers={"Content-Type": "application/json", "Authorization": "Bearer sk-111"},
-            json={
-                "model": "qwen2vl",
-                "messages": messages,
-                "max_tokens": 300,
-                "temperature": 0.7,
-                "top_p": 0.9
-            },
-            # timeout=30
-        )
-        return response.json()["choices"][0]["message"]["content"].strip()
-    except Exception as e:
-        print(f"API failure: {str(e)}")
-        return ""
+async def generate_reasoning(client, user_instruction, previous_steps, current_image, original_action):
+    image_base64 = await asyncio.to_thread(image_to_base64, current_image)
+    if not image_base64:
+        # fail the step rather than log an empty reasoning, so a rerun retries it
+        raise RuntimeError(f"could not encode image {current_image}")
+    return await client.chat(build_messages(user_instruction, previous_steps, image_base64, original_action))
 
-def process_single_entry(entry):
-    """single process"""
-    try:
-        modified_entry = copy.deepcopy(entry)
-        conversations = modified_entry["conversations"]
-        images = modified_entry["images"]
-        
-        previous_steps = []
-        image_index = 0
-        
-        for i, msg in enumerate(conversations):
+
+class EntryChain:
+    """The steps of one entry; step k can only be rewritten once steps 0..k-1 are."""
+
+    def __init__(self, entry, order):
+        self.entry = entry
+        self.id = entry_id(entry)
+        self.order = order
+        self.steps = []  # (conversation index, image, original action)
+        images = entry["images"]
+        for i, msg in enumerate(entry["conversations"]):
             if msg["from"] == "gpt" and "Reasoning:" in msg["value"]:
-                if image_index >= len(images):
+                if len(self.steps) >= len(images):
                     break
-                
-                original_action = msg["value"].split("Action: ")[-1].strip()
-                current_image = images[image_index]
-                image_index += 1
-                
-                new_reasoning = generate_reasoning(
-                    conversations[0]["value"],
-                    "\n".join(previous_steps),
-                    current_image,
-                    original_action
-                )
-                
-                new_reasoning = new_reasoning.replace("Reasoning:", "").split("Action:")[0].strip()
-                
-                msg["value"] = f"Reasoning: {new_reasoning}\nAction: {original_action}"
-                previous_steps.append(f"Reasoning: {new_reasoning} Action: {original_action}")
-        
+                self.steps.append((i, images[len(self.steps)], msg["value"].split("Action: ")[-1].strip()))
+        self.reasonings = []
+
+    @property
+    def remaining(self):
+        return len(self.steps) - len(self.reasonings)
+
+    def next_request(self):
+        _, image, original_action = self.steps[len(self.reasonings)]
+        previous_steps = "\n".join(f"Reasoning: {r} Action: {self.steps[k][2]}" for k, r in enumerate(self.reasonings))
+        return self.entry["conversations"][0]["value"], previous_steps, image, original_action
+
+    def add(self, new_reasoning):
+        self.reasonings.append(new_reasoning.replace("Reasoning:", "").split("Action:")[0].strip())
+
+    def result(self):
+        modified_entry = copy.deepcopy(self.entry)
+        conversations = modified_entry["conversations"]
+        for (i, _, original_action), reasoning in zip(self.steps, self.reasonings):
+            conversations[i]["value"] = f"Reasoning: {reasoning}\nAction: {original_action}"
         return modified_entry
-    except Exception as e:
-        print(f"Failure: {str(e)}")
-        return None
-
-def process_dataset(subset_name):
-    json_list = ["path/to/data"]
-
-    for path in json_list:
-        try:
-            with open(path) as f:
-                dataset = json.load(f)
-        except Exception as e:
-            print(f"file loading failure: {path} - {str(e)}")
-            continue
 
-        enhanced_data = []
-        with ThreadPoolExecutor(max_workers=20) as executor:  
-            futures = [executor.submit(process_single_entry, entry) for entry in dataset]
-            
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    enhanced_data.append(result)
-                    if len(enhanced_data) % 10 == 0: 
-                        print(f"Processed {len(enhanced_data)}/{len(dataset)} data")
-
-        # 保存结果
-        output_path = f"path/to/data"
-        with open(output_path, "w") as f:
-            json.dump(enhanced_data, f, indent=2)
-        print(f"Saved to {output_path}")
+
+class StepScheduler:
+    """
+    Runs the (entry, step) requests of many entries against one server. A step is
+    ready once the previous step of its entry is done; among ready steps the entry
+    with the longest remaining chain goes first, so long entries start early instead
+    of trailing at the end. Up to max_in_flight requests are kept running. Every
+    finished step is appended to step_log and every finished entry to done_log.
+    """
+
+    def __init__(self, client, step_log, done_log, max_in_flight=20):
+        self.client = client
+        self.step_log = step_log
+        self.done_log = done_log
+        self.max_in_flight = max_in_flight
+        self.steps_done = 0
+        self.entries_done = 0
+        self.entries_failed = 0
+        self._in_flight_samples = []
+
+    async def run(self, chains):
+        ready = [(-c.remaining, c.order, c) for c in chains]
+        heapq.heapify(ready)
+        running = {}
+        while ready or running:
+            while ready and len(running) < self.max_in_flight:
+                _, _, chain = heapq.heappop(ready)
+                running[asyncio.create_task(generate_reasoning(self.client, *chain.next_request()))] = chain
+            self._in_flight_samples.append(len(running))
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                chain = running.pop(task)
+                try:
+                    new_reasoning = task.result()
+                except Exception as e:
+                    # the entry stops here; its finished steps are kept and a rerun continues from this step
+                    print(f"Failure: {chain.id} step {len(chain.reasonings)}: {str(e)}")
+                    self.entries_failed += 1
+                    continue
+                chain.add(new_reasoning)
+                self.step_log.append({"key": f"{chain.id}/{len(chain.reasonings) - 1}", "id": chain.id,
+                                      "step": len(chain.reasonings) - 1, "reasoning": chain.reasonings[-1]})
+                self.steps_done += 1
+                if chain.remaining:
+                    heapq.heappush(ready, (-chain.remaining, chain.order, chain))
+                else:
+                    self.finish(chain)
+                    if self.entries_done % 10 == 0:
+                        print(f"Processed {self.entries_done} entries, {self.steps_done} steps")
+
+    def finish(self, chain):
+        self.done_log.append({"id": chain.id, "entry": chain.result()})
+        self.entries_done += 1
+
+    def summary(self):
+        samples = self._in_flight_samples
+        return {
+            'entries_done': self.entries_done,
+            'entries_failed': self.entries_failed,
+            'steps_done': self.steps_done,
+            'mean_in_flight': round(sum(samples) / len(samples), 2) if samples else 0.0,
+        }
+
+
+def load_chains(path, step_log, done_log):
+    """Entries of path that are not finished yet, with the steps already rewritten in earlier runs restored."""
+    finished_steps = {}
+    for record in step_log.records():
+        finished_steps.setdefault(record["id"], {})[record["step"]] = record["reasoning"]
+    chains = []
+    seen = set()
+    for order, entry in enumerate(iter_dataset(path)):
+        chain = EntryChain(entry, order)
+        if chain.id in done_log or chain.id in seen:
+            continue
+        seen.add(chain.id)
+        restored = finished_steps.get(chain.id, {})
+        while len(chain.reasonings) in restored and chain.remaining:
+            chain.reasonings.append(restored[len(chain.reasonings)])
+        chains.append(chain)
+    return chains
+
+async def process_dataset(args):
+    global _image_cache
+    json_list = args.input
+    _image_cache = ImagePayloadCache(args.image_cache_mb << 20, args.image_cache_dir, args.image_max_side)
+
+    async with AsyncChatClient(args.api_url, args.model, max_in_flight=args.max_in_flight, timeout=args.timeout) as client:
+        for path in json_list:
+            name = f"{args.subset}_{os.path.basename(path).split('.')[0]}"
+            step_log = JsonlCheckpoint(os.path.join(args.output_dir, f"{name}_steps.jsonl"), key="key")
+            done_log = JsonlCheckpoint(os.path.join(args.output_dir, f"{name}_rewritten.jsonl"))
+            try:
+                chains = load_chains(path, step_log, done_log)
+                scheduler = StepScheduler(client, step_log, done_log, args.max_in_flight)
+                for chain in chains:
+                    if not chain.remaining:
+                        scheduler.finish(chain)
+                chains = [c for c in chains if c.remaining]
+                print(f"{name}: {len(done_log.done)} entries done before, {len(chains)} to go, {sum(c.remaining for c in chains)} steps")
+                await scheduler.run(chains)
+            finally:
+                step_log.close()
+                done_log.close()
+            print(f"Scheduler stats: {scheduler.summary()}")
+
+            # 保存结果
+            entries = {r["id"]: r["entry"] for r in done_log.records()}
+            enhanced_data = [entries[entry_id(entry)] for entry in iter_dataset(path) if entry_id(entry) in entries]
+            output_path = os.path.join(args.output_dir, f"{name}_rewritten.json")
+            with open(output_path, "w") as f:
+                json.dump(enhanced_data, f, indent=2)
+            print(f"Saved to {output_path}")
+        print(f"Request stats: {client.stats.summary()}")
+    print(f"Image cache: {_image_cache.summary()}")
 
 def main():
     """argparse"""
     parser = argparse.ArgumentParser(description="tool")
     parser.add_argument("--subset", "-s", required=True, help="subset name")
+    parser.add_argument("--input", nargs="+", default=["path/to/data"], help="JSON list or JSONL datasets")
+    parser.add_argument("--output_dir", default="path/to/data", help="step progress, finished entries and the final json go here")
+    parser.add_argument("--api_url", default=DEFAULT_API_URL)
+    parser.add_argument("--model", default="qwen2vl")
+    parser.add_argument("--max_in_flight", type=int, default=20, help="requests kept running across all entries")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds per request attempt")
+    parser.add_argument("--image_cache_dir", default=None, help="keep encoded images on disk for later runs")
+    parser.add_argument("--image_cache_mb", type=int, default=512, help="memory for encoded images")
+    parser.add_argument("--image_max_side", type=int, default=None, help="shrink larger images before sending them")
     args = parser.parse_args()
-    
+
     print(f"Processing {args.subset} subset")
-    process_dataset(args.subset)
+    asyncio.run(process_dataset(args))
     print("Finish")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()